@@ -8,6 +8,12 @@ import inspect
 
 from .util import *
 from .core import *
+from .search import *
+from .pipeline import *
+from .shard import *
+from .crawl import *
+from .daemon import *
+from .worlds import *
 from .asset_cache import *
 from .qt_gui import *
 
@@ -258,3 +258,162 @@ class AssetCache(object):
         pass
     pass
 
+
+#
+# thumbnails
+#
+# The images we cache are the original avatars, but we only ever display
+# them at a couple of fixed sizes.  Scale each image once, in a worker
+# process, and keep the result next to the original:
+#
+#   .image-cache/<key>
+#   .image-cache/thumb-128/<key>
+#   .image-cache/thumb-48/<key>
+#
+THUMB_SIZES = (128, 48)
+
+
+def thumb_path(path, size):
+    """Construct the thumbnail path for the image at `path`."""
+    head, tail = os.path.split(path)
+    return os.path.join(head, f'thumb-{size}', tail)
+
+
+def make_thumbs(path, sizes=THUMB_SIZES):
+    """Generate the thumbnails for the image at `path`.
+    This is run in a worker process, so must be picklable (top level).
+    Returns the list of thumbnail paths generated.
+    """
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QImage
+
+    img = QImage(path)
+    if img.isNull():
+        return []
+
+    # keep the format of the original, as its name says
+    fmt = os.path.splitext(path)[1][1:].upper() or 'PNG'
+    rv = []
+    for size in sizes:
+        dst = thumb_path(path, size)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if img.width() > size or img.height() > size:
+            thumb = img.scaled(size, size, Qt.KeepAspectRatio,
+                               Qt.SmoothTransformation)
+        else:
+            thumb = img
+            pass
+        # write then rename, so readers never see a partial file.
+        tmp = f'{dst}.{os.getpid()}.tmp'
+        if thumb.save(tmp, fmt, 90):
+            os.replace(tmp, dst)
+            rv.append(dst)
+            pass
+        pass
+    return rv
+
+
+class ThumbCache(object):
+    """Generate image thumbnails using a pool of worker processes."""
+
+    def __init__(self, path, sizes=THUMB_SIZES, workers=None):
+        self._path = path
+        self._sizes = tuple(sizes)
+        self._workers = workers
+        self._pool = None
+        self._pending = {}
+        self._mux = threading.Lock()
+        # ensure path has a trailing os.sep
+        if self._path[-1] != os.sep:
+            self._path += os.sep
+            pass
+        pass
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    def _executor(self):
+        if self._pool is None:
+            # spawned, not forked: we are called from a threaded Qt process
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            pass
+        return self._pool
+
+    def have(self, path):
+        """Predicate: all the thumbnails for `path` are extant."""
+        return all(os.path.isfile(thumb_path(path, s)) for s in self._sizes)
+
+    def lookup(self, path, size):
+        """Return the thumbnail path for `path` at `size`, or None."""
+        fna = thumb_path(path, size)
+        return fna if os.path.isfile(fna) else None
+
+    def submit(self, path):
+        """Queue up thumbnail generation for `path`.
+        Returns a Future, or None if there is nothing to do.
+        """
+        if self.have(path):
+            return None
+
+        self._mux.acquire()
+        fut = self._pending.get(path)
+        new = fut is None
+        if new:
+            fut = self._executor().submit(make_thumbs, path, self._sizes)
+            self._pending[path] = fut
+            pass
+        self._mux.release()
+        if new:
+            # may run immediately, so not while holding the lock.
+            fut.add_done_callback(lambda f: self._done(path))
+            pass
+        return fut
+
+    def _done(self, path):
+        self._mux.acquire()
+        self._pending.pop(path, None)
+        self._mux.release()
+        pass
+
+    def make(self, path):
+        """Generate the thumbnails for `path`, waiting for the result."""
+        fut = self.submit(path)
+        if fut is None:
+            return True
+        try:
+            return len(fut.result()) == len(self._sizes)
+        except Exception as e:
+            debug(1, f'thumbs: {path=} {e=}')
+            return False
+        pass
+
+    def populate(self):
+        """Generate any missing thumbnails for everything in the cache."""
+        todo = [self._path + f for f in os.listdir(self._path)
+                if os.path.isfile(self._path + f) and not f.endswith('.tmp')]
+        todo = [f for f in todo if not self.have(f)]
+        count = 0
+        for f in todo:
+            self.submit(f)
+            pass
+        for f in todo:
+            if self.make(f):
+                count += 1
+                pass
+            verbo(1, f'\rthumbs: {count} of {len(todo)}', end='')
+            pass
+        verbo(1, '') if todo else None
+        return count
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            pass
+        pass
+    pass
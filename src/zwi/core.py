@@ -6,23 +6,43 @@
 #
 """Zwi core stuff."""
 import os
-import urllib3
+import re
+import json
+import time
+import zlib
+import hashlib
+import importlib
+import threading
 import sqlite3 as sq
+from contextlib import contextmanager
 from datetime import datetime
-from dataclasses import dataclass, fields
-from .util import Error, debug, verbo, verbo_p
+from dataclasses import dataclass, field, fields
+from .util import Error, Log
+from .search import SearchIndex
+from .pipeline import Pipeline, Stage
 
-try:
-    import zwift
-    from zwift import Client
-    import keyring
-except Exception as __ex:
-    print('import error', __ex)
-    raise SystemExit('please run: pip3 install zwift-client keyring')
+
+def _import(name):
+    """Import `name`, one of the (slow to import) modules we need only to
+    talk to Zwift or the keyring, on first use."""
+    try:
+        return importlib.import_module(name)
+    except Exception as e:
+        print('import error', e)
+        raise SystemExit('please run: pip3 install zwift-client keyring')
+    pass
 
 # Cache of authentication, so we establish at most once
 _zwi_auth_cache = {}
 
+# the logs of our subsystems (see util.Log)
+_auth_log = Log('auth')     # logging in, and tokens
+_db_log = Log('db')         # SQL
+_data_log = Log('data')     # conversions of the ZwiBase dataclasses
+_user_log = Log('user')     # followers/followees
+_pro_log = Log('pro')       # profiles
+_graph_log = Log('graph')   # the follower graph
+
 
 def get_zdir(subdir: str = None, mkdir: bool = True) -> str:
     """Establish local Zwi directory."""
@@ -57,6 +77,7 @@ def get_zpath(dname: str = None, fname: str = None, subdir: str = None,
 
 def auth_user(key='zwi.py'):
     """Return the user ID saved."""
+    keyring = _import('keyring')
     try:
         name = keyring.get_password(key, 'username')
     except Exception as e:
@@ -69,6 +90,7 @@ def auth_user(key='zwi.py'):
 
 def auth_passwd(name, key='zwi.py'):
     """Return the password."""
+    keyring = _import('keyring')
     try:
         passwd = keyring.get_password(key, name)
     except Exception as e:
@@ -81,8 +103,10 @@ def auth_passwd(name, key='zwi.py'):
 
 def auth(name, password, key='zwi.py'):
     """Establish the authentication."""
+    (zwift, urllib3) = (_import('zwift'), _import('urllib3'))
+    keyring = _import('keyring')
     try:
-        cl = Client(name, password)
+        cl = zwift.Client(name, password)
         # there is no error checking in the above
         # but if I force a fetch as below, I can discover
         # if there are issues.
@@ -91,7 +115,7 @@ def auth(name, password, key='zwi.py'):
             estr = 'error'
             for k in ['error', 'error_description']:
                 if k in token_data:
-                    debug(1, f'{k:22} {token_data[k]}')
+                    _auth_log.debug(1, '%-22s %s', k, token_data[k])
                     estr += f': {token_data[k]}'
                 pass
             raise SystemExit(estr)
@@ -120,17 +144,23 @@ def auth(name, password, key='zwi.py'):
     if auth_passwd(name, key=key) != password:
         raise SystemExit('keyring password mismatch')
 
+    ZwiToken.clear(key)     # any cached token is for the old credentials
     return True
 
 
 def check(key='zwi.py'):
     """Verify that we have established the authentication."""
     (cl, pr) = zwi_init(key=key)
+    try:
+        pr.profile      # (a cached token need not have talked to Zwift)
+    except Exception as e:
+        raise SystemExit(f'Authentication failure: {e}')
     pass
 
 
 def clear(key='zwi.py'):
     """Clear out any saved authentication information."""
+    keyring = _import('keyring')
 
     try:
         name = keyring.get_password(key, 'username')
@@ -148,29 +178,179 @@ def clear(key='zwi.py'):
         except keyring.errors.KeyringError as e:
             raise SystemExit('Trying to delete username: ***keyring error:', e)
         pass
+    ZwiToken.clear(key)
     return
 
 
+class ZwiToken(object):
+    """Zwift auth tokens, cached between runs in ~/.zwi/<key>.token
+    (readable only by us), along with the user name and player ID, so a
+    run need not log in.  The access token is refreshed when it is near
+    expiry, using the refresh token or, failing that, the password
+    (which is only then fetched from the keyring).
+    This stands in for the zwift.Client's AuthToken.
+    """
+
+    MARGIN = 60     # seconds before expiry to refresh the access token
+
+    # what we cache
+    FIELDS = ['username', 'player_id', 'access_token', 'refresh_token',
+              'access_token_expiration', 'refresh_token_expiration']
+
+    URL = 'https://secure.zwift.com/auth/realms/zwift/tokens/access/codes'
+
+    def __init__(self, username, key='zwi.py', password=None):
+        self.username = username
+        self.player_id = None
+        self.access_token = None
+        self.refresh_token = None
+        self.access_token_expiration = 0
+        self.refresh_token_expiration = 0
+        self._password = password
+        self._key = key
+        self._mux = threading.Lock()
+        pass
+
+    @property
+    def password(self):
+        if self._password is None:
+            self._password = auth_passwd(self.username, self._key)
+            pass
+        return self._password
+
+    @staticmethod
+    def path(key='zwi.py'):
+        return get_zpath(fname=f'{key}.token')
+
+    @classmethod
+    def load(cls, key='zwi.py'):
+        """The cached token, or None if there is none still usable."""
+        try:
+            with open(cls.path(key)) as f:
+                d = json.load(f)
+                pass
+        except (OSError, ValueError):
+            return None
+        tok = cls(d.get('username'), key=key)
+        for k in cls.FIELDS:
+            setattr(tok, k, d.get(k))
+            pass
+        if tok.player_id is None or not tok.have_valid_refresh_token():
+            return None
+        return tok
+
+    def save(self):
+        """Write the cache, readable only by us."""
+        path = self.path(self._key)
+        tmp = f'{path}.{os.getpid()}'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict((k, getattr(self, k)) for k in self.FIELDS), f)
+            pass
+        os.replace(tmp, path)
+        pass
+
+    @classmethod
+    def clear(cls, key='zwi.py'):
+        try:
+            os.remove(cls.path(key))
+        except FileNotFoundError:
+            pass
+        pass
+
+    def expire(self):
+        """Zwift refused the access token: refresh it on next use."""
+        with self._mux:
+            self.access_token = None
+            pass
+        pass
+
+    def have_valid_access_token(self):
+        return (self.access_token is not None and
+                time.time() < self.access_token_expiration - self.MARGIN)
+
+    def have_valid_refresh_token(self):
+        return (self.refresh_token is not None and
+                time.time() < self.refresh_token_expiration)
+
+    def get_access_token(self):
+        with self._mux:     # (threads share the token)
+            if not self.have_valid_access_token():
+                self.update_token_data()
+                pass
+            return self.access_token
+        pass
+
+    def fetch_token_data(self):
+        """Ask Zwift for a token, by refresh token or else password."""
+        if self.have_valid_refresh_token():
+            data = {'refresh_token': self.refresh_token,
+                    'grant_type': 'refresh_token'}
+        else:
+            data = {'username': self.username, 'password': self.password,
+                    'grant_type': 'password'}
+            pass
+        data['client_id'] = 'Zwift_Mobile_Link'
+        return _import('requests').post(self.URL, data=data).json()
+
+    def update_token_data(self):
+        """Refresh the access token, and cache it."""
+        data = self.fetch_token_data()
+        if 'access_token' not in data and self.refresh_token is not None:
+            _auth_log.debug(1, 'token refresh refused: %s', data)
+            self.refresh_token = None   # log in afresh
+            data = self.fetch_token_data()
+            pass
+        if 'access_token' not in data:
+            err = data.get('error_description', data.get('error', data))
+            raise SystemExit(f'Authentication failure: {err}')
+        now = time.time()
+        self.access_token = data['access_token']
+        self.refresh_token = data.get('refresh_token')
+        self.access_token_expiration = now + data['expires_in'] - 5
+        self.refresh_token_expiration = now + data['refresh_expires_in'] - 5
+        self.save()
+        pass
+
+    pass
+
+
 def zwi_init(zid='me', key='zwi.py'):
-    """Initialise communications with Zwift API."""
+    """Initialise communications with Zwift API.
+    We log in only if there is no usable cached ZwiToken.
+    """
     global _zwi_auth_cache
 
-    if zid in _zwi_auth_cache:
-        v = _zwi_auth_cache[zid]
+    if (zid, key) in _zwi_auth_cache:
+        v = _zwi_auth_cache[(zid, key)]
         return v[0], v[1]
 
+    zwift = _import('zwift')
+    tok = ZwiToken.load(key)
+    if tok is not None:
+        cl = zwift.Client(tok.username, None)
+        cl.auth_token = tok
+        pr = cl.get_profile(tok.player_id)
+        _auth_log.debug(1, 'player_id: %s (cached)', pr.player_id)
+        _zwi_auth_cache[(zid, key)] = [cl, pr]
+        return cl, pr
+
     name = auth_user(key)
     if name:
         password = auth_passwd(name, key)
     else:
         raise SystemExit('User name not set -- re-run `auth`.')
 
+    urllib3 = _import('urllib3')
     try:
-        cl = Client(name, password)
+        cl = zwift.Client(name, password)
+        cl.auth_token = tok = ZwiToken(name, key=key, password=password)
         pr = cl.get_profile()
         pr.check_player_id()
-        debug(1, f'player_id: {pr.player_id}')
-        _zwi_auth_cache[zid] = [cl, pr]
+        _auth_log.debug(1, 'player_id: %s', pr.player_id)
+        tok.player_id = pr.player_id
+        tok.save()
+        _zwi_auth_cache[(zid, key)] = [cl, pr]
         return cl, pr
     except urllib3.exceptions.HTTPError as e:
         raise SystemExit(f'Cannot connect to Zwift: {e}')
@@ -182,12 +362,65 @@ def zwi_init(zid='me', key='zwi.py'):
     pass
 
 
+#
+# SQLite tuning profiles.
+#
+# safe:       the SQLite defaults.  Rollback journal, fsync on every commit.
+#             Survives power loss, but readers and a writer block each other.
+# concurrent: write-ahead log, so readers (eg. `zwibok`) run alongside a
+#             writer (eg. `zwi pro-update`).  synchronous=NORMAL only fsyncs
+#             at checkpoints: a power loss (not a crash of `zwi` itself) may
+#             lose the last few commits, but the DB remains consistent.
+# bulk:       for large syncs.  As for `concurrent`, but never fsyncs: a power
+#             loss or OS crash mid-sync can corrupt the DB, which then has
+#             to be rebuilt (`zwi reset`).  A crash of `zwi` itself is safe.
+#
+DB_PROFILES = {
+    'safe': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,            # KiB (the default)
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    'concurrent': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64*1024,         # 64MiB
+        'mmap_size': 256*1024*1024,
+        'temp_store': 'MEMORY',
+    },
+    'bulk': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -256*1024,        # 256MiB
+        'mmap_size': 1024*1024*1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
 class DataBase(object):
+    """Connection manager for a DB file.
+
+    There is one DataBase object per path (see `cache`).  All writes go
+    through the one designated writer connection, serialised by a lock,
+    so it may be used from any thread.  Reads (`table_rows()`, `select()`,
+    `table_exists()`) use a connection private to the calling thread, so
+    readers in different threads neither block nor disturb each other.
+    """
     cache = {}  # DB universe
+    profile = 'concurrent'  # default tuning profile for DBs we open
+    _cache_mux = threading.Lock()
 
-    def __init__(self, path=None, reset=False, create=False):
+    def __init__(self, path=None, reset=False, create=False, profile=None):
         self._path = path
         self._cur = None
+        self._profile = DataBase.profile if profile is None else profile
+        self._wmux = threading.RLock()    # writer lock
+        self._local = threading.local()   # per-thread reader
+        self._gen = 0   # bumped on reset, to invalidate readers
+        self._batch = 0  # batch() nesting
 
         # programming error if extant
         assert path is not None
@@ -196,6 +429,7 @@ class DataBase(object):
         self._db = DataBase.__db_connect(path, reset, create)
         assert self._db
         DataBase.cache[path] = self
+        self.tune(self._profile)
         pass
 
     @staticmethod
@@ -208,71 +442,182 @@ class DataBase(object):
 
         if reset and os.path.isfile(path):
             os.remove(path)
+            for ext in ('-wal', '-shm'):
+                if os.path.isfile(path + ext):
+                    os.remove(path + ext)
+                    pass
+                pass
             pass
 
         if reset or path not in DataBase.cache:
-            db = sq.connect(path)
+            # the writer is shared between threads, under self._wmux
+            db = sq.connect(path, check_same_thread=False)
             pass
         return db
 
     @classmethod
-    def db_connect(cls, path=None, reset=False, create=False):
+    def db_connect(cls, path=None, reset=False, create=False, profile=None):
         """Connect to a database."""
         path = get_zpath(mkdir=create) if path is None else path
 
-        if path not in cls.cache:
-            return DataBase(path=path, reset=reset, create=create)
+        with cls._cache_mux:
+            if path not in cls.cache:
+                return DataBase(path=path, reset=reset, create=create,
+                                profile=profile)
+            obj = cls.cache[path]
+            pass
 
-        obj = cls.cache[path]
         if reset:   # reset extand DB, retaining object
-            obj._db = cls.__db_connect(path, reset=reset, create=create)
+            with obj._wmux:
+                obj._close_reader()
+                if obj._cur:
+                    obj._cur.close()
+                    obj._cur = None
+                    pass
+                if obj._db:
+                    obj._db.close()
+                    pass
+                obj._gen += 1
+                obj._db = cls.__db_connect(path, reset=reset, create=create)
+                obj.tune(obj._profile)
+                pass
+            pass
+        if profile is not None and profile != obj._profile:
+            obj.tune(profile)
             pass
         return obj
 
+    @classmethod
+    def set_profile(cls, profile):
+        """Set the default tuning profile for DBs opened from now on."""
+        if profile not in DB_PROFILES:
+            raise SystemExit(f'Unknown DB profile: {profile}.')
+        cls.profile = profile
+        pass
+
+    def tune(self, profile):
+        """Apply the named tuning profile to the writer (and to the readers
+        as they are opened)."""
+        if profile not in DB_PROFILES:
+            raise SystemExit(f'Unknown DB profile: {profile}.')
+        for (k, v) in DB_PROFILES[profile].items():
+            self.execute(f'PRAGMA {k} = {v};')
+            pass
+        self._profile = profile
+        self._gen += 1  # readers pick up the new settings
+        pass
+
     @property
     def db(self):
+        """The writer connection."""
         return self._db
 
     @property
     def path(self):
         return self._path
 
+    @property
+    def lock(self):
+        """The writer lock.  Hold it to make a series of writes atomic."""
+        return self._wmux
+
     @property
     def cursor(self):
+        """The writer cursor.  Use only while holding the writer lock."""
         if not self._cur:
             self._cur = self._db.cursor()
         return self._cur
 
+    @property
+    def reader(self):
+        """The calling thread's read connection."""
+        loc = self._local
+        if getattr(loc, 'gen', None) != self._gen:
+            self._close_reader()
+            loc.db = sq.connect(self._path)
+            for (k, v) in DB_PROFILES[self._profile].items():
+                if k != 'journal_mode':     # that is per DB, not connexion
+                    loc.db.execute(f'PRAGMA {k} = {v};')
+                    pass
+                pass
+            loc.gen = self._gen
+            pass
+        return loc.db
+
+    def _close_reader(self):
+        """Close the calling thread's read connection, if any."""
+        loc = self._local
+        if getattr(loc, 'db', None) is not None:
+            loc.db.close()
+            pass
+        loc.db = None
+        loc.gen = None
+        pass
+
+    def read(self, exe, args=()):
+        """Execute a query on the calling thread's read connection."""
+        _db_log.debug(2, '%s %s', exe, args)
+        try:
+            return self.reader.execute(exe, args)
+        except Exception as e:
+            raise Error(f'execute({exe} => {e}')
+        pass
+
     def table_exists(self, name):
         """Query if table exists in DB."""
-        sel = ''.join("SELECT name FROM sqlite_master",
-                      f" WHERE type='table' AND name='{name}';")
-        res = self.execute(sel)
+        sel = ''.join(("SELECT name FROM sqlite_master",
+                       f" WHERE type='table' AND name='{name}';"))
+        res = self.read(sel)
         for tup in res.fetchall():
             # print(f'{type(tup)=} {isinstance(tup, tuple)=}')
             if isinstance(tup, tuple):
                 for t in tup:
                     if t == name:
-                        debug(2, f'{res=} {tup=} {t=} {t==name=}')
+                        _db_log.debug(2, 'res=%r tup=%r t=%r t==name=%r',
+                                      res, tup, t, t == name)
                         return True
                     pass
                 pass
             pass
-        debug(2, f'{res=} {name in res=}')
+        _db_log.debug(2, 'res=%r', res)
         return False
 
-    def execute(self, exe):
-        debug(2, f'{exe}')
-        try:
-            return self.cursor.execute(exe)
-        except Exception as e:
-            debug(2, f'{exe}')
-            raise Error(f'execute({exe} => {e}')
+    def execute(self, exe, args=()):
+        """Execute a statement on the writer connection.  Returns a cursor
+        of its own, so its rows (and rowcount) may be read after the writer
+        lock is released."""
+        _db_log.debug(2, '%s %s', exe, args)
+        with self._wmux:
+            try:
+                return self._db.execute(exe, args)
+            except Exception as e:
+                _db_log.debug(2, '%s', exe)
+                raise Error(f'execute({exe} => {e}')
+            pass
+        pass
+
+    def executemany(self, exe, seq):
+        """Execute a statement on the writer for each args tuple in `seq`."""
+        _db_log.debug(2, '%s', exe)
+        with self._wmux:
+            try:
+                return self._db.executemany(exe, seq)
+            except Exception as e:
+                raise Error(f'executemany({exe} => {e}')
+            pass
         pass
 
     def drop_table(self, name):
         return self.execute(f'DROP TABLE IF EXISTS {name};')
 
+    def drop_view(self, name):
+        return self.execute(f'DROP VIEW IF EXISTS {name};')
+
+    def create_view(self, name, sel):
+        exe = f'CREATE VIEW IF NOT EXISTS {name} AS {sel};'
+        self.execute(exe)
+        return
+
     def create_table(self, name, cols):
         _c = ', '.join(cols)
         exe = f'CREATE TABLE IF NOT EXISTS {name}({_c});'
@@ -280,36 +625,83 @@ class DataBase(object):
         return
 
     def row_insert(self, name, cols, vals):
-        debug(2, f'{cols=}')
-        debug(2, f'{vals=}')
+        _db_log.debug(2, 'cols=%r', cols)
+        _db_log.debug(2, 'vals=%r', vals)
         _c = ', '.join(cols)
         _v = ', '.join(vals)
         exe = f'INSERT INTO {name} ({_c}) VALUES({_v});'
-        self.execute(exe)
-        self.commit()
+        with self._wmux:
+            self.execute(exe)
+            self.commit()
+            pass
         return
 
     def row_replace(self, name, cols, vals):
-        debug(2, f'{cols=}')
-        debug(2, f'{vals=}')
+        _db_log.debug(2, 'cols=%r', cols)
+        _db_log.debug(2, 'vals=%r', vals)
         _c = ', '.join(cols)
         _v = ', '.join(vals)
         exe = f'REPLACE INTO {name} ({_c}) VALUES({_v});'
-        self.execute(exe)
-        self.commit()
+        with self._wmux:
+            self.execute(exe)
+            self.commit()
+            pass
         return
 
     def row_delete(self, name, col, val):
-        debug(2, f'row_delete: {name=} {col=} {val=}')
+        _db_log.debug(2, 'row_delete: name=%r col=%r val=%r', name, col, val)
         exe = f'DELETE FROM {name} WHERE {col} = {val};'
-        self.execute(exe)
-        self.commit()
+        with self._wmux:
+            self.execute(exe)
+            self.commit()
+            pass
         return
 
     def table_rows(self, name, cols, arraysize=200):
         """Return a generator for the specified rows in the named table."""
         sel = ', '.join(f'{a}' for a in cols)
-        r = self.execute(f'SELECT {sel} FROM {name} ORDER BY rowid')
+        r = self.read(f'SELECT {sel} FROM {name} ORDER BY rowid')
+
+        def gen():
+            while True:
+                ar = r.fetchmany(arraysize)
+
+                if not ar:
+                    break
+                for e in ar:
+                    yield e
+                    pass
+                pass
+            r.close()
+            pass
+
+        return gen
+
+    def create_index(self, name, cols):
+        """Create an index on columns `cols` of table `name`."""
+        _c = ', '.join(cols)
+        _n = '_'.join([name] + list(cols)) + '_idx'
+        exe = f'CREATE INDEX IF NOT EXISTS {_n} ON {name}({_c});'
+        self.execute(exe)
+        return
+
+    def select(self, name, cols, where='', args=(), order='', limit=None,
+               arraysize=200):
+        """Return a generator for the rows of the named table which match
+        `where` (with `args` bound to its parameters), in `order`.
+        """
+        sel = ', '.join(f'{a}' for a in cols)
+        exe = f'SELECT {sel} FROM {name}'
+        if where:
+            exe += f' WHERE {where}'
+            pass
+        if order:
+            exe += f' ORDER BY {order}'
+            pass
+        if limit is not None:
+            exe += f' LIMIT {int(limit)}'
+            pass
+        r = self.read(exe, args)
 
         def gen():
             while True:
@@ -321,26 +713,59 @@ class DataBase(object):
                     yield e
                     pass
                 pass
+            r.close()
             pass
 
         return gen
 
+    @contextmanager
+    def batch(self):
+        """Hold the writer for a batch of writes, deferring any commits
+        to the end of the batch."""
+        with self._wmux:
+            self._batch += 1
+            try:
+                yield self
+            finally:
+                self._batch -= 1
+                if self._batch == 0:
+                    self.db.commit()
+                    pass
+                pass
+            pass
+        pass
+
+    def data_version(self):
+        """The writer's PRAGMA data_version: it changes when some other
+        connection commits to the DB."""
+        return self.execute('PRAGMA data_version').fetchone()[0]
+
     def commit(self):
-        return self.db.commit()
+        with self._wmux:
+            if self._batch:     # (only the batching thread gets here)
+                return None
+            return self.db.commit()
+        pass
 
     def close(self):
-        if self._cur:
-            self._cur.close()
-            del self._cur
-            self._cur = None
-            pass
-        if self._db:
-            self._db.close()
-            del self._db
-            self._db = None
-            pass
-        assert self._path in DataBase.cache
-        del DataBase.cache[self._path]
+        with self._wmux:
+            self._close_reader()
+            if self._cur:
+                self._cur.close()
+                del self._cur
+                self._cur = None
+                pass
+            if self._db:
+                self._db.close()
+                del self._db
+                self._db = None
+                pass
+            self._gen += 1
+            pass
+        with DataBase._cache_mux:
+            assert self._path in DataBase.cache
+            del DataBase.cache[self._path]
+            pass
         pass
     pass
 
@@ -374,7 +799,8 @@ class ZwiBase(object):
 
     def _diff(self, other, d, ignore=[]):
         """Return the set of differences."""
-        debug(2, f'diff: {self=}\ndiff: {other=}\ndiff: {d=}')
+        _data_log.debug(2, 'diff: self=%r\ndiff: other=%r\ndiff: d=%r',
+                        self, other, d)
 
         for x in fields(self):
             if x.name in ignore:
@@ -423,7 +849,8 @@ class ZwiBase(object):
         read the same after we write/read thru the DB.
         """
         if x.name in arg:
-            debug(2, f'{x.name=} {x.type=} {arg[x.name]=}')
+            _data_log.debug(2, 'x.name=%r x.type=%r arg[x.name]=%r',
+                            x.name, x.type, arg[x.name])
             if x.type is int and arg[x.name] is None:
                 # Need to map these to zero here.
                 setattr(f, x.name, 0)
@@ -439,7 +866,8 @@ class ZwiBase(object):
                 # we expect that f.<value> here is a suitable dict
                 f0 = getattr(f, x.name)
                 if f0 is not None and x.name in arg:
-                    debug(2, f'dict: {f0=} {arg[x.name]=}')
+                    _data_log.debug(2, 'dict: f0=%r arg[x.name]=%r',
+                                    f0, arg[x.name])
                     f0.traverse(ZwiBase.from_dict, arg[x.name])
                 else:
                     raise SystemExit('oops')
@@ -464,7 +892,8 @@ class ZwiBase(object):
                 # we expect that self.<value> here is a suitable dict
                 f0 = getattr(f, x.name)
                 if f0 is not None:
-                    debug(2, f'dict: {f0=} {arg[x.name]=}')
+                    _data_log.debug(2, 'dict: f0=%r arg[x.name]=%r',
+                                    f0, arg[x.name])
                     f0.traverse(f.to_dict, arg[x.name])
                     pass
                 pass
@@ -488,11 +917,11 @@ class ZwiBase(object):
         elif isinstance(x.type(), ZwiBase):
             # decide what we need the recursion to do:
             f0 = getattr(f, x.name)
-            debug(2, f'from_seq: {x.name=} {f0}')
+            _data_log.debug(2, 'from_seq: x.name=%r %s', x.name, f0)
             if f0 is not None:
                 return f0.traverse(f0.from_seq, arg)
                 pass
-            debug(0, f'from_seq: {x.name=} {f0}')
+            _data_log.debug(0, 'from_seq: x.name=%r %s', x.name, f0)
             raise SystemExit('logic error')
         else:
             raise SystemExit(f'Unexpected type: {x.type=}')
@@ -544,7 +973,7 @@ class ZwiFollowers(ZwiBase):
 
             pass
 
-        privacy: Privacy = Privacy()
+        privacy: Privacy = field(default_factory=Privacy)
 
         @dataclass
         class SocialFacts(ZwiBase):
@@ -556,7 +985,7 @@ class ZwiFollowers(ZwiBase):
             isFavoriteOfLoggedInPlayer: bool = True
             pass
 
-        socialFacts: SocialFacts = SocialFacts()
+        socialFacts: SocialFacts = field(default_factory=SocialFacts)
         worldId: int = 0
         enrolledZwiftAcademy: bool = False
         playerTypeId: int = 0
@@ -565,7 +994,7 @@ class ZwiFollowers(ZwiBase):
         likelyInGame: bool = False
         pass
 
-    profile: FollowerProfile = FollowerProfile()
+    profile: FollowerProfile = field(default_factory=FollowerProfile)
 
     addDate: str = f'''{datetime.now().isoformat(timespec='minutes')}'''
     delDate: str = 'not yet'
@@ -698,7 +1127,7 @@ class ZwiProfile(ZwiBase):
 
         pass
 
-    privacy: Privacy = Privacy()
+    privacy: Privacy = field(default_factory=Privacy)
 
     @dataclass
     class SocialFacts(ZwiBase):
@@ -710,7 +1139,7 @@ class ZwiProfile(ZwiBase):
         isFavoriteOfLoggedInPlayer: bool = True
         pass
 
-    socialFacts: SocialFacts = SocialFacts()
+    socialFacts: SocialFacts = field(default_factory=SocialFacts)
 
     worldId: int = 0
     enrolledZwiftAcademy: bool = False
@@ -719,67 +1148,67 @@ class ZwiProfile(ZwiBase):
     currentActivityId: int = 0
     likelyInGame: bool = False
 
-    address: str = None,
-    age: int = 0,
-    bodyType: int = 0,
-    connectedToStrava: bool = False,
-    connectedToTrainingPeaks: bool = False,
-    connectedToTodaysPlan: bool = False,
-    connectedToUnderArmour: bool = False,
-    connectedToWithings: bool = False,
-    connectedToFitbit: bool = False,
-    connectedToGarmin: bool = False,
-    connectedToRuntastic: bool = False,
-    connectedToZwiftPower: bool = False,
-    stravaPremium: bool = False,
-    bt: str = None,
-    dob: str = None,
-    emailAddress: str = None,
-    height: int = 0,
-    location: str = '',
-    preferredLanguage: str = '',
-    mixpanelDistinctId: str = '',
-    profileChanges: bool = False,
-    weight: int = 0,
-    b: bool = False,
-    createdOn: str = '',
-    source: str = '',
-    origin: str = '',
-    launchedGameClient: str = '',
-    ftp: int = 0,
-    userAgent: str = '',
-    runTime1miInSeconds: int = 0,
-    runTime5kmInSeconds: int = 0,
-    runTime10kmInSeconds: int = 0,
-    runTimeHalfMarathonInSeconds: int = 0,
-    runTimeFullMarathonInSeconds: int = 0,
-    cyclingOrganization: str = None,
-    licenseNumber: str = None,
-    bigCommerceId: str = '',
-    marketingConsent: str = None,
-
-    achievementLevel: int = 0,
-    totalDistance: int = 0,
-    totalDistanceClimbed: int = 0,
-    totalTimeInMinutes: int = 0,
-    totalInKomJersey: int = 0,
-    totalInSprintersJersey: int = 0,
-    totalInOrangeJersey: int = 0,
-    totalWattHours: int = 0,
-    totalExperiencePoints: int = 0,
-    totalGold: int = 0,
-    runAchievementLevel: int = 0,
-    totalRunDistance: int = 0,
-    totalRunTimeInMinutes: int = 0,
-    totalRunExperiencePoints: int = 0,
-    totalRunCalories: int = 0,
-    powerSourceType: str = '',
-    powerSourceModel: str = '',
-    virtualBikeModel: str = '',
-    numberOfFolloweesInCommon: int = 0,
-    affiliate: str = None,
-    avantlinkId: str = None,
-    fundraiserId: str = None,
+    address: str = None
+    age: int = 0
+    bodyType: int = 0
+    connectedToStrava: bool = False
+    connectedToTrainingPeaks: bool = False
+    connectedToTodaysPlan: bool = False
+    connectedToUnderArmour: bool = False
+    connectedToWithings: bool = False
+    connectedToFitbit: bool = False
+    connectedToGarmin: bool = False
+    connectedToRuntastic: bool = False
+    connectedToZwiftPower: bool = False
+    stravaPremium: bool = False
+    bt: str = None
+    dob: str = None
+    emailAddress: str = None
+    height: int = 0
+    location: str = ''
+    preferredLanguage: str = ''
+    mixpanelDistinctId: str = ''
+    profileChanges: bool = False
+    weight: int = 0
+    b: bool = False
+    createdOn: str = ''
+    source: str = ''
+    origin: str = ''
+    launchedGameClient: str = ''
+    ftp: int = 0
+    userAgent: str = ''
+    runTime1miInSeconds: int = 0
+    runTime5kmInSeconds: int = 0
+    runTime10kmInSeconds: int = 0
+    runTimeHalfMarathonInSeconds: int = 0
+    runTimeFullMarathonInSeconds: int = 0
+    cyclingOrganization: str = None
+    licenseNumber: str = None
+    bigCommerceId: str = ''
+    marketingConsent: str = None
+
+    achievementLevel: int = 0
+    totalDistance: int = 0
+    totalDistanceClimbed: int = 0
+    totalTimeInMinutes: int = 0
+    totalInKomJersey: int = 0
+    totalInSprintersJersey: int = 0
+    totalInOrangeJersey: int = 0
+    totalWattHours: int = 0
+    totalExperiencePoints: int = 0
+    totalGold: int = 0
+    runAchievementLevel: int = 0
+    totalRunDistance: int = 0
+    totalRunTimeInMinutes: int = 0
+    totalRunExperiencePoints: int = 0
+    totalRunCalories: int = 0
+    powerSourceType: str = ''
+    powerSourceModel: str = ''
+    virtualBikeModel: str = ''
+    numberOfFolloweesInCommon: int = 0
+    affiliate: str = None
+    avantlinkId: str = None
+    fundraiserId: str = None
 
     addDate: str = f'''{datetime.now().isoformat(timespec='minutes')}'''
 
@@ -856,34 +1285,148 @@ class ZwiProfile(ZwiBase):
 
         return self.traverse(fun, list())
 
+    def column_dict(self):
+        """generate a column name => value dict, with the values as
+        column_values() would store them."""
+
+        def fun(f, x, arg):
+            """Function to enumerate the column values."""
+            val = getattr(f, x.name)
+
+            if x.type in (int, bool):
+                arg.append(0 if val is None else int(val))
+            elif x.type is str:
+                arg.append(str(val))
+            elif isinstance(x.type(), ZwiBase):
+                f0 = getattr(f, x.name)
+                if f0 is not None:
+                    f0.traverse(fun, arg)
+                    pass
+                pass
+            pass
+
+        return dict(zip(self.column_names(), self.traverse(fun, list())))
+
     def refresh(self, pro):
         """Refresh local cached values from Zwift."""
         return pro.refresh(self)
     pass
 
 
+PROGRESS = 500     # rows between ZwiUser progress reports
+
+
+class RowView(object):
+    """Sequence view of `rows` in the order given by the permutation `perm`.
+    Reversing the order or changing the permutation is O(1): the rows are
+    never copied.  With a permutation, the view is of the rows it covers,
+    should more rows arrive (as while loading).
+    """
+
+    def __init__(self, rows, perm=None, reverse=False):
+        self._rows = rows
+        self._perm = perm
+        self._rev = reverse
+        pass
+
+    def __len__(self):
+        return len(self._rows if self._perm is None else self._perm)
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+            pass
+        if i < 0 or i >= n:
+            raise IndexError(f'{i} not in range [0, {n})')
+        if self._rev:
+            i = n - 1 - i
+            pass
+        return self._rows[i if self._perm is None else self._perm[i]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    pass
+
+
 class ZwiUser(object):
-    """Zwift user model."""
+    """Zwift user model.
+    The followers/followees are stored as edges (see ZwiGraph) plus one
+    `fprofile` row per rider, shared by the two lists.  The `followers`
+    and `followees` views present them in the old, flat, format.
+    The views can join only tables in our own DB, so the edges are kept
+    there, and also recorded in the shared ZwiGraph (of the profile DB),
+    alongside everyone else's.
+    """
 
-    def __init__(self, db=None, drop=False, update=False, uid=None,
-                 pro_update=None):
+    # ZwiFollowers columns held in the edge, rather than in `fprofile`
+    EDGE_COLS = ['followerId', 'followeeId', 'status',
+                 'isFolloweeFavoriteOfFollower', 'addDate', 'delDate']
+
+    # update() pipeline: workers per stage, and rows written per commit
+    STAGES = {'decode': 1, 'diff': 1, 'write': 1}
+    BATCH = 200
+
+    def __init__(self, db=None, drop=False, update=False,
+                 pro_update=None, progress=None, defer=False, graph=None):
+        """If `defer` is set, the DB is not touched until `load()` is called.
+        `progress(tab, count)` is called periodically as rows are fetched
+        from Zwift or slurped from the DB.
+        Our edges are also recorded in the shared ZwiGraph `graph`: by
+        default, that of the profile DB, unless we were given a `db`.
+        """
         self._db = db
         self._wers = []
         self._wees = []
         self._wers_dict = {}
         self._wees_dict = {}
         self._cols = ZwiFollowers.column_names()
-        self._uid = uid
+        self._pcols = [c for c in self._cols if c not in self.EDGE_COLS]
+        self._graph = None
+        self._shared = graph
+        self._share = graph is not None or db is None
+        self._uid = None
         self._cl = None
         self._pr = None
         self._pro = pro_update
-        self._setup(drop, update, uid)
+        self._index = None
+        self._order = {}
+        self._progress = progress
+        self._loaded = False
+        self._pipe = None
+        self._args = (drop, update)
+        if not defer:
+            self.load()
+            pass
+        pass
+
+    def load(self):
+        """Syncronise with the local DB (and Zwift, if updating)."""
+        self._setup(*self._args)
+        self._loaded = True
+        pass
+
+    def _report(self, tab, count, final=False):
+        """Pass progress on to any interested party."""
+        if self._progress is not None and (final or count % PROGRESS == 0):
+            self._progress(tab, count)
+            pass
         pass
 
+    @property
+    def db(self):
+        return self._db
+
     @property
     def cols(self):
         return self._cols
 
+    @property
+    def pipeline(self):
+        """The Pipeline of the last update(), for its counters."""
+        return self._pipe
+
     @property
     def wees(self):
         return self._wees
@@ -900,6 +1443,60 @@ class ZwiUser(object):
     def wers_dict(self):
         return self._wers_dict
 
+    @property
+    def index(self):
+        """Search index over the followers/followees, built on first use.
+        It is not retained if built while the rows are still loading.
+        """
+        if self._index is None or not self._loaded:
+            idx = SearchIndex()
+            cn = [self._cols.index(c) for c in ('firstName', 'lastName',
+                                                'countryAlpha3', 'playerType')]
+            for (rows, zc) in ((self._wers, 'followerId'),
+                               (self._wees, 'followeeId')):
+                zc = self._cols.index(zc)
+                for r in rows:
+                    idx.add(r[zc], *[r[i] for i in cn])
+                    pass
+                pass
+            self._index = idx
+            pass
+        return self._index
+
+    def order(self, which, col):
+        """Return the permutation of the `which` ('wers' or 'wees') rows
+        which sorts them by `col`.  Computed on first use and cached.
+        """
+        key = (which, col)
+        rows = self._wers if which == 'wers' else self._wees
+        perm = self._order.get(key)
+        if perm is None or len(perm) != len(rows):  # (still loading?)
+            idx = self._cols.index(col)
+            perm = sorted(range(len(rows)), key=lambda i: rows[i][idx])
+            self._order[key] = perm
+            pass
+        return perm
+
+    def view(self, which, col=None, reverse=False):
+        """Return a RowView of the `which` rows, sorted by `col`."""
+        rows = self._wers if which == 'wers' else self._wees
+        perm = None if col is None else self.order(which, col)
+        return RowView(rows, perm, reverse)
+
+    def search(self, text='', country=None, ptype=None, limit=None):
+        """Return the Zwift IDs of followers/followees matching, ordered
+        by name (the first `limit` of them, if given)."""
+        zids = self.index.search(text, country=country, ptype=ptype)
+        (fn, ln) = (self._cols.index('firstName'),
+                    self._cols.index('lastName'))
+
+        def name(zid):
+            r = self._wers_dict.get(zid) or self._wees_dict.get(zid)
+            return ((r[ln] or '').lower(), (r[fn] or '').lower())
+
+        zids.sort(key=name)
+        return zids[:limit]
+
     def wees_iter(self):
         """Construct an iterator to produce the wees
         as ZwiFollowers objects."""
@@ -910,29 +1507,36 @@ class ZwiUser(object):
         as ZwiFollowers objects."""
         return (ZwiFollowers.wers(x) for x in self._wers)
 
-    def _setup(self, drop, update, uid):
+    def _setup(self, drop, update):
         """Syncronise with the local DB version of the world."""
         if self._db is None:  # attach to the usual DB
-            if uid is not None:
-                # put into a different data base
-                self._db = DataBase.db_connect(get_zpath(subdir=f'{uid}',
-                                                         mkdir=update),
-                                               create=update)
-            else:
-                self._db = DataBase.db_connect(create=update)
-                pass
+            self._db = DataBase.db_connect(create=update)
             pass
 
         if drop:
-            self._db.drop_table('followers')
-            self._db.drop_table('followees')
+            for tab in ('followers', 'followees'):
+                if self._db.table_exists(tab):  # (old format)
+                    self._db.drop_table(tab)
+                else:
+                    self._db.drop_view(tab)
+                    pass
+                pass
+            self._db.drop_table('edge')
+            self._db.drop_table('fprofile')
             pass
 
-        def cn(pk=''):
-            return ZwiFollowers.column_names(create=True, pk=pk)
-
-        self._db.create_table('followers', cn(pk='followerId'))
-        self._db.create_table('followees', cn(pk='followeeId'))
+        old = [t for t in ('followers', 'followees')
+               if self._db.table_exists(t)]
+        self._graph = ZwiGraph(db=self._db)
+        self._db.create_table('fprofile', ['id INT PRIMARY KEY'] + [
+            c for c in ZwiFollowers.column_names(create=True)
+            if c.split()[0] in self._pcols])
+        for (dir, tab) in ZwiGraph.TABS.items():
+            self._db.create_view(tab, self._view(dir))
+            pass
+        for tab in old:
+            self._migrate(tab)
+            pass
 
         werid = self._cols.index('followerId')
         weeid = self._cols.index('followeeId')
@@ -953,24 +1557,87 @@ class ZwiUser(object):
         self._slurp(self._wers, self._wers_dict, werid, 'followers')
         self._slurp(self._wees, self._wees_dict, weeid, 'followees')
         if self._pro is not None:
-            cnt = 0
-            for r in self._wers:
-                self._pro.update(r[werid])
-                verbo(0, f'\rupdate profile of followers: {cnt}', end='')
-                cnt += 1
+            cnt = [0]
+
+            def report(zid, old, new):
+                cnt[0] += 1
+                _user_log.verbo(0, '\rupdate profile of followers/followees:'
+                                ' %d', cnt[0], end='')
                 pass
-            verbo(0, '') if cnt else None
 
-            cnt = 0
-            for r in self._wees:
-                self._pro.update(r[weeid])
-                verbo(0, f'\rupdate profile of followees: {cnt}', end='')
-                cnt += 1
+            self._pro.update_all([r[werid] for r in self._wers] +
+                                 [r[weeid] for r in self._wees],
+                                 report=report)
+            _user_log.verbo(0, '') if cnt[0] else None
+            pass
+        pass
+
+    def _view(self, dir):
+        """SELECT for the flat view of the `dir` list."""
+        (wer, wee) = ('other', 'owner') if dir == GRAPH_WERS else ('owner',
+                                                                   'other')
+        pcols = ', '.join(f'p.{c}' for c in self._pcols)
+        return ' '.join((
+            f'SELECT e.rowid AS rowid, e.{wer} AS followerId,',
+            f'e.{wee} AS followeeId, e.status AS status,',
+            f'e.fav AS isFolloweeFavoriteOfFollower, {pcols},',
+            "e.addDate AS addDate, 'not yet' AS delDate",
+            'FROM edge e JOIN fprofile p ON p.id = e.other',
+            f'WHERE e.dir = {dir} AND e.delDate IS NULL'))
+
+    def _store(self, vals):
+        """Write the profile part of each (zid, ZwiFollowers.column_values())
+        in `vals` to `fprofile`."""
+        cols = ['id'] + self._pcols
+        idx = [self._cols.index(c) for c in self._pcols]
+        with self._db.lock:
+            for (zid, v) in vals:
+                _v = ', '.join([f'{int(zid)}'] + [v[i] for i in idx])
+                self._db.execute(f'REPLACE INTO fprofile ({", ".join(cols)})'
+                                 f' VALUES({_v});')
                 pass
-            verbo(0, '') if cnt else None
+            self._db.commit()
             pass
         pass
 
+    def _migrate(self, tab):
+        """Convert a pre-edge `tab` table, then replace it by its view."""
+        (dir, fac, sym, own) = {
+            'followers': (GRAPH_WERS, ZwiFollowers.wers,
+                          'followerId', 'followeeId'),
+            'followees': (GRAPH_WEES, ZwiFollowers.wees,
+                          'followeeId', 'followerId'),
+        }[tab]
+        rows = list(self._db.table_rows(tab, self._cols)())
+        vals = []
+        owners = {}
+        for r in rows:
+            f = fac(r)
+            zid = getattr(f, sym)
+            vals.append((zid, f.column_values()))
+            owners.setdefault(getattr(f, own), []).append(
+                (zid, f.status, f.isFolloweeFavoriteOfFollower, f.addDate))
+            pass
+        self._store(vals)
+        for (owner, edges) in owners.items():
+            self._record(owner, dir, edges)
+            pass
+        self._db.drop_table(tab)
+        self._db.create_view(tab, self._view(dir))
+        _user_log.verbo(1, 'converted %d %s', len(rows), tab)
+        pass
+
+    def _record(self, owner, dir, edges):
+        """Record `edges` in our DB, and in the shared ZwiGraph."""
+        rv = self._graph.record(owner, dir, edges)
+        if self._share:
+            if self._shared is None:
+                self._shared = ZwiGraph(create=True)
+                pass
+            self._shared.record(owner, dir, edges)
+            pass
+        return rv
+
     def _slurp(self, cache, ns, idx, tab):
         """Slurp in the table data."""
         g = self._db.table_rows(tab, self._cols)
@@ -979,12 +1646,17 @@ class ZwiUser(object):
             cache.append(r)
             ns[r[idx]] = r
             count = count + 1
-            verbo(1, f'\rslurped {tab}: {count}', end='')
+            _user_log.verbo(1, '\rslurped %s: %d', tab, count, end='')
+            self._report(tab, count)
             pass
-        verbo(1, '') if count else None
+        _user_log.verbo(1, '') if count else None
+        self._report(tab, count, final=True)
         pass
 
     def update(self, cache, ns, idx, tab, factory, compare, delete):
+        """Update the `tab` list from Zwift, through a Pipeline: the pages
+        fetched feed the decode, diff (against `ns`) and write stages."""
+        self._order = {}    # any sort orders are now suspect
         if self._pr is None:
             self._cl, self._pr = zwi_init()
             if self._uid is None:
@@ -993,33 +1665,74 @@ class ZwiUser(object):
             pass
 
         sym = self._cols[idx]
-        vec = []
-        dic = {}
-        start = 0
-        while True:
-            req = f'/api/profiles/{self._uid}/{tab}?start={start}&limit=200'
-            fe = self._pr.request.json(req)
-            if len(fe) == 0:
-                break
+        get = self._pr.request.json
+        seen = set()
+        edges = []
+        hdr = [f'Updating {tab}:\n']
 
-            for f in fe:
-                start += 1
-                vec.append(f)
-                dic[f[sym]] = f
+        def fetch():
+            start = 0
+            while True:
+                req = f'/api/profiles/{self._uid}/{tab}?start={start}&limit=200'
+                fe = get(req)
+                ZwiArchive.record(req, fe)
+                if len(fe) == 0:
+                    break
+                for f in fe:
+                    yield start, f
+                    start += 1
+                    pass
+                self._report(f'fetch {tab}', start, final=True)
                 pass
-            verbo(1, f'\rupdate: processed {tab}: {start}', end='')
             pass
-        verbo(1, '') if start else None
 
-        # I want to add these into the DB in historical order.
-        # It appears that more recent followers are returned first above.
-        vec.reverse()
+        def decode(item):
+            (seq, f) = item
+            return seq, factory(f)
+
+        def diff(item):
+            (seq, w) = item
+            return seq, w, compare(w, ns)
+
+        def write(batch):
+            changed = []
+            for (seq, w, change) in batch:
+                zid = getattr(w, sym)
+                seen.add(zid)
+                edges.append((seq, (zid, w.status,
+                                    w.isFolloweeFavoriteOfFollower, None)))
+                if change:
+                    print(f'{hdr[0]}      {w.profile.firstName}'
+                          f' {w.profile.lastName}')
+                    hdr[0] = ''
+                    changed.append((zid, w.column_values()))
+                    if self._index is not None:
+                        p = w.profile
+                        self._index.add(zid, p.firstName, p.lastName,
+                                        p.countryAlpha3, p.playerType)
+                        pass
+                    pass
+                pass
+            self._store(changed)
+            _user_log.verbo(1, '\rupdate: processed %s: %d', tab, len(edges),
+                            end='')
+            pass
+
+        conf = self.STAGES
+        self._pipe = Pipeline([
+            Stage('decode', decode, conf['decode']),
+            Stage('diff', diff, conf['diff']),
+            Stage('write', write, conf['write'], batch=self.BATCH),
+        ], source='fetch')
+        self._pipe.run(fetch())
+        _user_log.verbo(1, '') if edges else None
+        self._pipe.report()
 
         # Check to see if there are any deletions
         hdr = f'No longer in {tab}:\n'
         for r in cache:
             zid = r[idx]
-            if zid not in dic.keys():
+            if zid not in seen:
                 r = factory(r)
                 print(f'{hdr}      {r.profile.firstName} {r.profile.lastName}')
                 hdr = ''
@@ -1027,21 +1740,12 @@ class ZwiUser(object):
                 pass
             pass
 
-        start = 0
-        hdr = f'Updating {tab}:\n'
-        for v in vec:
-            w = factory(v)
-            fun = compare(w, ns)
-            if fun is not None:
-                print(f'{hdr}      {w.profile.firstName} {w.profile.lastName}')
-                hdr = ''
-                w.addDate = f'{datetime.now().isoformat(timespec="minutes")}'
-                fun(tab, w.column_names(), w.column_values())
-                pass
-            start += 1
-            verbo(1, f'\rupdate: processed {tab}: {start}', end='')
-            pass
-        verbo(1, '') if start else None
+        # I want to add these into the DB in historical order.
+        # It appears that more recent followers are returned first above.
+        edges.sort(key=lambda e: -e[0])
+        # edges no longer listed are marked deleted by record()
+        dir = GRAPH_WERS if tab == 'followers' else GRAPH_WEES
+        self._record(self._uid, dir, [e for (seq, e) in edges])
         return
 
     def wers_fac(self, v):
@@ -1055,48 +1759,133 @@ class ZwiUser(object):
         return o
 
     def wers_cmp(self, o0, cache):
+        """Is `o0` new, or changed from the cached version?"""
         if o0.followerId not in cache:
-            return self._db.row_insert
+            return True
         o1 = ZwiFollowers.wers(cache[o0.followerId])
         if o0 == o1:
-            return None
-        else:
-            print(f'{o0.last_difference=}')
-            return self._db.row_replace
-        pass
+            return False
+        print(f'{o0.last_difference=}')
+        return True
 
     def wees_cmp(self, o0, cache):
+        """Is `o0` new, or changed from the cached version?"""
         if o0.followeeId not in cache:
-            return self._db.row_insert
+            return True
         o1 = ZwiFollowers.wees(cache[o0.followeeId])
-        if o0 == o1:
-            return None
-        else:
-            return self._db.row_replace
-        pass
-
-    def wers_del(self, fid):
-        return self._db.row_delete('followers', 'followerId', fid)
+        return o0 != o1
+
+    def rebuild(self, archive, workers=None):
+        """Regenerate the followers/followees from the latest archived
+        lists of the users recorded in this DB."""
+        if not self._loaded:
+            self.load()
+            pass
+        for uid in self._graph.owners():
+            for (dir, tab) in ZwiGraph.TABS.items():
+                ents = archive.follows(uid, tab, workers=workers)
+                if ents is None:
+                    continue
+                ents.reverse()  # historical order, as for update()
+                self._store([(zid, vals) for (zid, _, _, vals) in ents])
+                self._record(uid, dir, [e[:3] + (None,) for e in ents])
+                _user_log.verbo(1, 'rebuilt %s of %s: %d', tab, uid, len(ents))
+                pass
+            pass
+        pass
+
+    def _index_del(self, fid, other):
+        if self._index is not None and fid not in other:
+            self._index.remove(fid)
+            pass
+        pass
+
+    def wers_del(self, fid):
+        # the edge itself is retired by ZwiGraph.record()
+        self._index_del(fid, self._wees_dict)
+        pass
+
+    def wees_del(self, fid):
+        self._index_del(fid, self._wers_dict)
+        pass
+
+    pass
 
-    def wees_del(self, fid):
-        return self._db.row_delete('followees', 'followeeId', fid)
 
+def fetch_profile(get, zid):
+    """Fetch profile `zid` from Zwift, using `get(req)`."""
+    zwift = _import('zwift')
+    count = 0
+    while True:
+        try:
+            rsp = get(f'/api/profiles/{zid}')
+        except zwift.error.RequestException as e:
+            # This is derived from BaseExeption, not Exception...
+            print(f'error trying to obtain profile for {zid}: {e}')
+            rsp = None
+        except ConnectionError as e:
+            #  retry this some #  of times
+            count += 1
+            if count < 8:
+                print(f'retry: {count} of Connection reset',
+                      f'trying to obtain profile for {zid}: {e}')
+                continue
+            raise SystemExit(
+                f'Connection reset trying to obtain profile for {zid}: {e}'
+            )
+        except Exception as e:
+            print(f'{type(e)} {e}')
+            raise SystemExit(f'Some error trying to update id {zid}.')
+        if rsp is not None:
+            ZwiArchive.record(f'/api/profiles/{zid}', rsp)
+            pass
+        return rsp
     pass
 
 
 class ZwiPro(object):
     """Zwift profiles model.
     Seems we can get profile data given user id.
+    If `slurp` is False, the profiles are not loaded into memory: only
+    `query()` is useful.
     """
 
-    def __init__(self, db=None, drop=False, update=False, create=False):
+    # secondary indexes on the `profile` table
+    INDEXES = [
+        ['countryAlpha3'],
+        ['playerType'],
+        ['ftp'],
+        ['weight'],
+        ['age'],
+        ['achievementLevel'],
+        ['addDate'],
+    ]
+
+    # update_all() pipeline: workers per stage, and profiles per commit
+    STAGES = {'fetch': 4, 'decode': 1, 'diff': 1, 'write': 1}
+    BATCH = 50
+
+    # query() predicate operators
+    OPS = {
+        '=': '=', '==': '=', '!=': '!=',
+        '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+        '~': 'LIKE',
+    }
+
+    def __init__(self, db=None, drop=False, update=False, create=False,
+                 slurp=True):
         self._db = db
         self._cols = ZwiProfile.column_names()
+        self._types = dict(c.split() for c in
+                           ZwiProfile.column_names(create=True))
         self._pro = []
         self._lookup = {}
+        self._index = None
+        self._hist = None
+        self._slurped = slurp
         self._cl = None
         self._pr = None
-        self._setup(drop, update, create)
+        self._setup(drop, update, create, slurp)
         pass
 
     def __len__(self):
@@ -1106,6 +1895,17 @@ class ZwiPro(object):
         """The iterator returns the set ZwiProfile() in the self._pro cache."""
         return (ZwiProfile.from_seq(x) for x in self._pro)
 
+    def walk(self, skip=0, seek=None):
+        """As for the iterator, but skipping the first `skip` entries, and
+        any before Zwift ID `seek`."""
+        start = skip
+        if seek is not None:
+            if seek not in self._lookup:
+                raise SystemExit(f'{seek} not found in local profile DB.')
+            start = max(start, self._lookup[seek])
+            pass
+        return (ZwiProfile.from_seq(x) for x in self._pro[start:])
+
     @property
     def pr(self):
         if not self._pr:
@@ -1117,7 +1917,16 @@ class ZwiPro(object):
     def cols(self):
         return self._cols
 
-    def _setup(self, drop, update, create):
+    @property
+    def db(self):
+        return self._db
+
+    @property
+    def history(self):
+        """The ZwiHistory of the profiles."""
+        return self._hist
+
+    def _setup(self, drop, update, create, slurp):
         """Syncronise with the local DB version of the world."""
         if self._db is None:  # attach to the usual DB
             self._db = DataBase.db_connect(get_zpath(fname='profile.db'),
@@ -1130,9 +1939,68 @@ class ZwiPro(object):
 
         cn = ZwiProfile.column_names(create=True, pk='id')
         self._db.create_table('profile', cn)
-        self._slurp()
+        for cols in self.INDEXES:
+            self._db.create_index('profile', cols)
+            pass
+        self._db.commit()
+        self._hist = ZwiHistory(db=self._db)
+        if slurp:
+            self._slurp()
+            pass
         pass
 
+    @classmethod
+    def parse_pred(cls, pred):
+        """Parse a predicate such as `ftp>=300` or `lastName~Smi%`
+        into a (column, operator, value) tuple.
+        """
+        ops = '|'.join(re.escape(o) for o in
+                       sorted(cls.OPS.keys(), key=len, reverse=True))
+        m = re.match(rf'^\s*(\w+)\s*({ops})\s*(.*?)\s*$', pred)
+        if m is None:
+            raise SystemExit(f'Cannot parse predicate: {pred}')
+        return m.group(1), m.group(2), m.group(3)
+
+    def query(self, where=[], order=[], limit=None):
+        """Query the profile DB, returning a generator of ZwiProfile().
+          where - list of (column, operator, value) predicates, all of
+                  which must hold.  Operators are those in OPS, `~` being
+                  SQL LIKE.
+          order - list of column names, prefixed by `-` for descending.
+          limit - return at most this many.
+        The predicates and ordering are compiled into SQL, so the indexed
+        columns (see INDEXES) are cheap to query.
+        """
+        terms = []
+        args = []
+        for (col, op, val) in where:
+            if col not in self._types:
+                raise SystemExit(f'Unknown column: {col}')
+            if op not in self.OPS:
+                raise SystemExit(f'Unknown operator: {op}')
+            if self._types[col] == 'INT':
+                try:
+                    val = int(val)
+                except ValueError:
+                    raise SystemExit(f'{col} requires an integer: {val}')
+                pass
+            terms.append(f'{col} {self.OPS[op]} ?')
+            args.append(val)
+            pass
+
+        keys = []
+        for col in order:
+            desc = col.startswith('-')
+            col = col.lstrip('-+')
+            if col not in self._types:
+                raise SystemExit(f'Unknown column: {col}')
+            keys.append(f'{col} DESC' if desc else col)
+            pass
+
+        g = self._db.select('profile', self._cols, where=' AND '.join(terms),
+                            args=args, order=', '.join(keys), limit=limit)
+        return (ZwiProfile.from_seq(r) for r in g())
+
     def _slurp(self):
         """Slurp in the table data."""
         g = self._db.table_rows('profile', self._cols)
@@ -1144,15 +2012,52 @@ class ZwiPro(object):
             self._lookup[id] = len(self._pro) - 1
 
             count = count + 1
-            if count <= 10 and verbo_p(2):
-                verbo(3, f'{r=}')
+            if count <= 10 and _pro_log.verbo_p(2):
+                _pro_log.verbo(3, 'r=%r', r)
             else:
-                verbo(1, f'\rslurped profile: {count}', end='')
+                _pro_log.verbo(1, '\rslurped profile: %d', count, end='')
                 pass
             pass
-        verbo(1 * int(count > 0), '')
+        _pro_log.verbo(1 * int(count > 0), '')
         pass
 
+    @property
+    def index(self):
+        """Search index over the profiles, built on first use."""
+        if self._index is None:
+            idx = SearchIndex()
+            names = ('id', 'firstName', 'lastName',
+                     'countryAlpha3', 'playerType')
+            cn = [self._cols.index(c) for c in names]
+            for r in self._pro:
+                if isinstance(r, dict):
+                    idx.add(*[r.get(c, '') for c in names])
+                else:
+                    idx.add(*[r[i] for i in cn])
+                    pass
+                pass
+            self._index = idx
+            pass
+        return self._index
+
+    def _index_add(self, p):
+        if self._index is not None:
+            self._index.add(p.id, p.firstName, p.lastName,
+                            p.countryAlpha3, p.playerType)
+            pass
+        pass
+
+    def search(self, text='', country=None, ptype=None, limit=None):
+        """Search the profiles by name, country and player type.
+        Returns the matching ZwiProfile() list, ordered by name (the first
+        `limit` of them, if given).
+        """
+        zids = self.index.search(text, country=country, ptype=ptype)
+        rv = [self.lookup(zid) for zid in zids]
+        rv.sort(key=lambda p: ((p.lastName or '').lower(),
+                               (p.firstName or '').lower()))
+        return rv[:limit]
+
     def lookup(self, zid, fetch=False):
         """Lookup `zid` in cache, converting to ZwiProfile if found.
         Inputs:
@@ -1170,30 +2075,10 @@ class ZwiPro(object):
             return rv
         return self.update(zid) if fetch else None
 
-    def fetch_profile(self, zid):
-        count = 0
-        while True:
-            try:
-                rsp = self.pr.request.json(f'/api/profiles/{zid}')
-            except zwift.error.RequestException as e:
-                # This is derived from BaseExeption, not Exception...
-                print(f'error trying to obtain profile for {zid}: {e}')
-                rsp = None
-            except ConnectionError as e:
-                #  retry this some #  of times
-                count += 1
-                if count < 8:
-                    print(f'retry: {count} of Connection reset',
-                          f'trying to obtain profile for {zid}: {e}')
-                    continue
-                raise SystemExit(
-                    f'Connection reset trying to obtain profile for {zid}: {e}'
-                )
-            except Exception as e:
-                print(f'{type(e)} {e}')
-                raise SystemExit(f'Some error trying to update id {zid}.')
-            return rsp
-        pass
+    def fetch_profile(self, zid, get=None):
+        """Fetch profile `zid` from Zwift, using `get(req)` if supplied."""
+        return fetch_profile(self.pr.request.json if get is None else get,
+                             zid)
 
     def update(self, zid=None, force=False):
         """Update the profile for `zid` if not currently in the DB.
@@ -1207,17 +2092,84 @@ class ZwiPro(object):
         rsp = self.fetch_profile(zid)
         if rsp is None:
             return None
+        return self.store(zid, rsp)
+
+    def update_all(self, zids, force=False, report=None, stages={}):
+        """As for update(), for each of `zids`, through a Pipeline: the
+        profiles are fetched, decoded and compared with the cached ones
+        concurrently (see STAGES, overridden by `stages`), and those
+        changed are written in batches by the one writer.
+        `report(zid, old, new)` is called by the writer for each: `new`
+        is None if the fetch failed, and `old` itself if unchanged.
+        Returns the Pipeline, for its counters.
+        """
+        conf = dict(self.STAGES, **stages)
+        get = self.pr.request.json
+        seen = set()
 
-        new = ZwiProfile.from_zwift(rsp)
+        def todo():
+            for zid in zids:
+                if zid in seen or not force and zid in self._lookup:
+                    continue
+                seen.add(zid)
+                yield zid
+                pass
+            pass
+
+        def fetch(zid):
+            return zid, fetch_profile(get, zid)
+
+        def decode(item):
+            (zid, rsp) = item
+            return zid, rsp, (None if rsp is None else
+                              ZwiProfile.from_zwift(rsp))
+
+        def diff(item):
+            (zid, rsp, new) = item
+            old = self.lookup(zid)
+            if new is not None and new == old:
+                new = old
+                pass
+            return zid, rsp, new, old
+
+        def write(batch):
+            with self._db.batch():
+                for (zid, rsp, new, old) in batch:
+                    if new is not None and new is not old:
+                        new = self.store(zid, rsp, new)
+                        pass
+                    if report is not None:
+                        report(zid, old, new)
+                        pass
+                    pass
+                pass
+            pass
+
+        pipe = Pipeline([
+            Stage('fetch', fetch, conf['fetch']),
+            Stage('decode', decode, conf['decode']),
+            Stage('diff', diff, conf['diff']),
+            Stage('write', write, conf['write'], batch=self.BATCH),
+        ], source='zid')
+        pipe.run(todo())
+        pipe.report()
+        return pipe
+
+    def store(self, zid, rsp, new=None):
+        """Store profile `rsp`, as fetched from Zwift for `zid` (and
+        decoded as `new`, if already done)."""
+        new = ZwiProfile.from_zwift(rsp) if new is None else new
+        self._hist.record(new, self.lookup(zid))
         new.addDate = f'{datetime.now().isoformat(timespec="minutes")}'
         # update cache
         rsp[self._cols.index('addDate')] = new.addDate
         if zid in self._lookup:
             self._pro[self._lookup[zid]] = rsp
-        else:
+        elif self._slurped:
             self._pro.append(rsp)
             self._lookup[zid] = len(self._pro) - 1
             pass
+        self._index_add(new)
         self._db.row_replace('profile', new.column_names(),
                              new.column_values())
         return new
@@ -1230,21 +2182,23 @@ class ZwiPro(object):
         if rsp is None:
             return None
 
-        debug(1, f'/api/profiles/{old.id} => {rsp}')
+        _pro_log.debug(1, '/api/profiles/%s => %s', old.id, rsp)
         new = ZwiProfile.from_zwift(rsp)
-        debug(1, f'from_zwift => {new=}')
+        _pro_log.debug(1, 'from_zwift => new=%r', new)
 
-        debug(1, f'{old=}')
+        _pro_log.debug(1, 'old=%r', old)
         if old == new:
             return old
         else:
-            debug(1, f'{old.last_difference=}')
+            _pro_log.debug(1, 'old.last_difference=%r', old.last_difference)
             pass
 
+        self._hist.record(new, old)
         new.addDate = f'{datetime.now().isoformat(timespec="minutes")}'
         # update cache
         rsp[self._cols.index('addDate')] = new.addDate
         self._pro[self._lookup[old.id]] = rsp
+        self._index_add(new)
         # update DB
         self._db.row_replace('profile', new.column_names(),
                              new.column_values())
@@ -1252,9 +2206,32 @@ class ZwiPro(object):
 
     def delete(self, zid):
         """delete entry from local DB."""
+        if self._index is not None:
+            self._index.remove(zid)
+            pass
         self._db.row_delete('profile', 'id', zid)
         pass
 
+    def rebuild(self, archive, workers=None):
+        """Regenerate the `profile` table from the latest archived
+        responses.  Returns the number of profiles written."""
+        cols = ', '.join(self._cols)
+        count = 0
+        with self._db.lock:
+            for vals in archive.profiles(workers=workers):
+                self._db.execute(f'REPLACE INTO profile ({cols})'
+                                 f' VALUES({", ".join(vals)});')
+                count += 1
+                _pro_log.verbo(1, '\rrebuilt profile: %d', count, end='')
+                pass
+            self._db.commit()
+            pass
+        _pro_log.verbo(1, '') if count else None
+        self._pro = []
+        self._lookup = {}
+        self._index = None
+        return count
+
     class Printer():
         fmt = [
             ('date',     ('{:18.18s} ',  '{p.addDate:18.18s} ')),
@@ -1317,3 +2294,698 @@ class ZwiPro(object):
             pass
         pass
     pass
+
+
+class ZwiHistory(object):
+    """Append-only history of the profiles.
+    Each row of the `history` table holds, as a JSON object, only those
+    columns of profile `id` which changed at time `ts`.  The first row
+    for a profile is a full snapshot, from which the later ones are
+    deltas, so the table grows with the number of changes rather than
+    the number of refreshes.
+    """
+
+    COLS = [
+        'id INT',
+        'ts TEXT',
+        'delta TEXT',
+        'PRIMARY KEY (id, ts)',
+    ]
+
+    # columns not worth a history entry
+    IGNORE = ['addDate']
+
+    def __init__(self, db=None, create=False):
+        self._db = db
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='profile.db'),
+                                           create=create)
+            pass
+        self._db.create_table('history', self.COLS)
+        self._db.commit()
+        pass
+
+    def _append(self, zid, ts, delta):
+        # two changes within the second: merge them.
+        self._db.execute('INSERT INTO history (id, ts, delta) VALUES (?, ?, ?)'
+                         ' ON CONFLICT (id, ts) DO UPDATE SET'
+                         ' delta = json_patch(delta, excluded.delta)',
+                         (zid, ts, json.dumps(delta, separators=(',', ':'))))
+        pass
+
+    def _snapshot(self, p):
+        d = p.column_dict()
+        for c in self.IGNORE:
+            d.pop(c, None)
+            pass
+        return d
+
+    def record(self, new, old=None, ts=None):
+        """Record ZwiProfile `new`, as of `ts` (default now).
+        `old` is the profile as we had it, if any.  It provides the
+        snapshot for a profile without history, else saves reading the
+        history back.  Returns the delta recorded (empty if none).
+        """
+        ts = datetime.now().isoformat(timespec='seconds') if ts is None else ts
+        has = self._db.read('SELECT 1 FROM history WHERE id = ? LIMIT 1',
+                            (new.id,)).fetchone() is not None
+        base = None
+        if old is not None:
+            cur = self._snapshot(old)
+            if not has:     # start from what we had, when we got it
+                base = (min(old.addDate or ts, ts), cur)
+                pass
+        else:
+            cur = self.as_of(new.id, ts, raw=True) or {}
+            pass
+
+        delta = {}
+        for (k, v) in self._snapshot(new).items():
+            if k not in cur or cur[k] != v:
+                delta[k] = v
+                pass
+            pass
+        with self._db.lock:
+            if base is not None:
+                self._append(new.id, *base)
+                pass
+            if delta:
+                self._append(new.id, ts, delta)
+                pass
+            self._db.commit()
+            pass
+        return delta
+
+    def as_of(self, zid, when=None, raw=False):
+        """Rebuild profile `zid` as it was at `when` (an ISO date/time, a
+        date meaning its start; default now).  Returns a ZwiProfile (the column dict if
+        `raw`), or None if there is no history that early.
+        """
+        when = datetime.now().isoformat() if when is None else when
+        cur = None
+        for (delta,) in self._db.read('SELECT delta FROM history'
+                                      ' WHERE id = ? AND ts <= ? ORDER BY ts',
+                                      (zid, when)).fetchall():
+            cur = {} if cur is None else cur
+            cur.update(json.loads(delta))
+            pass
+        if cur is None or raw:
+            return cur
+        cols = ZwiProfile.column_names()
+        p = ZwiProfile.from_seq([cur.get(c) for c in cols])
+        p.addDate = when
+        return p
+
+    def changes(self, zid):
+        """Return the list of (ts, delta) for profile `zid`."""
+        return [(ts, json.loads(d)) for (ts, d) in
+                self._db.read('SELECT ts, delta FROM history WHERE id = ?'
+                              ' ORDER BY ts', (zid,)).fetchall()]
+
+    def series(self, col, zid=None, since='', until=None):
+        """Return the time series of column `col` (eg. `ftp`, `weight`) of
+        profile `zid` (or of all profiles) as a list of (id, ts, value),
+        one per change, ordered by id and time.
+        """
+        if col not in ZwiProfile.column_names() or col in self.IGNORE:
+            raise SystemExit(f'Unknown column: {col}')
+        path = f'$.{col}'
+        exe = ('SELECT id, ts, json_extract(delta, ?) FROM history'
+               ' WHERE json_type(delta, ?) IS NOT NULL AND ts >= ?')
+        args = [path, path, since]
+        if zid is not None:
+            exe += ' AND id = ?'
+            args.append(zid)
+            pass
+        if until is not None:
+            exe += ' AND ts <= ?'
+            args.append(until)
+            pass
+        return self._db.read(exe + ' ORDER BY id, ts', args).fetchall()
+
+    pass
+
+
+class ZwiSchedule(object):
+    """Staleness-driven refresh schedule for the profiles.
+    Each profile is due for refresh `days` after it was last checked
+    (or, if never checked, after its `addDate`).  `days` halves when a
+    check finds a change and doubles when it does not, so it tracks how
+    often the profile changes.  Hot profiles (riding, likely in game, or
+    in our follow lists) are due HOT times as often, and go first.
+    """
+
+    COLS = [
+        'id INT PRIMARY KEY',
+        'last TEXT',
+        'days REAL',
+        'checks INT',
+        'changes INT',
+    ]
+
+    FIRST_DAYS = 7.0    # for profiles never checked
+    MIN_DAYS = 1.0
+    MAX_DAYS = 120.0
+    HOT = 4
+
+    def __init__(self, db=None, create=False):
+        self._db = db
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='profile.db'),
+                                           create=create)
+            pass
+        self._db.create_table('schedule', self.COLS)
+        self._db.commit()
+        pass
+
+    @staticmethod
+    def _date(d):
+        try:
+            return datetime.fromisoformat(d)
+        except (TypeError, ValueError):
+            return datetime.min
+        pass
+
+    def due(self, hot=(), budget=None, now=None):
+        """Return the Zwift IDs of the profiles due for refresh at `now`,
+        hot ones (and those in `hot`) first, then most overdue first.
+        At most `budget` are returned.
+        """
+        now = datetime.now() if now is None else now
+        rv = []
+        for (zid, added, riding, ingame, last, days) in self._db.read(
+                'SELECT p.id, p.addDate, p.riding, p.likelyInGame,'
+                ' s.last, s.days FROM profile p'
+                ' LEFT JOIN schedule s ON s.id = p.id').fetchall():
+            if last is None:
+                (last, days) = (added, self.FIRST_DAYS)
+                pass
+            h = bool(riding or ingame or zid in hot)
+            age = (now - self._date(last)).total_seconds() / 86400
+            over = age / (days / self.HOT if h else days)
+            if over >= 1:
+                rv.append((not h, -over, zid))
+                pass
+            pass
+        rv.sort()
+        return [zid for (_, _, zid) in rv[:budget]]
+
+    def done(self, zid, changed, now=None):
+        """Note that `zid` was checked at `now`, and whether it had
+        `changed`."""
+        now = datetime.now() if now is None else now
+        r = self._db.read('SELECT days FROM schedule WHERE id = ?',
+                          (zid,)).fetchone()
+        days = self.FIRST_DAYS if r is None else r[0]
+        if changed:
+            days = max(self.MIN_DAYS, days / 2)
+        else:
+            days = min(self.MAX_DAYS, days * 2)
+            pass
+        with self._db.lock:
+            self._db.execute(
+                'INSERT INTO schedule (id, last, days, checks, changes)'
+                ' VALUES (?, ?, ?, 1, ?) ON CONFLICT (id) DO UPDATE SET'
+                ' last = excluded.last, days = excluded.days,'
+                ' checks = checks + 1, changes = changes + excluded.changes',
+                (zid, now.isoformat(timespec='minutes'), days, int(changed)))
+            self._db.commit()
+            pass
+        pass
+
+    def failed(self, zid, now=None):
+        """Note that `zid` could not be checked at `now`: it is not due
+        again for its usual interval, so those which keep failing do not
+        take the budget from the rest."""
+        now = datetime.now() if now is None else now
+        with self._db.lock:
+            self._db.execute(
+                'INSERT INTO schedule (id, last, days, checks, changes)'
+                ' VALUES (?, ?, ?, 0, 0) ON CONFLICT (id) DO UPDATE SET'
+                ' last = excluded.last',
+                (zid, now.isoformat(timespec='minutes'), self.FIRST_DAYS))
+            self._db.commit()
+            pass
+        pass
+
+    def forget(self, zid):
+        """Forget the schedule of `zid` (as when its profile is deleted)."""
+        with self._db.lock:
+            self._db.execute('DELETE FROM schedule WHERE id = ?', (zid,))
+            self._db.commit()
+            pass
+        pass
+
+    pass
+
+
+def _decode_profiles(chunk):
+    """Worker: decode archived (ts, blob) profiles to column values."""
+    rv = []
+    for (ts, blob) in chunk:
+        p = ZwiProfile.from_zwift(json.loads(zlib.decompress(blob)))
+        p.addDate = ts[:16]
+        rv.append(p.column_values())
+        pass
+    return rv
+
+
+def _decode_follows(chunk):
+    """Worker: decode archived (tab, blob) list entries to
+    (zid, status, fav, column values)."""
+    rv = []
+    for (tab, blob) in chunk:
+        d = json.loads(zlib.decompress(blob))
+        if tab == 'followers':
+            f = ZwiFollowers.wers(d)
+            zid = f.followerId
+        else:
+            f = ZwiFollowers.wees(d)
+            zid = f.followeeId
+            pass
+        rv.append((zid, f.status, f.isFolloweeFavoriteOfFollower,
+                   f.column_values()))
+        pass
+    return rv
+
+
+class ZwiArchive(object):
+    """Archive of the raw Zwift API responses, so the DB can be
+    regenerated (`zwi rebuild`) without refetching, should the schema
+    change.
+    Responses are stored as zlib compressed canonical JSON in the `blob`
+    table, keyed by their SHA1, so identical content is held once.  The
+    elements of list responses (eg. a followers page) are stored as
+    separate blobs, the page itself being the list of their hashes: an
+    unchanged rider is stored once however many pages they appear in.
+    `response` indexes the blobs by request and time.
+    """
+
+    enabled = True  # record() anything?
+    CHUNK = 256     # blobs per decode job
+
+    _archives = {}  # path => ZwiArchive
+
+    def __init__(self, db=None, create=True):
+        self._db = db
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='archive.db'),
+                                           create=create)
+            pass
+        self._db.create_table('blob', ['hash TEXT PRIMARY KEY', 'data BLOB'])
+        self._db.create_table('response', ['req TEXT', 'ts TEXT',
+                                           'hash TEXT', 'list INT',
+                                           'PRIMARY KEY (req, ts)'])
+        self._db.commit()
+        pass
+
+    @classmethod
+    def record(cls, req, data):
+        """Archive response `data` to `req`, in the usual archive."""
+        if not cls.enabled:
+            return
+        path = get_zpath(fname='archive.db')
+        if path not in cls._archives:
+            cls._archives[path] = ZwiArchive()
+            pass
+        cls._archives[path].put(req, data)
+        pass
+
+    def _put(self, data):
+        raw = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+        h = hashlib.sha1(raw).hexdigest()
+        self._db.execute('INSERT OR IGNORE INTO blob (hash, data)'
+                         ' VALUES (?, ?)', (h, zlib.compress(raw)))
+        return h
+
+    def put(self, req, data, ts=None):
+        """Archive response `data` to request `req` at `ts` (default now)."""
+        ts = datetime.now().isoformat(timespec='seconds') if ts is None else ts
+        with self._db.lock:
+            if isinstance(data, list):
+                h = self._put([self._put(e) for e in data])
+            else:
+                h = self._put(data)
+                pass
+            self._db.execute('REPLACE INTO response (req, ts, hash, list)'
+                             ' VALUES (?, ?, ?, ?)',
+                             (req, ts, h, int(isinstance(data, list))))
+            self._db.commit()
+            pass
+        pass
+
+    def _blob(self, h):
+        r = self._db.read('SELECT data FROM blob WHERE hash = ?',
+                          (h,)).fetchone()
+        if r is None:
+            raise Error(f'archive: missing blob {h}')
+        return r[0]
+
+    def get(self, req, when=None):
+        """Return the latest response to `req` at or before `when`."""
+        when = datetime.now().isoformat() if when is None else when
+        r = self._db.read('SELECT hash, list FROM response'
+                          ' WHERE req = ? AND ts <= ? ORDER BY ts DESC LIMIT 1',
+                          (req, when)).fetchone()
+        if r is None:
+            return None
+        data = json.loads(zlib.decompress(self._blob(r[0])))
+        if r[1]:
+            data = [json.loads(zlib.decompress(self._blob(h))) for h in data]
+            pass
+        return data
+
+    def stats(self):
+        """Return (responses, blobs, compressed bytes)."""
+        (n,) = self._db.read('SELECT COUNT(*) FROM response').fetchone()
+        (b, z) = self._db.read('SELECT COUNT(*), TOTAL(LENGTH(data))'
+                               ' FROM blob').fetchone()
+        return n, b, int(z)
+
+    @classmethod
+    def _decode(cls, fun, todo, workers):
+        """Run `fun` over `todo` in chunks, in parallel if worthwhile,
+        yielding the results in order."""
+        chunks = [todo[i:i+cls.CHUNK] for i in range(0, len(todo), cls.CHUNK)]
+        if workers == 1 or len(chunks) < 2:
+            for c in chunks:
+                yield from fun(c)
+                pass
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for res in pool.map(fun, chunks):
+                yield from res
+                pass
+            pass
+        pass
+
+    def profiles(self, workers=None):
+        """Generate the column values of the latest archived profile of
+        each user, decoded by `workers` processes."""
+        todo = self._db.read("SELECT MAX(r.ts), b.data FROM response r"
+                             " JOIN blob b ON b.hash = r.hash"
+                             " WHERE r.req GLOB '/api/profiles/[0-9]*'"
+                             " AND r.list = 0 GROUP BY r.req").fetchall()
+        return self._decode(_decode_profiles, todo, workers)
+
+    def owners(self):
+        """Zwift IDs of the users whose lists have been archived."""
+        rv = set()
+        for (req,) in self._db.read("SELECT DISTINCT req FROM response"
+                                    " WHERE req GLOB '/api/profiles/*/follo*'"
+                                    " AND req GLOB '*start=0&*'").fetchall():
+            rv.add(int(req.split('/')[3]))
+            pass
+        return sorted(rv)
+
+    def follows(self, uid, tab, workers=None):
+        """Return the latest archived `tab` ('followers' or 'followees')
+        list of `uid` as (zid, status, fav, column values), or None.
+        """
+        pre = f'/api/profiles/{uid}/{tab}?start='
+        r = self._db.read('SELECT MAX(ts) FROM response WHERE req GLOB ?',
+                          (pre + '0&*',)).fetchone()
+        if r is None or r[0] is None:
+            return None
+        pages = []
+        # the pages fetched along with the latest first page
+        for (req, ts, h) in self._db.read(
+                'SELECT req, MAX(ts), hash FROM response'
+                ' WHERE req GLOB ? AND ts >= ? GROUP BY req',
+                (pre + '*', r[0])).fetchall():
+            start = int(req[len(pre):].split('&')[0])
+            pages.append((start, json.loads(zlib.decompress(self._blob(h)))))
+            pass
+        pages.sort()
+        todo = [(tab, self._blob(h)) for (_, hs) in pages for h in hs]
+        return list(self._decode(_decode_follows, todo, workers))
+
+    pass
+
+
+GRAPH_WERS = 0  # edge direction: `other` follows `owner`
+GRAPH_WEES = 1  # edge direction: `owner` follows `other`
+
+
+class ZwiGraph(object):
+    """Follower graph across Zwift users.
+    The `edge` table, kept in the profile DB so it joins to `profile`,
+    holds one row per (owner, direction, other), where `owner` is a user
+    whose followers/followees lists we have fetched.  Edges which vanish
+    from a list are retained with their `delDate` set.
+    ZwiUser records our own lists here too (as well as in its DB).
+    """
+
+    COLS = [
+        'owner INT',
+        'other INT',
+        'dir INT',
+        'status TEXT',
+        'fav INT',
+        'addDate TEXT',
+        'delDate TEXT',
+        'PRIMARY KEY (owner, dir, other)',
+    ]
+
+    # reverse lookups: who has `other` as follower/followee?
+    INDEXES = [
+        ['other', 'dir'],
+    ]
+
+    TABS = {GRAPH_WERS: 'followers', GRAPH_WEES: 'followees'}
+
+    def __init__(self, db=None, create=False):
+        self._db = db
+        self._pr = None
+        self._cl = None
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='profile.db'),
+                                           create=create)
+            pass
+        self._db.create_table('edge', self.COLS)
+        for cols in self.INDEXES:
+            self._db.create_index('edge', cols)
+            pass
+        self._db.commit()
+        pass
+
+    @property
+    def pr(self):
+        if not self._pr:
+            self._cl, self._pr = zwi_init()
+            pass
+        return self._pr
+
+    def _ids(self, exe, args):
+        return [r[0] for r in self._db.read(exe, args).fetchall()]
+
+    def owners(self):
+        """Zwift IDs of users whose lists have been recorded."""
+        return self._ids('SELECT DISTINCT owner FROM edge ORDER BY owner', ())
+
+    def record(self, owner, dir, edges):
+        """Record the complete current `dir` list of `owner`.
+          edges - iterable of (other, status, fav, addDate) tuples;
+                  addDate may be None, meaning now.
+        Edges not in the list are marked deleted.  Returns the number of
+        (new, deleted) edges.
+        """
+        now = f'{datetime.now().isoformat(timespec="minutes")}'
+        cur = set(self._ids('SELECT other FROM edge WHERE owner = ?'
+                            ' AND dir = ? AND delDate IS NULL', (owner, dir)))
+        rows = []
+        for (other, status, fav, added) in edges:
+            rows.append((owner, other, dir, status, int(bool(fav)),
+                         now if added is None else added))
+            pass
+        seen = set(r[1] for r in rows)
+        gone = [(now, owner, dir, o) for o in cur - seen]
+        with self._db.lock:
+            self._db.executemany(
+                'INSERT INTO edge'
+                ' (owner, other, dir, status, fav, addDate, delDate)'
+                ' VALUES (?, ?, ?, ?, ?, ?, NULL)'
+                ' ON CONFLICT (owner, dir, other) DO UPDATE SET'
+                ' status = excluded.status, fav = excluded.fav,'
+                ' addDate = CASE WHEN delDate IS NULL THEN addDate'
+                ' ELSE excluded.addDate END, delDate = NULL', rows)
+            self._db.executemany(
+                'UPDATE edge SET delDate = ?'
+                ' WHERE owner = ? AND dir = ? AND other = ?', gone)
+            self._db.commit()
+            pass
+        return len(seen - cur), len(gone)
+
+    def drop(self, owner):
+        """Forget everything recorded for `owner`."""
+        with self._db.lock:
+            self._db.execute('DELETE FROM edge WHERE owner = ?', (owner,))
+            self._db.commit()
+            pass
+        pass
+
+    @classmethod
+    def fetch(cls, uid, dir, get):
+        """Fetch the `dir` list of `uid` from Zwift, using `get(req)`, as a
+        list of edges for record()."""
+        tab = cls.TABS[dir]
+        sym = 'followerId' if dir == GRAPH_WERS else 'followeeId'
+        edges = []
+        start = 0
+        while True:
+            req = f'/api/profiles/{uid}/{tab}?start={start}&limit=200'
+            fe = get(req)
+            ZwiArchive.record(req, fe)
+            if len(fe) == 0:
+                break
+            for f in fe:
+                start += 1
+                edges.append((f[sym], f.get('status', ''),
+                              f.get('isFolloweeFavoriteOfFollower', False),
+                              None))
+                pass
+            _graph_log.verbo(2, '\rfetch %s %s: %d', uid, tab, start, end='')
+            pass
+        _graph_log.verbo(2, '') if start else None
+        return edges
+
+    def sync(self, uid, pro=None):
+        """Fetch the followers/followees lists of `uid` from Zwift and
+        record them.  If `pro` (a ZwiPro) is given, any profiles we do
+        not have are fetched too.
+        """
+        for (dir, tab) in self.TABS.items():
+            edges = self.fetch(uid, dir, self.pr.request.json)
+            new, gone = self.record(uid, dir, edges)
+            _graph_log.verbo(1, '%s %s: %d new, %d gone', uid, tab, new, gone)
+
+            if pro is not None:
+                for (cnt, e) in enumerate(edges):
+                    pro.update(e[0])
+                    _graph_log.verbo(0, '\rupdate profile of %s: %d', tab, cnt,
+                                     end='')
+                    pass
+                _graph_log.verbo(0, '') if edges else None
+                pass
+            pass
+        pass
+
+    def followers(self, zid):
+        """Zwift IDs of the known followers of `zid`: those in its own
+        followers list, and those having `zid` in their followees list.
+        """
+        return self._ids('SELECT other FROM edge WHERE owner = ? AND dir = ?'
+                         ' AND delDate IS NULL'
+                         ' UNION SELECT owner FROM edge'
+                         ' WHERE other = ? AND dir = ? AND delDate IS NULL',
+                         (zid, GRAPH_WERS, zid, GRAPH_WEES))
+
+    def followees(self, zid):
+        """Zwift IDs of the known followees of `zid`."""
+        return self._ids('SELECT other FROM edge WHERE owner = ? AND dir = ?'
+                         ' AND delDate IS NULL'
+                         ' UNION SELECT owner FROM edge'
+                         ' WHERE other = ? AND dir = ? AND delDate IS NULL',
+                         (zid, GRAPH_WEES, zid, GRAPH_WERS))
+
+    def mutual(self, zid):
+        """Zwift IDs which both follow, and are followed by, `zid`."""
+        return sorted(set(self.followers(zid)) & set(self.followees(zid)))
+
+    def common(self, a, b, dir=GRAPH_WEES):
+        """Zwift IDs in the `dir` lists of both `a` and `b`."""
+        return self._ids('SELECT e.other FROM edge e JOIN edge f'
+                         ' ON f.other = e.other AND f.dir = e.dir'
+                         ' WHERE e.owner = ? AND f.owner = ? AND e.dir = ?'
+                         ' AND e.delDate IS NULL AND f.delDate IS NULL',
+                         (a, b, dir))
+
+    def profiles(self, zid, dir, cols=None):
+        """Return a generator of the `profile` rows (`cols`, by default
+        all) for the `dir` list of `zid`, as recorded."""
+        cols = ZwiProfile.column_names() if cols is None else cols
+        sel = ', '.join(f'p.{c}' for c in cols)
+        r = self._db.read(f'SELECT {sel} FROM edge e'
+                          ' JOIN profile p ON p.id = e.other'
+                          ' WHERE e.owner = ? AND e.dir = ?'
+                          ' AND e.delDate IS NULL ORDER BY e.addDate',
+                          (zid, dir))
+
+        def gen():
+            while True:
+                ar = r.fetchmany(200)
+
+                if not ar:
+                    break
+                for e in ar:
+                    yield e
+                    pass
+                pass
+            r.close()
+            pass
+
+        return gen
+
+    def rebuild(self, archive, workers=None):
+        """Regenerate the edges from the latest archived lists."""
+        for uid in archive.owners():
+            for (dir, tab) in self.TABS.items():
+                ents = archive.follows(uid, tab, workers=workers)
+                if ents is not None:
+                    self.record(uid, dir, [e[:3] + (None,) for e in ents])
+                    pass
+                pass
+            pass
+        pass
+
+    def migrate(self, remove=False):
+        """Import the per-user DBs formerly written by `zwi inspect`
+        (~/.zwi/<uid>/zwi.db).  If `remove` is set, each DB is removed
+        once imported.  The riders in their lists are added to the
+        profiles (those we have already are left as they are), so none is
+        lost with the DB.  Returns the list of users imported.
+        """
+        ZwiPro(db=self._db, slurp=False)    # (ensure the profile table)
+        pcols = ZwiProfile.column_names()
+        zdir = get_zdir()
+        done = []
+        for name in sorted(os.listdir(zdir)):
+            path = get_zpath(dname=zdir + name + os.sep)
+            if not name.isdigit() or not os.path.isfile(path):
+                continue
+            db = DataBase.db_connect(path)
+            for (dir, tab) in self.TABS.items():
+                if not db.table_exists(tab):
+                    continue
+                sym = 'followerId' if dir == GRAPH_WERS else 'followeeId'
+                g = db.table_rows(tab, [sym, 'status',
+                                        'isFolloweeFavoriteOfFollower',
+                                        'addDate'])
+                self.record(int(name), dir, list(g()))
+
+                have = [r[1] for r in db.read(f'PRAGMA table_info({tab})')]
+                cols = [c for c in have if c in pcols and c != 'id']
+                rows = list(db.table_rows(tab, [sym] + cols)())
+                with self._db.lock:
+                    self._db.executemany(
+                        f'INSERT OR IGNORE INTO profile'
+                        f' (id, {", ".join(cols)})'
+                        f' VALUES ({", ".join("?" * (len(cols) + 1))})', rows)
+                    self._db.commit()
+                    pass
+                pass
+            db.close()
+            _graph_log.verbo(1, 'imported %s', path)
+            if remove:
+                for ext in ('', '-wal', '-shm'):
+                    if os.path.isfile(path + ext):
+                        os.remove(path + ext)
+                        pass
+                    pass
+                pass
+            done.append(int(name))
+            pass
+        return done
+
+    pass
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""Resumable crawl of the Zwift social graph."""
+
+from datetime import datetime
+
+from .util import Log
+from .core import DataBase, ZwiGraph, ZwiPro, fetch_profile, get_zpath
+from .shard import ApiBudget, ShardPool, zwift_session
+
+_crawl_log = Log('crawl')   # progress, and failed riders
+
+CRAWL_QUEUED = 0    # in the frontier
+CRAWL_DONE = 1      # visited
+CRAWL_FAILED = 2    # visited, but Zwift would not tell us
+
+
+def _crawl(get, zid, profiles):
+    """Worker: fetch the lists (and profile) of `zid`."""
+    lists = dict((dir, ZwiGraph.fetch(zid, dir, get))
+                 for dir in ZwiGraph.TABS)
+    rsp = None
+    if profiles:
+        get.take()
+        rsp = fetch_profile(get.raw, zid)
+        pass
+    return lists, rsp
+
+
+class ZwiCrawler(object):
+    """Breadth first crawl of the follower graph, recorded in ZwiGraph.
+    The frontier and the visited set are the `crawl` table in the
+    profile DB, checkpointed with what was recorded, so an interrupted
+    crawl resumes where it stopped.  The lists are fetched by a
+    ShardPool of threads or processes; this (the calling) thread alone
+    writes to the DB.
+    """
+
+    COLS = [
+        'id INT PRIMARY KEY',
+        'depth INT',
+        'state INT',
+        'ts TEXT',
+    ]
+
+    INDEXES = [
+        ['state', 'depth'],
+    ]
+
+    def __init__(self, db=None, create=False, profiles=True):
+        self._db = db
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='profile.db'),
+                                           create=create)
+            pass
+        self._db.create_table('crawl', self.COLS)
+        for cols in self.INDEXES:
+            self._db.create_index('crawl', cols)
+            pass
+        self._db.commit()
+        self._graph = ZwiGraph(db=self._db)
+        self._pro = ZwiPro(db=self._db, slurp=False) if profiles else None
+        pass
+
+    def reset(self):
+        """Forget the crawl state (but not what it recorded)."""
+        with self._db.lock:
+            self._db.execute('DELETE FROM crawl')
+            self._db.commit()
+            pass
+        pass
+
+    def seed(self, zids):
+        """Add `zids` to the frontier, at depth 0."""
+        with self._db.lock:
+            self._db.executemany('INSERT OR IGNORE INTO crawl'
+                                 ' (id, depth, state) VALUES (?, 0, ?)',
+                                 [(z, CRAWL_QUEUED) for z in zids])
+            self._db.commit()
+            pass
+        pass
+
+    def stats(self):
+        """Return the number of users (queued, done, failed)."""
+        n = dict(self._db.read('SELECT state, COUNT(*) FROM crawl'
+                               ' GROUP BY state').fetchall())
+        return tuple(n.get(s, 0) for s in (CRAWL_QUEUED, CRAWL_DONE,
+                                            CRAWL_FAILED))
+
+    def _frontier(self, n, busy):
+        """The next `n` queued users not `busy`, shallowest first.
+        (Read by the writer, to see the current batch.)"""
+        rows = self._db.execute('SELECT id, depth FROM crawl WHERE state = ?'
+                                ' ORDER BY depth, rowid LIMIT ?',
+                                (CRAWL_QUEUED, n + len(busy))).fetchall()
+        return [r for r in rows if r[0] not in busy][:n]
+
+    def _visit(self, zid, depth, lists, rsp, max_depth, max_size):
+        """Record what we fetched for `zid`, extending the frontier."""
+        for (dir, edges) in lists.items():
+            self._graph.record(zid, dir, edges)
+            pass
+        if rsp is not None:
+            self._pro.store(zid, rsp)
+            pass
+
+        new = []
+        if depth < max_depth:
+            new = sorted(set(e[0] for edges in lists.values() for e in edges))
+            pass
+        with self._db.lock:
+            if new and max_size is not None:
+                (n,) = self._db.execute('SELECT COUNT(*) FROM crawl').fetchone()
+                new = new[:max(0, max_size - n)]
+                pass
+            self._db.executemany('INSERT OR IGNORE INTO crawl'
+                                 ' (id, depth, state) VALUES (?, ?, ?)',
+                                 [(z, depth + 1, CRAWL_QUEUED) for z in new])
+            self._mark(zid, CRAWL_DONE)
+            pass
+        pass
+
+    def _mark(self, zid, state):
+        with self._db.lock:
+            self._db.execute('UPDATE crawl SET state = ?, ts = ? WHERE id = ?',
+                             (state, datetime.now().isoformat(
+                                 timespec='seconds'), zid))
+            self._db.commit()
+            pass
+        pass
+
+    def run(self, max_depth=2, max_size=None, workers=4, budget=None,
+            processes=False, batch=50, session=zwift_session):
+        """Crawl until the frontier is empty or the ApiBudget `budget` is
+        spent, following lists to `max_depth` from the seeds, and queueing
+        at most `max_size` users in all.  The fetches are spread over
+        `workers` threads, or processes if `processes` is set.  The
+        results are committed every `batch` users.
+        Returns the number visited.
+        """
+        budget = ApiBudget() if budget is None else budget
+        count = 0
+        if not self._frontier(1, ()):
+            return count
+        busy = {}   # zid => depth
+        with ShardPool(_crawl, workers, budget=budget, processes=processes,
+                       session=session) as pool, self._db.batch():
+            while True:
+                if len(busy) < 2 * workers and not budget.exhausted():
+                    for (zid, depth) in self._frontier(2 * workers -
+                                                       len(busy), busy):
+                        pool.submit(zid, self._pro is not None)
+                        busy[zid] = depth
+                        pass
+                    pass
+                if not busy:
+                    break
+                (zid, res, err) = pool.get()
+                depth = busy.pop(zid)
+                if err == 'exhausted':
+                    continue    # still queued, for next time
+                if err is not None:
+                    _crawl_log.debug(1, '%s: %s', zid, err)
+                    self._mark(zid, CRAWL_FAILED)
+                    continue
+                self._visit(zid, depth, *res, max_depth, max_size)
+                count += 1
+                if count % batch == 0:
+                    self._db.db.commit()
+                    pass
+                _crawl_log.verbo(1, '\rcrawled: %s (depth %s) requests: %s',
+                                 count, depth, budget.used, end='')
+                pass
+            pass
+        _crawl_log.verbo(1, '') if count else None
+        return count
+
+    pass
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""Long running `zwi daemon`, answering requests on a Unix socket."""
+
+import os
+import csv
+import io
+import json
+import queue
+import sqlite3 as sq
+import threading
+
+from .util import Log
+from .core import DataBase, ZwiPro, ZwiProfile, ZwiUser, get_zpath
+
+_daemon_log = Log('daemon')  # (re)loads, and failed requests
+
+
+def daemon_path():
+    return get_zpath(fname='zwi.sock')
+
+
+class DaemonDown(Exception):
+    """There is no daemon to answer."""
+    pass
+
+
+def _call(path, cmd, args):
+    """Send `cmd(**args)` to the daemon on `path`: its answer."""
+    import socket
+
+    if not os.path.exists(path):
+        raise DaemonDown(path)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+            s.sendall(json.dumps({'cmd': cmd, 'args': args}).encode() + b'\n')
+            s.shutdown(socket.SHUT_WR)
+            with s.makefile('rb') as f:
+                rsp = json.loads(f.readline() or b'null')
+                pass
+            pass
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise DaemonDown(path)
+    if rsp is None:
+        raise SystemExit(f'zwi daemon: no answer to {cmd}')
+    if 'error' in rsp:
+        raise SystemExit(f'zwi daemon: {rsp["error"]}')
+    return rsp['result']
+
+
+def daemon_call(cmd, path=None, **args):
+    """Have the daemon run `cmd(**args)`, returning its result.
+    Raises DaemonDown if there is no daemon listening (or we are not
+    to use one: see ZwiDaemon.enabled), and SystemExit if `cmd` failed.
+    """
+    path = daemon_path() if path is None else path
+    if not ZwiDaemon.enabled:
+        raise DaemonDown(path)
+    return _call(path, cmd, args)
+
+
+def daemon_running(path=None):
+    """The pid of the running daemon, or None (whether or not we are to
+    use it)."""
+    try:
+        return _call(daemon_path() if path is None else path, 'ping', {})
+    except DaemonDown:
+        return None
+    pass
+
+
+class ZwiDaemon(object):
+    """Keep the ZwiUser and ZwiPro caches (and their search indexes), and
+    the Zwift session, loaded, to answer requests on a Unix socket (see
+    `daemon_call()`).  Each request is one line of JSON, {cmd, args},
+    answered by one line, {result} or {error}.
+    Reads are answered by a thread per connection; the commands in
+    WRITES are queued for the one writer thread, which builds new caches
+    and swaps them in whole, so readers never see them change under them.
+    Should another process commit to the DBs (`pro-refresh`, `crawl`,
+    ...), the caches are reloaded before the next read.
+    """
+
+    enabled = True  # may `daemon_call()` use a running daemon?
+
+    WRITES = {'update', 'pro_update'}
+
+    def __init__(self, path=None):
+        self._path = daemon_path() if path is None else path
+        self._writes = queue.Queue()
+        self._server = None
+        self._mux = threading.RLock()   # (re)loading the caches
+        dbs = (DataBase.db_connect(),
+               DataBase.db_connect(get_zpath(fname='profile.db'),
+                                   create=True))
+        self._probes = [sq.connect(db.path, check_same_thread=False)
+                        for db in dbs]
+        self._caches = None     # (ZwiUser, ZwiPro, DB versions)
+        self.load()
+        pass
+
+    def _versions(self):
+        """The data_version of each DB, as seen by our probes: it changes
+        when anyone (including us) commits to the DB."""
+        with self._mux:
+            return tuple(db.execute('PRAGMA data_version').fetchone()[0]
+                         for db in self._probes)
+        pass
+
+    def _swap(self, usr, pro, vers):
+        """Swap in caches, built from the DBs at versions `vers`."""
+        usr.index
+        pro.index
+        with self._mux:
+            self._caches = (usr, pro, vers)
+            pass
+        _daemon_log.verbo(1, 'loaded %s followers, %s followees, %s profiles',
+                          len(usr.wers), len(usr.wees), len(pro))
+        pass
+
+    def load(self):
+        """(Re)load the caches, and build their indexes."""
+        with self._mux:
+            vers = self._versions()
+            self._swap(ZwiUser(), ZwiPro(create=True), vers)
+            pass
+        pass
+
+    def caches(self):
+        """The (ZwiUser, ZwiPro) to read, reloaded first should the DBs
+        have changed since they were loaded."""
+        with self._mux:
+            if self._caches[2] != self._versions():
+                _daemon_log.verbo(1, 'DBs changed: reloading')
+                self.load()
+                pass
+            return self._caches[:2]
+        pass
+
+    def dispatch(self, cmd, args):
+        """Run `cmd`, by the writer if it writes: {result} or {error}."""
+        fun = getattr(self, f'do_{cmd}', None)
+        if fun is None:
+            return {'error': f'unknown command: {cmd}'}
+        if cmd not in self.WRITES:
+            return self._run(fun, args)
+        rsp = queue.Queue(1)
+        self._writes.put((fun, args, rsp))
+        return rsp.get()
+
+    @staticmethod
+    def _run(fun, args):
+        # zwift's RequestException, among others, is a BaseException
+        try:
+            return {'result': fun(**args)}
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            _daemon_log.debug(1, '%s(%s): %r', fun.__name__, args, e)
+            return {'error': f'{e}'}
+        pass
+
+    def _writer(self):
+        """The one thread which writes to the DBs."""
+        while True:
+            (fun, args, rsp) = self._writes.get()
+            if fun is None:
+                break
+            rsp.put(self._run(fun, args))
+            pass
+        pass
+
+    def serve(self):
+        """Answer requests until stopped."""
+        import socketserver
+
+        if daemon_running(self._path) is not None:
+            raise SystemExit(f'zwi daemon already running on {self._path}')
+        if os.path.exists(self._path):
+            os.remove(self._path)   # left by one which died
+            pass
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    req = json.loads(self.rfile.readline())
+                    rsp = daemon.dispatch(req['cmd'], req.get('args', {}))
+                except (ValueError, KeyError, TypeError) as e:
+                    rsp = {'error': f'bad request: {e}'}
+                    pass
+                self.wfile.write(json.dumps(rsp).encode() + b'\n')
+                pass
+            pass
+
+        writer = threading.Thread(target=self._writer, daemon=True)
+        writer.start()
+        old = os.umask(0o177)   # the socket is for us alone
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(
+                self._path, Handler)
+        finally:
+            os.umask(old)
+            pass
+        self._server.daemon_threads = True
+        _daemon_log.verbo(0, 'zwi daemon %s listening on %s', os.getpid(),
+                          self._path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self._path)
+            self._writes.put((None, None, None))
+            writer.join()
+            for db in self._probes:
+                db.close()
+                pass
+            pass
+        pass
+
+    def do_stop(self):
+        """Stop serving (once this is answered)."""
+        threading.Thread(target=self._server.shutdown).start()
+        return os.getpid()
+
+    def do_ping(self):
+        return os.getpid()
+
+    def do_reload(self):
+        """Reload the caches now."""
+        self.load()
+        (usr, pro) = self.caches()
+        return [len(usr.wers), len(usr.wees), len(pro)]
+
+    def do_lookup(self, zid):
+        """The profile of `zid`, as a column_dict(), or None."""
+        p = self.caches()[1].lookup(zid)
+        return None if p is None else p.column_dict()
+
+    def do_list(self, which):
+        """The `which` ('wers' or 'wees') rows, and their columns."""
+        usr = self.caches()[0]
+        return {'cols': usr.cols, 'rows': list(getattr(usr, which))}
+
+    def do_search(self, text='', country=None, ptype=None, limit=None):
+        """The profiles matching, as column_dict()s."""
+        return [p.column_dict() for p in self.caches()[1].search(
+            text, country=country, ptype=ptype, limit=limit)]
+
+    def do_csv(self, which):
+        """The `which` rows, as CSV."""
+        usr = self.caches()[0]
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=usr.cols)
+        writer.writeheader()
+        for r in getattr(usr, which):
+            writer.writerow(dict(zip(usr.cols, r)))
+            pass
+        return out.getvalue()
+
+    def do_update(self):
+        """Update the followers/followees (and their profiles)."""
+        vers = self._versions()
+        usr = ZwiUser(update=True)
+        pro = ZwiPro(create=True)
+        pro.update(force=True)
+        self._swap(usr, pro, vers)
+        return [len(usr.wers), len(usr.wees)]
+
+    def do_pro_update(self, force=False):
+        """As for `zwi pro-update`: the number of profiles changed."""
+        vers = self._versions()
+        usr = self.caches()[0]
+        pro = ZwiPro(create=True)
+        (wer, wee) = (usr.cols.index('followerId'),
+                      usr.cols.index('followeeId'))
+        changed = [0]
+
+        def report(zid, old, new):
+            if new is not None and new is not old:
+                changed[0] += 1
+                pass
+            pass
+
+        pro.update_all([r[wer] for r in usr.wers] +
+                       [r[wee] for r in usr.wees],
+                       force=force, report=report)
+        self._swap(usr, pro, vers)
+        return changed[0]
+
+    @staticmethod
+    def profile(d):
+        """The ZwiProfile of a column_dict() from the daemon."""
+        return ZwiProfile.from_seq([d[c] for c in ZwiProfile.column_names()])
+
+    pass
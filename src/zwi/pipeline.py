@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""Staged pipelines, with bounded queues between the stages."""
+
+import time
+import queue
+import threading
+
+from .util import Log
+
+_pipe_log = Log('pipe')     # stage counters
+
+_END = object()     # end of input, one per worker
+
+
+class Stage(object):
+    """One stage of a Pipeline: `fun(item)` run by `workers` threads.
+    `fun` returns the item to pass on, or None to drop it; with `many`
+    set, it returns a list of items to pass on.  With `batch` set, `fun`
+    is given lists of up to that many items.
+    The counters are: `items` taken, `out` passed on, and the seconds
+    spent `busy` in `fun`, `idle` waiting for input, and `stalled`
+    waiting for the next stage to take our output (backpressure).
+    """
+
+    def __init__(self, name, fun, workers=1, many=False, batch=None):
+        self.name = name
+        self.fun = fun
+        self.workers = max(1, workers)
+        self.many = many
+        self.batch = batch
+        self.items = 0
+        self.out = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.stalled = 0.0
+        self._mux = threading.Lock()
+        pass
+
+    def count(self, items=0, out=0, busy=0.0, idle=0.0, stalled=0.0):
+        with self._mux:
+            self.items += items
+            self.out += out
+            self.busy += busy
+            self.idle += idle
+            self.stalled += stalled
+            pass
+        pass
+
+    @property
+    def rate(self):
+        """Items per busy second, per worker."""
+        return self.items / self.busy if self.busy > 0 else 0.0
+
+    def __str__(self):
+        return (f'{self.name:>8s}: {self.workers:2d} x {self.items:6d} in'
+                f' {self.out:6d} out {self.rate:9.1f}/s'
+                f' busy {self.busy:7.2f}s idle {self.idle:7.2f}s'
+                f' stalled {self.stalled:7.2f}s')
+
+    pass
+
+
+class Pipeline(object):
+    """Run items from a source through a sequence of Stages, each stage
+    feeding the next through a queue of at most `qsize` items, so that
+    when a stage falls behind, those before it wait for it (rather than
+    piling up the work in memory).
+    Iterating over the source is itself counted as a stage (`source`).
+    If any stage raises, the pipeline is drained and `run()` re-raises.
+    """
+
+    def __init__(self, stages, qsize=64, source='source'):
+        self.source = Stage(source, None)
+        self.stages = stages
+        self._qsize = qsize
+        self._stop = threading.Event()
+        self._error = None
+        pass
+
+    def stop(self):
+        """Stop taking from the source."""
+        self._stop.set()
+        pass
+
+    def _put(self, stage, q, item):
+        t0 = time.monotonic()
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self._error is not None:
+                    break   # no one is listening
+                pass
+            pass
+        stage.count(stalled=time.monotonic() - t0)
+        pass
+
+    def _emit(self, stage, q, rv):
+        """Pass the result `rv` of `stage.fun` on to `q`."""
+        rvs = (rv or []) if stage.many else ([] if rv is None else [rv])
+        for r in rvs:
+            if q is not None:
+                self._put(stage, q, r)
+                pass
+            pass
+        stage.count(out=len(rvs))
+        pass
+
+    def _call(self, stage, outq, arg, n):
+        if self._error is not None:
+            return  # draining
+        t0 = time.monotonic()
+        try:
+            rv = stage.fun(arg)
+        except BaseException as e:
+            self._error = self._error or e
+            self._stop.set()
+            return
+        stage.count(items=n, busy=time.monotonic() - t0)
+        self._emit(stage, outq, rv)
+        pass
+
+    def _worker(self, stage, inq, outq, left):
+        """Run `stage` on items from `inq`; the last worker of the stage
+        to finish passes the end of input on to the next stage."""
+        batch = []
+        while True:
+            t0 = time.monotonic()
+            item = inq.get()
+            stage.count(idle=time.monotonic() - t0)
+            if item is _END:
+                break
+            if stage.batch is None:
+                self._call(stage, outq, item, 1)
+                continue
+            batch.append(item)
+            if len(batch) >= stage.batch:
+                self._call(stage, outq, batch, len(batch))
+                batch = []
+                pass
+            pass
+        if batch:
+            self._call(stage, outq, batch, len(batch))
+            pass
+        with left[1]:
+            left[0] -= 1
+            if left[0] == 0 and outq is not None:
+                for i in range(left[2]):
+                    outq.put(_END)
+                    pass
+                pass
+            pass
+        pass
+
+    def run(self, source):
+        """Run each item of `source` through the stages."""
+        qs = [queue.Queue(self._qsize) for s in self.stages] + [None]
+        threads = []
+        for (i, s) in enumerate(self.stages):
+            nxt = self.stages[i + 1].workers if i + 1 < len(self.stages) else 0
+            left = [s.workers, threading.Lock(), nxt]
+            threads += [threading.Thread(target=self._worker, daemon=True,
+                                         args=(s, qs[i], qs[i + 1], left))
+                        for w in range(s.workers)]
+            pass
+        for t in threads:
+            t.start()
+            pass
+
+        src = iter(source)
+        try:
+            while not self._stop.is_set():
+                t0 = time.monotonic()
+                item = next(src, _END)
+                self.source.count(busy=time.monotonic() - t0)
+                if item is _END:
+                    break
+                self.source.count(items=1, out=1)
+                self._put(self.source, qs[0], item)
+                pass
+        except BaseException as e:
+            self._error = self._error or e
+            pass
+        for i in range(self.stages[0].workers):
+            qs[0].put(_END)
+            pass
+        for t in threads:
+            t.join()
+            pass
+        if self._error is not None:
+            raise self._error
+        pass
+
+    def stats(self):
+        """The per stage counters, source first."""
+        return [self.source] + self.stages
+
+    def report(self, lvl=1):
+        for s in self.stats():
+            _pipe_log.verbo(lvl, '%s', s)
+            pass
+        pass
+
+    pass
@@ -5,9 +5,10 @@
 
 import os
 import sys
-import time
+from collections import OrderedDict
 
-from zwi import ZwiPro, ZwiUser, DataBase, get_zdir
+from zwi import ZwiPro, ZwiUser, DataBase, get_zdir, get_zpath
+from zwi.asset_cache import ThumbCache
 
 # Was messing about trying to determine if I should use Qt or Tk.
 # Got so far with Tk, then bloodies myself trying not to use the GUI builder,
@@ -17,11 +18,20 @@ from zwi import ZwiPro, ZwiUser, DataBase, get_zdir
 # This functionality may end up being replaced with Bokeh.
 #
 
+PREFETCH = 8                    # images to prefetch in direction of travel
+PIXMAP_LIMIT = 64*1024*1024     # bytes of decoded pixmaps to retain
+IMAGE_THREADS = 4               # image fetch/decode worker threads
+IMAGE_BATCH = 8                 # pixmaps to convert per event loop pass
+THUMB_SIZE = 48                 # table view avatar size
+
 
 def qt_gui():
     """Qt based GUI to display info from followers/followees lists."""
-    # ensure zwi.db is extant
-    DataBase.db_connect(reset=False, create=False)
+    # ensure zwi.db is extant.  Do not connect here: the DB is loaded
+    # by the DB job thread (see MyWindow.load()).
+    path = get_zpath(mkdir=False)
+    if not os.path.isfile(path):
+        raise SystemExit(f'Database file {path} does not exist.')
 
     try:
         from PyQt5.QtGui import QPalette, QColor
@@ -33,14 +43,18 @@ def qt_gui():
                                      QTableWidgetItem, QWidget,
                                      QGridLayout,
                                      QDialog, QLineEdit, QMessageBox,
+                                     QInputDialog,
                                      QMainWindow,
                                      QGraphicsScene,
+                                     QTableView, QHeaderView,
                                      QStyleOptionViewItem)
         from PyQt5.QtCore import (pyqtSignal, QPointF, QRect, QSize,
                                   Qt, QTimer,
+                                  QAbstractTableModel, QModelIndex,
+                                  QSortFilterProxyModel,
                                   QFile,
-                                  QRunnable, QThreadPool, QMutex, QSemaphore)
-        from PyQt5.QtGui import (QPainter, QPolygonF, QIcon,
+                                  QRunnable, QThreadPool, QMutex)
+        from PyQt5.QtGui import (QPainter, QPolygonF, QIcon, QImage,
                                  QPixmap, QBrush, QPen, QColor, QFont)
 
     except Exception as e:
@@ -56,23 +70,40 @@ def qt_gui():
         print(f'{e}')
         raise SystemExit(f"Can't find GUI script file: {sfile}.")
 
-    class ImageCache(QRunnable):
-        def __init__(self, sig):
+    class ImageWorker(QRunnable):
+        """Pool worker: fetch, scale and decode queued images."""
+
+        def __init__(self, cache):
             super().__init__()
-            self.setAutoDelete(False)
+            self._cache = cache
+            pass
+
+        def run(self):
+            return self._cache.run()
+
+        pass
+
+    class ImageCache(object):
+        def __init__(self, sig, size=128, limit=PIXMAP_LIMIT,
+                     nthreads=IMAGE_THREADS, batch=IMAGE_BATCH):
             self._queue = list()
             self._done = list()
-            self._cache = dict()
+            self._cache = OrderedDict()    # LRU: oldest first
+            self._bytes = 0
+            self._limit = limit
             self._context = self._ssl_kluge()
-            self._threads = list()
             self._path = get_zdir('.image-cache')
+            self._size = size
+            self._thumbs = ThumbCache(self._path)
             self._mux = QMutex()
-            self._requ = QSemaphore()
-            self._resp = QSemaphore()
-            self._pool = QThreadPool.globalInstance()
+            self._pool = QThreadPool()
+            self._pool.setMaxThreadCount(nthreads)
             self._sig = sig
             self._terminate = False
             self._nthreads = 0
+            self._maxthreads = nthreads
+            self._batch = batch
+            self._posted = False
             pass
 
         def load(self, key, widget):
@@ -81,65 +112,127 @@ def qt_gui():
             self._mux.lock()
             if key in self._cache:
                 px = self._cache[key]
+                self._cache.move_to_end(key)
+                if px is None:
+                    self._promote(key)
+                    pass
             else:
-                self._cache[key] = px = None
-                self._queue.insert(0, (key, widget))
-                self._requ.release()
-                if self._nthreads == 0:
-                    self._terminate = False
-                    self._pool.start(self)
-                    self._nthreads = 1
+                px = None
+                self._enqueue(key, widget, False)
+                pass
+            self._mux.unlock()
+            return px
+
+        def prefetch(self, keys, widget):
+            """Queue up images we expect to want soon, nearest first.
+            Any prefetches still queued which are no longer wanted are
+            dropped, so scrolling rapidly does not build up a backlog.
+            """
+            self._mux.lock()
+            want = set(keys)
+            keep = []
+            for wrk in self._queue:
+                if wrk[2] and wrk[0] not in want:
+                    if self._cache.get(wrk[0], 0) is None:
+                        del self._cache[wrk[0]]
+                        pass
+                else:
+                    keep.append(wrk)
+                    pass
+                pass
+            self._queue = keep
+
+            for key in keys:
+                if key not in self._cache:
+                    self._enqueue(key, widget, True)
                     pass
                 pass
             self._mux.unlock()
+            pass
+
+        def _promote(self, key):
+            """Move a queued prefetch to the head of the line."""
+            for i, wrk in enumerate(self._queue):
+                if wrk[0] == key and wrk[2]:
+                    del self._queue[i]
+                    self._queue.append((wrk[0], wrk[1], False))
+                    break
+                pass
+            pass
+
+        def _enqueue(self, key, widget, prefetch):
+            """Queue an image fetch.  Called with the lock held.
+            The worker pops from the end of the queue, so explicit loads
+            go to the end and prefetches to the start.
+            """
+            self._cache[key] = None
+            if prefetch:
+                self._queue.insert(0, (key, widget, True))
+            else:
+                self._queue.append((key, widget, False))
+                pass
+            if self._nthreads < min(self._maxthreads, len(self._queue)):
+                self._nthreads += 1
+                self._pool.start(ImageWorker(self))
+                pass
+            pass
+
+        def peek(self, key):
+            """Return the cached pixmap, without queueing a load."""
+            self._mux.lock()
+            px = self._cache.get(key)
+            if px is not None:
+                self._cache.move_to_end(key)
+                pass
+            self._mux.unlock()
             return px
 
-        def autoDelete(self):
-            print(f'autodel: {self=}')
-            return False
+        def _insert(self, key, px):
+            """Add a pixmap to the LRU, evicting the oldest as required.
+            Called with the lock held.
+            """
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._bytes -= self._px_bytes(old)
+                pass
+            self._cache[key] = px
+            self._bytes += self._px_bytes(px)
+            while self._bytes > self._limit and len(self._cache) > 1:
+                k, v = self._cache.popitem(last=False)
+                if v is not None:
+                    self._bytes -= self._px_bytes(v)
+                    pass
+                pass
+            pass
+
+        @staticmethod
+        def _px_bytes(px):
+            return px.width() * px.height() * px.depth() // 8
 
         def stop(self):
-            while True:
-                self._mux.lock()
-                if self._nthreads > 0:
-                    # XXX: what about if it is blocked on a semaphore?
-                    self._terminate = True
-                    print('waiting for thread to terminate....')
-                    self._mux.unlock()
-                    time.sleep(5)
-                else:
-                    self._mux.unlock()
-                    return
-                pass
+            """Stop: drop the queue, and wait for the workers (and the
+            thumbnail processes) to finish."""
+            self._mux.lock()
+            self._terminate = True
+            self._queue = list()
+            self._mux.unlock()
+            self._pool.waitForDone()
+            self._thumbs.stop()
             pass
 
         def run(self):
-            """Thread function."""
-            # print(f'running: {self=}')
+            """Worker thread function: drain the request queue.
+            The image is decoded to a QImage here, so the GUI thread
+            need only convert it to a QPixmap.
+            """
             while True:
-                self._requ.acquire()
                 self._mux.lock()
-                if self._terminate:
-                    if len(self._queue) != 0:
-                        # print(f'{self=} {self._terminate=} {self._nthreads=} {self._queue=}')
-                        self._terminate = False
-                    else:
-                        self._terminate = False
-                        self._nthreads = 0
-                        assert len(self._queue) == 0
-                        self._mux.unlock()
-                        return
-                    pass
-
-                if len(self._queue) == 0:
-                    # print(f'wtf? {len(self._queue)=}')
-                    wrk = None
-                else:
-                    wrk = self._queue.pop()
-                    pass
+                if self._terminate or len(self._queue) == 0:
+                    self._nthreads -= 1
+                    self._mux.unlock()
+                    return
+                wrk = self._queue.pop()
                 self._mux.unlock()
-                if wrk is None:
-                    continue
 
                 key = wrk[0]
                 if key == 'None' or 'http' not in key:
@@ -151,12 +244,18 @@ def qt_gui():
                     pass
 
                 if os.path.isfile(path):
+                    # scale down once, in a worker process
+                    self._thumbs.make(path)
+                    img = QImage(self._image_path(key))
                     self._mux.lock()
-                    self._done.insert(0, wrk)
+                    self._done.insert(0, (key, wrk[1], img))
+                    post = not self._posted
+                    self._posted = True
                     self._mux.unlock()
-                    self._sig.emit(1)
+                    if post:
+                        self._sig.emit(1)
+                        pass
                     pass
-                time.sleep(.001)
                 pass
             pass
 
@@ -170,41 +269,56 @@ def qt_gui():
             return context
 
         def update(self):
+            """Convert decoded images to pixmaps, a batch at a time.
+            If there are more, come back on the next pass of the event loop
+            rather than hogging the GUI thread.
+            """
             self._mux.lock()
-            while len(self._done) > 0:
-                wrk = self._done.pop()
-                key, wid = wrk[0], wrk[1]
-                px = self._cache[key] = QPixmap(f'''{self._path}/{key.split('/')[-1]}''')
+            n = min(self._batch, len(self._done))
+            batch = [self._done.pop() for i in range(n)]
+            more = len(self._done) > 0
+            self._posted = more
+            self._mux.unlock()
+
+            for key, wid, img in batch:
+                px = QPixmap.fromImage(img)
+                self._mux.lock()
+                self._insert(key, px)
                 self._mux.unlock()
                 wid.imageLoaded(key, px)
-                self._mux.lock()
                 pass
 
-            # see if we are all done
-            if len(self._queue) == 0 and not self._terminate and self._nthreads > 0:
-                # print(f'request thread to terminate')
-                self._terminate = True
-                self._requ.release()
+            if more:
+                QTimer.singleShot(0, self.update)
                 pass
-            self._mux.unlock()
             pass
 
+        def _image_path(self, key):
+            """Prefer the thumbnail for our display size, if extant."""
+            path = f'''{self._path}/{key.split('/')[-1]}'''
+            thumb = self._thumbs.lookup(path, self._size)
+            return path if thumb is None else thumb
+
         def _fetch(self, url, path):
             """Try to fetch the resource and stack in file."""
             import shutil
+            import threading
             import urllib.request
 
+            # several workers: write then rename, so nobody sees a partial file
+            tmp = f'{path}.{threading.get_ident()}.tmp'
             try:
                 with urllib.request.urlopen(url, context=self._context) as resp:
-                    f = open(path, 'wb')
+                    f = open(tmp, 'wb')
                     shutil.copyfileobj(resp, f)
                     f.close()
+                os.replace(tmp, path)
             except Exception as e:
                 print(f'oops: {e}')
                 self._mux.lock()
-                del self._cache[url]
+                self._cache.pop(url, None)
                 try:
-                    os.remove(path)
+                    os.remove(tmp)
                 except Exception as e:
                     pass
                 self._mux.unlock()
@@ -215,8 +329,235 @@ def qt_gui():
 
     pass
 
+    class RiderModel(QAbstractTableModel):
+        """Table model over the follower/followee rows.
+        Cells are produced on demand from the row tuples, so only the rows
+        in view are ever touched.  Avatars are only ever peeked at here:
+        RiderTable asks for the visible ones to be loaded.
+        """
+        COLS = [
+            ('firstName', 'first name'),
+            ('lastName', 'last name'),
+            ('countryAlpha3', 'country'),
+            ('playerType', 'player type'),
+            ('followerStatusOfLoggedInPlayer', 'follower'),
+            ('followeeStatusOfLoggedInPlayer', 'followee'),
+        ]
+
+        def __init__(self, cols, rows, zcol, icache):
+            super().__init__()
+            self._all = cols
+            self._cols = [cols.index(c) for (c, _) in self.COLS]
+            self._img = cols.index('imageSrc')
+            self._zid = cols.index(zcol)
+            self._rows = rows
+            self._icache = icache
+            self._pending = {}  # image key => source rows awaiting it
+            pass
+
+        def setRows(self, rows, zcol):
+            self.beginResetModel()
+            self._rows = rows
+            self._zid = self._all.index(zcol)
+            self._pending = {}
+            self.endResetModel()
+            pass
+
+        def rowCount(self, parent=QModelIndex()):
+            return 0 if parent.isValid() else len(self._rows)
+
+        def columnCount(self, parent=QModelIndex()):
+            return 0 if parent.isValid() else len(self.COLS)
+
+        def headerData(self, section, orientation, role=Qt.DisplayRole):
+            if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+                return self.COLS[section][1]
+            return None
+
+        def data(self, index, role=Qt.DisplayRole):
+            if not index.isValid():
+                return None
+            r = self._rows[index.row()]
+            if role == Qt.DisplayRole:
+                return r[self._cols[index.column()]]
+            if role == Qt.DecorationRole and index.column() == 0:
+                return self._icache.peek(r[self._img])
+            return None
+
+        def zid(self, row):
+            return self._rows[row][self._zid]
+
+        def image_key(self, row):
+            return self._rows[row][self._img]
+
+        def want(self, rows):
+            """Request the avatars for the given source rows."""
+            keys = []
+            for row in rows:
+                key = self.image_key(row)
+                if key == 'None' or self._icache.peek(key) is not None:
+                    continue
+                self._pending.setdefault(key, set()).add(row)
+                keys.append(key)
+                pass
+            self._icache.prefetch(keys, self)
+            pass
+
+        def imageLoaded(self, key, px):
+            for row in self._pending.pop(key, ()):
+                if row < len(self._rows):
+                    idx = self.index(row, 0)
+                    self.dataChanged.emit(idx, idx, [Qt.DecorationRole])
+                    pass
+                pass
+            pass
+
+        pass
+
+    class RiderFilter(QSortFilterProxyModel):
+        """Sort/filter proxy for the RiderModel.
+        Filtering is by the ZwiUser search index.
+        """
+
+        def __init__(self, index):
+            super().__init__()
+            self._index = index     # function returning the SearchIndex
+            self._hits = None
+            self.setSortCaseSensitivity(Qt.CaseInsensitive)
+            pass
+
+        def setText(self, text):
+            self._hits = set(self._index().query(text)) if text.strip() else None
+            self.invalidateFilter()
+            pass
+
+        def filterAcceptsRow(self, row, parent):
+            if self._hits is None:
+                return True
+            return self.sourceModel().zid(row) in self._hits
+
+        pass
+
+    class RiderTable(QWidget):
+        """Table view of the follower/followee rows."""
+        sig = pyqtSignal(int, name='results')
+
+        def __init__(self, usr, rows, zcol, title, parent=None):
+            super().__init__()
+            self._parent = parent
+            self._icache = ImageCache(self.sig, size=THUMB_SIZE)
+            self.sig.connect(lambda index: self._icache.update())
+
+            self._usr = usr
+            self._model = RiderModel(usr.cols, rows, zcol, self._icache)
+            self._proxy = RiderFilter(lambda: self._usr.index)
+            self._proxy.setSourceModel(self._model)
+
+            self._filter = QLineEdit()
+            self._filter.setPlaceholderText('name [country:XXX] [type:XXX]')
+            self._filter.textChanged.connect(self.doFilter)
+
+            self._view = view = QTableView()
+            view.setModel(self._proxy)
+            view.setSortingEnabled(True)
+            view.setSelectionBehavior(QAbstractItemView.SelectRows)
+            view.setIconSize(QSize(THUMB_SIZE, THUMB_SIZE))
+            # fixed row heights: the view need not measure 50k rows
+            vh = view.verticalHeader()
+            vh.setSectionResizeMode(QHeaderView.Fixed)
+            vh.setDefaultSectionSize(THUMB_SIZE + 4)
+            view.horizontalHeader().setStretchLastSection(True)
+            view.verticalScrollBar().valueChanged.connect(self.want)
+            view.doubleClicked.connect(self.doSelect)
+            self._proxy.layoutChanged.connect(self.want)
+
+            layout = QVBoxLayout()
+            layout.addWidget(self._filter)
+            layout.addWidget(view)
+            self.setLayout(layout)
+            self.resize(800, 1024)
+            self.setTitle(title)
+            QTimer.singleShot(0, self.want)
+            pass
+
+        def setTitle(self, title):
+            self.setWindowTitle(f'ZwiView table -- {title}')
+            pass
+
+        def setRows(self, usr, rows, zcol, title):
+            self._usr = usr
+            self._model.setRows(rows, zcol)
+            self.setTitle(title)
+            self.want()
+            pass
+
+        def doFilter(self, text):
+            self._proxy.setText(text)
+            self.want()
+            pass
+
+        def doSelect(self, index):
+            if self._parent is not None:
+                row = self._proxy.mapToSource(index).row()
+                self._parent.goto(row)
+                pass
+            pass
+
+        def want(self, *args):
+            """Ask for the avatars of the visible rows, and no others."""
+            view = self._view
+            top = view.rowAt(0)
+            if top < 0:
+                return
+            bot = view.rowAt(view.viewport().height())
+            if bot < 0:
+                bot = self._proxy.rowCount() - 1
+                pass
+            rows = [self._proxy.mapToSource(self._proxy.index(i, 0)).row()
+                    for i in range(top, bot + 1)]
+            self._model.want(rows)
+            pass
+
+        def resizeEvent(self, event):
+            super().resizeEvent(event)
+            self.want()
+            pass
+
+        def closeEvent(self, event):
+            self._icache.stop()
+            if self._parent is not None:
+                self._parent.tableClosed()
+                pass
+            super().closeEvent(event)
+            pass
+
+        pass
+
+    class Job(QRunnable):
+        """Run `fun` on a pool thread, emitting the result (or exception)."""
+
+        def __init__(self, fun, done):
+            super().__init__()
+            self._fun = fun
+            self._done = done
+            pass
+
+        def run(self):
+            try:
+                rv = self._fun()
+            except BaseException as e:
+                # core raises SystemExit for all sorts of things
+                rv = e
+                pass
+            self._done.emit(rv)
+            pass
+
+        pass
+
     class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         sig = pyqtSignal(int, name='results')
+        loading = pyqtSignal(str, int, name='loading')
+        loaded = pyqtSignal(object, name='loaded')
 
         def __init__(self):
             QtWidgets.QMainWindow.__init__(self)
@@ -227,6 +568,11 @@ def qt_gui():
 
         def setup(self):
             self._timer = None
+            self._table = None
+            self._search = ''
+            self._sort = None
+            self._dir = 1
+            self._image_load_key = None
             self._status = self.statusBar()
             self._status.showMessage('Hi there')
             self.sig.connect(self.handle)
@@ -235,6 +581,7 @@ def qt_gui():
             self.actionwees.triggered.connect(self.doWees)
             self.actionwers.triggered.connect(self.doWers)
             self.actionauto.triggered.connect(self.doAuto)
+            self.actiontable.triggered.connect(self.doTable)
             self.actionnext.triggered.connect(self.doNext)
             self.actionprev.triggered.connect(self.doPrev)
             self.actionquit.triggered.connect(self.doQuit)
@@ -247,17 +594,88 @@ def qt_gui():
             self.actionlast_name.triggered.connect(self.doSortLastName)
             self.actionplayer_type.triggered.connect(self.doSortPlayerType)
             self.actioncountry.triggered.connect(self.doSortCountry)
+            self.actionreverse.toggled.connect(self.doReverse)
             # search menu
             self.actionsearch.triggered.connect(self.doSearch)
             # scroll bar
             self.sb.valueChanged.connect(self.sbValueChanged)
 
-            self._usr = ZwiUser()
+            # The DB is loaded in the background.  DB jobs run one at a
+            # time, so a reset cannot overlap a load.
+            self._jobs = QThreadPool()
+            self._jobs.setMaxThreadCount(1)
+            self._jobs.setExpiryTimeout(-1)
+            self._busy = False
+            self.loading.connect(self.doLoading)
+            self.loaded.connect(self.doLoaded)
+
             self._icache = ImageCache(self.sig)
-            self.switch('wers')
+            self.load(reset=False)
+            pass
+
+        def load(self, reset):
+            """Load (or reset and resync) the DB in the background.
+            The rows are displayed as they arrive.
+            """
+            if self._busy:
+                return self.message('Still loading.')
+            self._busy = True
+            usr = ZwiUser(update=reset, defer=True,
+                          progress=lambda tab, n: self.loading.emit(tab, n))
+
+            def fun():
+                if reset:
+                    DataBase.db_connect(reset=True, create=True)
+                    pass
+                usr.load()
+                return usr
+
+            self._usr = usr
+            self.switch(getattr(self, '_list', 'wers'))
+            self._status.showMessage('loading...')
+            self._jobs.start(Job(fun, self.loaded))
+            pass
+
+        def doLoading(self, tab, count):
+            """Progress report from the DB job."""
+            self._status.showMessage(f'loading {tab}: {count}')
+            if tab == self._which:
+                empty = self._max < 0
+                self._max = len(self._data) - 1
+                self.sb.setMaximum(self._max)
+                self.sb.setMinimum(0)
+                if empty:
+                    self.refresh(0)
+                    pass
+                if self._table is not None:
+                    self._table.setRows(self._usr, self._data, self._zcol,
+                                     self._which)
+                    pass
+                pass
+            pass
+
+        def doLoaded(self, rv):
+            """The DB job is done."""
+            self._busy = False
+            if isinstance(rv, BaseException):
+                self._status.showMessage('load failed')
+                return self.message(f'{rv}')
+            # re-establish the view: any sort order was of a partial list
+            self.setData()
+            self._max = len(self._data) - 1
+            self.sb.setMaximum(self._max)
+            self.sb.setMinimum(0)
+            self.refresh(0)
+            if self._table is not None:
+                self._table.setRows(self._usr, self._data, self._zcol,
+                                    self._which)
+                pass
             pass
 
         def sbValueChanged(self, val):
+            if val != self._idx:
+                self._dir = 1 if val > self._idx else -1
+                pass
             self._idx = val
             # self.refresh must keep _idx in range
             self.refresh(0, fromsb=True)
@@ -271,6 +689,26 @@ def qt_gui():
             self.switch('wers')
             pass
 
+        def doTable(self):
+            """Pop up a table view of the current list."""
+            if self._table is None:
+                self._table = RiderTable(self._usr, self._data, self._zcol,
+                                         self._which, parent=self)
+                pass
+            self._table.show()
+            self._table.raise_()
+            pass
+
+        def tableClosed(self):
+            self._table = None
+            pass
+
+        def goto(self, idx):
+            """Display the entry at `idx` of the current list."""
+            self._idx = idx
+            self.refresh(0)
+            pass
+
         def doAuto(self):
             if self._timer is None:
                 self._timer = QTimer()
@@ -312,14 +750,14 @@ def qt_gui():
 
         def doResetIcache(self):
             """Reset the image cache."""
+            # finish with the old one's threads and thumbnail processes
+            self._icache.stop()
             self._icache = ImageCache(self.sig)
             pass
 
         def doResetDBase(self):
             """Reset the local data base cache of Zwift data."""
-            db = DataBase.db_connect(reset=True)
-            ZwiUser(db, update=True)
-            self.switch('wers')	# necessary(?) side effect.
+            self.load(reset=True)
             pass
 
         def doResetAuthen(self):
@@ -343,21 +781,54 @@ def qt_gui():
             pass
 
         def doSort(self, col):
-            """Sort current table by country."""
-            idx = self._usr.cols.index(col)
-            rev = self.actionreverse.isChecked()
-
-            def sel(elem):
-                return elem[idx]
-
-            self._data = sorted(self._data, key=sel, reverse=rev)
+            """Sort current table by `col`.
+            The sort orders are cached by ZwiUser, so changing the column or
+            direction, or switching tables, just swaps the permutation.
+            """
+            self._sort = col
+            self.setData()
             self._idx = 0
             self.refresh(0)
+            if self._table is not None:
+                self._table.setRows(self._usr, self._data, self._zcol,
+                                     self._which)
+                pass
+            pass
+
+        def doReverse(self, checked):
+            if self._sort is not None:
+                self.doSort(self._sort)
+                pass
+            pass
+
+        def setData(self):
+            """Establish the view of the current table in the current order."""
+            rev = self.actionreverse.isChecked()
+            self._data = self._usr.view(self._list, self._sort, rev)
             pass
 
         def doSearch(self):
-            """(eventually) search."""
-            return self.message('Yet to be implemented.')
+            """Search the current list by name, country and player type.
+            Moves to the next match after the current entry.
+            """
+            if self._busy:
+                return self.message('Still loading.')
+            text, ok = QInputDialog.getText(
+                self, 'Search', 'name [country:XXX] [type:XXX]',
+                text=self._search)
+            if not ok or not text.strip():
+                return
+            self._search = text
+            hits = set(self._usr.index.query(text))
+            zc = self._usr.cols.index(self._zcol)
+            n = len(self._data)
+            for i in range(1, n + 1):
+                if self._data[(self._idx + i) % n][zc] in hits:
+                    self.goto((self._idx + i) % n)
+                    self._status.showMessage(f'{1+self._idx}: {len(hits)} matches')
+                    return
+                pass
+            return self.message(f'No match for: {text}')
 
         def message(self, msg='Oops!'):
             """Raise a modal dialog."""
@@ -372,6 +843,9 @@ def qt_gui():
             if self._icache:
                 self._icache.stop()
                 pass
+            if self._table is not None:
+                self._table.close()
+                pass
             super().close()
             pass
 
@@ -381,19 +855,29 @@ def qt_gui():
 
         def switch(self, which):
             if which == 'wers':
-                self._data = self._usr.wers
+                self._zcol = 'followerId'
             else:
-                self._data = self._usr.wees
+                self._zcol = 'followeeId'
                 pass
+            self._list = which
+            self._which = f'follo{which}'
+            self.setData()
             self._idx = 0
             self._max = len(self._data)-1
             self.sb.setMaximum(self._max)
             self.sb.setMinimum(0)
-            self.setWindowTitle(f'ZwiView -- follo{which}')
+            self.setWindowTitle(f'ZwiView -- {self._which}')
             self.refresh(0)
+            if self._table is not None:
+                self._table.setRows(self._usr, self._data, self._zcol,
+                                     self._which)
+                pass
             pass
 
         def refresh(self, delta=0, fromsb=False):
+            if delta != 0:
+                self._dir = 1 if delta > 0 else -1
+                pass
             self._idx += delta
             if self._idx > self._max:
                 self._idx = 0
@@ -405,6 +889,11 @@ def qt_gui():
                 self.sb.setValue(self._idx)
                 pass
 
+            if len(self._data) == 0:
+                self._status.showMessage('loading...' if self._busy
+                                         else 'empty list')
+                return
+
             try:
                 r = self._data[self._idx]
             except Exception as e:
@@ -455,6 +944,24 @@ def qt_gui():
             self.graphicsView.setScene(scene)
             self.graphicsView.show()
             self.show()
+            self.prefetch()
+            pass
+
+        def prefetch(self):
+            """Prefetch images for the entries either side of the current,
+            mostly in the direction of travel."""
+            n = len(self._data)
+            idx = self._usr.cols.index('imageSrc')
+            near = [self._dir * i for i in range(1, 1 + PREFETCH)]
+            near += [-self._dir * i for i in range(1, 1 + PREFETCH // 4)]
+            keys = []
+            for i in near:
+                url = self._data[(self._idx + i) % n][idx]
+                if url != 'None' and url not in keys:
+                    keys.append(url)
+                    pass
+                pass
+            self._icache.prefetch(keys, self)
             pass
 
         def imageLoaded(self, key, px):
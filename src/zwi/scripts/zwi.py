@@ -2,14 +2,13 @@
 #
 # Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
 
+import os
 import sys
 import signal
-import time
+import types
+from datetime import datetime
 import zwi
-from zwi import ZwiPro, ZwiUser, DataBase
-import zwift
-import requests
-import urllib3
+from zwi import ZwiPro, ZwiUser, ZwiProfile, ZwiGraph, DataBase
 
 try:
     import click
@@ -20,12 +19,45 @@ except Exception as ex__:
 
 @click.option('-v', '--verbose', count=True)
 @click.option('-d', '--debug', count=True)
+@click.option('--log', multiple=True, metavar='NAME=[v]LEVEL',
+              help='debug (or verbosity) level of one subsystem:'
+              ' auth, db, data, user, pro, graph, pipe, shard, crawl,'
+              ' daemon or worlds')
+@click.option('--log-json', is_flag=True, help='log as lines of JSON')
+@click.option('--db-profile', type=click.Choice(list(zwi.DB_PROFILES)),
+              default=DataBase.profile, show_default=True,
+              help='SQLite tuning profile')
+@click.option('--archive/--no-archive', default=True, show_default=True,
+              help='archive the raw Zwift responses')
+@click.option('--daemon/--no-daemon', 'use_daemon', default=True,
+              show_default=True, help='use the `zwi daemon`, if running')
 @click.group()
-def cli(verbose, debug):
-    zwi.setup(verbose, debug)
+def cli(verbose, debug, log, log_json, db_profile, archive, use_daemon):
+    zwi.setup(verbose, debug, zwi.log_levels(log), log_json)
+    DataBase.set_profile(db_profile)
+    zwi.ZwiArchive.enabled = archive
+    zwi.ZwiDaemon.enabled = use_daemon
     pass
 
 
+def via_daemon(cmd, **args):
+    """Have any running `zwi daemon` do `cmd`: (True, result), or
+    (False, None) if there is none."""
+    try:
+        return True, zwi.daemon_call(cmd, **args)
+    except zwi.DaemonDown:
+        return False, None
+    pass
+
+
+def daemon_user(which):
+    """The ZwiUser, or the daemon's `which` rows in its likeness."""
+    (ok, rv) = via_daemon('list', which=which)
+    if not ok:
+        return ZwiUser()
+    return types.SimpleNamespace(cols=rv['cols'], **{which: rv['rows']})
+
+
 @cli.command()
 def version():
     """Return the version number of the `zwi` package."""
@@ -56,13 +88,13 @@ def clear():
 @cli.command()
 def wees():
     """Display followees who are not following me."""
-    return followees(ZwiUser())
+    return followees(daemon_user('wees'))
 
 
 @cli.command()
 def wers():
     """Display followers who I am not following."""
-    return followers(ZwiUser())
+    return followers(daemon_user('wers'))
 
 
 def followees(usr):
@@ -128,15 +160,15 @@ def csv(wers, wees):
     """Generate CSV output, full table.  Writes to stdout."""
     import csv
 
-    usr = ZwiUser()
-
-    if wers:
-        rows = usr.wers
-    elif wees:
-        rows = usr.wees
-    else:
+    if not (wers or wees):
         raise SystemExit('No table selected.')
-        pass
+    (ok, rv) = via_daemon('csv', which='wers' if wers else 'wees')
+    if ok:
+        sys.stdout.write(rv)
+        return
+
+    usr = ZwiUser()
+    rows = usr.wers if wers else usr.wees
 
     with sys.stdout as out:
         writer = csv.DictWriter(out, fieldnames=usr.cols)
@@ -152,16 +184,40 @@ def csv(wers, wees):
 @cli.command()
 def reset():
     """Reset the database, refresh followers/followees data."""
-    db = DataBase.db_connect(reset=True, create=True)
+    # We are rebuilding from scratch anyway, so need not be durable.
+    db = DataBase.db_connect(reset=True, create=True, profile='bulk')
     ZwiUser(db, update=True)
     ZwiPro(create=True).update(force=True)
 
     return 0
 
 
+@click.option('--workers', type=int, default=None,
+              help='number of decode processes')
+@cli.command()
+def rebuild(workers):
+    """Regenerate the profile and followers/followees DBs from the archive
+    of Zwift responses."""
+    arc = zwi.ZwiArchive(create=False)
+    (n, b, z) = arc.stats()
+    zwi.verbo(1, f'archive: {n} responses, {b} blobs, {z} bytes')
+
+    count = ZwiPro(create=True, slurp=False).rebuild(arc, workers=workers)
+    zwi.verbo(0, f'rebuilt {count} profiles')
+    if os.path.isfile(zwi.get_zpath()):
+        ZwiUser(defer=True).rebuild(arc, workers=workers)
+        pass
+    ZwiGraph(create=True).rebuild(arc, workers=workers)
+    return 0
+
+
 @cli.command()
 def update():
     """Update user's follower/follee DB cache."""
+    (ok, rv) = via_daemon('update')
+    if ok:
+        zwi.verbo(1, f'{rv[0]} followers, {rv[1]} followees')
+        return 0
     ZwiUser(update=True)
     ZwiPro(create=True).update(force=True)
 
@@ -172,6 +228,10 @@ def update():
 @click.option('--force', is_flag=True, help='Force refresh.')
 def pro_update(force):
     """Update the profile DB based on user's follower/followee DB cache."""
+    (ok, rv) = via_daemon('pro_update', force=force)
+    if ok:
+        zwi.verbo(1, f'{rv} profiles changed')
+        return 0
 
     if zwi.verbo_p(1):
         skip = []
@@ -182,11 +242,8 @@ def pro_update(force):
     usr = ZwiUser()
     pro = ZwiPro(create=True)
     pr = pro.Printer(skip=skip)
-    done = []
 
-    def update(zid, force):
-        old = pro.lookup(zid)
-        new = pro.update(zid, force=force)
+    def report(zid, old, new):
         if zwi.verbo_p(1):
             if old is not None:
                 pr.out(old)
@@ -205,18 +262,10 @@ def pro_update(force):
             pass
         pass
 
-    for r in usr.wers:
-        d = dict(zip(usr.cols, r))
-        update(d['followerId'], force)
-        done.append(d['followerId'])
-        pass
-
-    for r in usr.wees:
-        d = dict(zip(usr.cols, r))
-        if d['followeeId'] in done:
-            continue
-        update(d['followeeId'], force)
-        pass
+    wer = usr.cols.index('followerId')
+    wee = usr.cols.index('followeeId')
+    pro.update_all([r[wer] for r in usr.wers] + [r[wee] for r in usr.wees],
+                   force=force, report=report)
 
     return 0
 
@@ -240,6 +289,61 @@ def pro_list():
     return 0
 
 
+@click.option('--country', help='restrict to country (e.g. GBR)')
+@click.option('--ptype', help='restrict to player type (e.g. CYCLIST)')
+@click.option('--limit', type=int, default=None,
+              help='display at most this many')
+@click.argument('name', nargs=-1)
+@cli.command()
+def search(name, country, ptype, limit):
+    """Search the profile DB by name, country and player type."""
+
+    if zwi.verbo_p(1):
+        skip = []
+    else:
+        skip = ['date', 'hours', 'distance', 'climbed', 'bike']
+        pass
+
+    pr = ZwiPro.Printer(skip=skip)
+    (ok, rv) = via_daemon('search', text=' '.join(name), country=country,
+                          ptype=ptype, limit=limit)
+    if ok:
+        found = [zwi.ZwiDaemon.profile(d) for d in rv]
+    else:
+        found = ZwiPro().search(' '.join(name), country=country, ptype=ptype,
+                                limit=limit)
+        pass
+    for p in found:
+        pr.out(p)
+        pass
+    return 0
+
+
+@click.option('--where', multiple=True,
+              help='predicate, eg. "ftp>=300" or "lastName~Smi%" (repeatable)')
+@click.option('--order', multiple=True,
+              help='column to order by, "-" prefix for descending (repeatable)')
+@click.option('--limit', type=int, default=None,
+              help='display at most this many')
+@cli.command()
+def pro_query(where, order, limit):
+    """Query the profile DB."""
+
+    if zwi.verbo_p(1):
+        skip = []
+    else:
+        skip = ['date', 'hours', 'distance', 'climbed', 'bike']
+        pass
+
+    pro = ZwiPro(slurp=False)
+    pr = pro.Printer(skip=skip)
+    for p in pro.query(where=[pro.parse_pred(w) for w in where],
+                       order=order, limit=limit):
+        pr.out(p)
+        pass
+    return 0
+
+
 def validate_prune(ctx, param, value):
     if isinstance(value, str):
         if value == '' or len(value) == 1 and value in 'YN':
@@ -255,30 +359,50 @@ def validate_prune(ctx, param, value):
               help='skip all entries before the specified Zwift ID')
 @click.option('--prune', help='auto-prune all invalid entries (Y/N)',
               type=str, callback=validate_prune, default='', prompt=False)
+@click.option('--all', 'every', is_flag=True,
+              help='refresh every entry, rather than those due')
+@click.option('--budget', type=int, default=500, show_default=True,
+              help='refresh at most this many of the entries due')
+@click.option('--procs', type=int, default=0,
+              help='fetch in this many worker processes, by Zwift ID')
 @cli.command()
-def pro_refresh(skip, zid, seek, prune):
+def pro_refresh(skip, zid, seek, prune, every, budget, procs):
     """Refresh local profile DB from Zwift."""
     skip = 0 if skip is None else int(skip)
 
     pro = ZwiPro()
+    sched = zwi.ZwiSchedule()
     pr = pro.Printer()
     delete = 'n' if prune == '' else prune
     count = 0
 
-    for p in pro:
-        if skip > 0:
-            skip -= 1
-            continue
+    if zid is not None:
+        p = pro.lookup(int(zid))
+        if p is None:
+            raise SystemExit(f'{zid} not found in local profile DB.')
+        todo = [p]
+    elif every or skip or seek is not None:
+        todo = pro.walk(skip, None if seek is None else int(seek))
+    else:
+        # those due, hot ones first
+        hot = set()
+        if os.path.isfile(zwi.get_zpath()):
+            usr = ZwiUser()
+            hot = set(usr.wers_dict) | set(usr.wees_dict)
+            pass
+        todo = (pro.lookup(i) for i in sched.due(hot=hot, budget=budget))
+        pass
 
-        if zid is not None and int(zid) != int(p.id):
-            continue
-        if seek is not None and int(seek) != int(p.id):
-            continue
+    if procs > 0:
+        done = zwi.refresh_sharded(pro, todo, procs)
+    else:
+        done = ((p, p.refresh(pro)) for p in todo)
+        pass
 
+    for (p, q) in done:
         count += 1
 
         pr.out(p)
-        q = p.refresh(pro)
         if q is None:
             # Sometimes the update fails.
             ch = delete
@@ -301,20 +425,48 @@ def pro_refresh(skip, zid, seek, prune):
             if ch in 'yY':
                 zwi.verbo(0, f'deleting {p.firstName} {p.lastName}')
                 pro.delete(p.id)
+                sched.forget(p.id)
+            else:
+                sched.failed(p.id)
                 pass
-            pass
-        elif p is not q and p != q:
+            continue
+        if p is not q and p != q:
             pr.out(q, prefix='*')
             zwi.verbo(1, f'{p.last_difference}')
             pass
-
-        if zid:
-            break
-        seek = None
+        sched.done(p.id, p is not q and p != q)
         pass
 
-    if zid and count != 1:
-        raise SystemExit(f'{zid} not found in local profile DB.')
+    zwi.verbo(1, f'refreshed {count} profiles')
+    return 0
+
+
+@click.option('--zid', type=int, help='restrict to this Zwift ID')
+@click.option('--col', help='show the history of one column, eg. ftp')
+@click.option('--as-of', help='show the profile as of date[Ttime]')
+@click.option('--since', default='', help='start date for --col')
+@cli.command()
+def pro_history(zid, col, as_of, since):
+    """Show the recorded changes to profiles."""
+    hist = ZwiPro(slurp=False).history
+
+    if col is not None:
+        for (i, ts, v) in hist.series(col, zid=zid, since=since):
+            print(f'{i:8d} {ts:19.19s} {v}')
+            pass
+        return 0
+    if zid is None:
+        raise SystemExit('--zid required.')
+    if as_of is not None:
+        p = hist.as_of(zid, as_of)
+        if p is None:
+            raise SystemExit(f'No history of {zid} as of {as_of}.')
+        ZwiPro.Printer().out(p)
+        return 0
+    for (ts, delta) in hist.changes(zid):
+        print(f'{ts:19.19s} ' + ' '.join(f'{k}={v}'
+                                         for (k, v) in delta.items()))
+        pass
     return 0
 
 
@@ -329,6 +481,19 @@ def gui():
         raise SystemExit(e)
 
 
+@cli.command()
+def thumbs():
+    """Generate any missing thumbnails for the local image cache."""
+    tc = zwi.ThumbCache(zwi.get_zdir('.image-cache'))
+    try:
+        count = tc.populate()
+    finally:
+        tc.stop()
+        pass
+    zwi.verbo(0, f'generated thumbnails for {count} images')
+    return 0
+
+
 @cli.command()
 @click.option('--zid', prompt='Zwift user ID', help='Zwift ID to inspect')
 @click.option('--update', is_flag=True,
@@ -345,179 +510,257 @@ def inspect(zid, update, reset):
 
     zwi.verbo(1, f'Inspecting user {zid}')
 
-    pro = ZwiPro()
-    pseudo = ZwiUser(uid=int(zid), update=update, pro_update=pro, drop=reset)
-    vic = pro.lookup(zid)
-    if vic is None:
-        vic = pro.update(zid)
+    zid = int(zid)
+    pro = ZwiPro(create=True)
+    graph = ZwiGraph()
+    if reset:
+        graph.drop(zid)
         pass
+    if update or reset or zid not in graph.owners():
+        graph.sync(zid, pro=pro)
+        pass
+    vic = pro.lookup(zid, fetch=True)
     if vic is None:
         raise SystemExit(f'Zwift user {zid} not in profiles data base.')
 
     pr = pro.Printer(f'followers of {vic.firstName} {vic.lastName}', skip=skip)
-    for f in pseudo.wers_iter():
-        pr.out(pro.lookup(f.followerId))
+    for r in graph.profiles(zid, zwi.GRAPH_WERS)():
+        pr.out(ZwiProfile.from_seq(r))
         pass
 
     pr = pro.Printer(f'followees of {vic.firstName} {vic.lastName}', skip=skip)
-    for f in pseudo.wees_iter():
-        pr.out(pro.lookup(f.followeeId))
+    for r in graph.profiles(zid, zwi.GRAPH_WEES)():
+        pr.out(ZwiProfile.from_seq(r))
         pass
 
     return 0
 
 
-# disable this ...
-# @cli.command()
-def devel():
-    """more development staging...."""
-
-    usr = ZwiUser()
-    pro = ZwiPro()
+@cli.command()
+@click.option('--remove', is_flag=True,
+              help='remove each per-user DB once imported')
+def graph_migrate(remove):
+    """Import the per-user DBs from older `inspect` into the graph DB."""
+    done = ZwiGraph(create=True).migrate(remove=remove)
+    zwi.verbo(0, f'imported {len(done)} users')
+    return 0
 
-    # pro.update(pr.player_id)
 
-    count = 0
-    for r in usr.wees:
-        d = dict(zip(usr.cols, r))
-        pro.update(d['followeeId'])
-        zwi.verbo(0, f'\rprocessed {d["followeeId"]}: {count}', end='')
-        count += 1
+@click.option('--seed', type=int, multiple=True,
+              help='Zwift ID to start from (repeatable; default: me)')
+@click.option('--depth', type=int, default=2, show_default=True,
+              help='how many lists away from the seeds to go')
+@click.option('--max-users', type=int, default=None,
+              help='queue at most this many users in all')
+@click.option('--workers', type=int, default=4, show_default=True,
+              help='number of concurrent fetches')
+@click.option('--procs', is_flag=True,
+              help='fetch in worker processes, rather than threads')
+@click.option('--budget', type=int, default=1000, show_default=True,
+              help='Zwift API requests to make in this run')
+@click.option('--rate', type=float, default=None,
+              help='at most this many API requests per second')
+@click.option('--profiles/--no-profiles', default=True, show_default=True,
+              help='fetch the profile of each user visited')
+@click.option('--reset', is_flag=True, help='start the crawl afresh')
+@cli.command()
+def crawl(seed, depth, max_users, workers, procs, budget, rate, profiles,
+          reset):
+    """Crawl the follower graph, resuming any earlier crawl."""
+    cr = zwi.ZwiCrawler(create=True, profiles=profiles)
+    if reset:
+        cr.reset()
         pass
-    zwi.verbo(0, '')
-
-    count = 0
-    for r in usr.wers:
-        d = dict(zip(usr.cols, r))
-        pro.update(d['followerId'])
-        zwi.verbo(0, f'\rprocessed {d["followerId"]}: {count}', end='')
-        count += 1
+    if seed:
+        cr.seed(seed)
+    elif sum(cr.stats()) == 0:
+        cr.seed([zwi.zwi_init()[1].player_id])
         pass
-    zwi.verbo(0, '')
 
-    zwi.setup(1, zwi.debug_lvl)
+    bud = zwi.ApiBudget(limit=budget, rate=rate)
+    count = cr.run(max_depth=depth, max_size=max_users, workers=workers,
+                   budget=bud, processes=procs)
+    (queued, done, failed) = cr.stats()
+    zwi.verbo(0, f'visited {count} users using {bud.used} requests;'
+              f' {done} done, {failed} failed, {queued} queued')
+    return 0
 
-    count = 0
-    for r in pro._pro:
-        d = dict(zip(pro.cols, r))
-        if d['id'] == 1277086:
-            continue
 
-        print(f'{d["id"]}')
-        ZwiUser(uid=d['id'], update=True, pro_update=pro)
-        zwi.verbo(1, f'processed {d["id"]}: {count}')
-        count += 1
-        pass
-    pass
+@click.option('--stop', is_flag=True, help='stop the running daemon')
+@click.option('--reload', is_flag=True,
+              help='have the running daemon reload its caches')
+@cli.command()
+def daemon(stop, reload):
+    """Serve warm queries (and updates) on a Unix socket, which the other
+    commands use when it is running."""
+    if stop or reload:
+        (ok, rv) = via_daemon('stop' if stop else 'reload')
+        if not ok:
+            raise SystemExit('no zwi daemon is running')
+        if stop:
+            zwi.verbo(0, f'stopped zwi daemon {rv}')
+        else:
+            zwi.verbo(0, f'reloaded {rv[0]} followers, {rv[1]} followees,'
+                      f' {rv[2]} profiles')
+            pass
+        return 0
+    zwi.ZwiDaemon().serve()
+    return 0
 
 
 @click.option('--poll', is_flag=True,
               help='poll repeatedly at specified interval')
 @click.option('--sleep', type=int, default=5*60,
               help='sleep interval in seconds')
+@click.option('--jitter', type=float, default=0.1, show_default=True,
+              help='vary each interval randomly by up to this fraction')
+@click.option('--world', type=int, multiple=True,
+              help='world to poll (repeatable; default: all known)')
+@click.option('--record/--no-record', default=True, show_default=True,
+              help='record each sample in the worlds DB')
+@click.option('--presence', is_flag=True,
+              help='track (and show) who comes and goes')
 @cli.command()
-def worlds(poll, sleep):
+def worlds(poll, sleep, jitter, world, record, presence):
     """Display info regarding worlds."""
-
     if sleep < 1:
         sleep = 1
 
-    (cl, _) = zwi.zwi_init(key='zwi.py')
+    series = zwi.ZwiSeries(create=True) if record else None
+    poller = zwi.WorldPoller(worlds=world or zwi.WORLDS, interval=sleep,
+                             jitter=jitter)
+    tracker = None
+    if presence:
+        (cl, pr) = zwi.zwi_init()
+        tracker = zwi.ZwiPresence(create=True, fetch=lambda zid:
+                                  zwi.fetch_profile(pr.request.json, zid))
+
+        def show(zid, online, ts):
+            when = datetime.fromtimestamp(ts).isoformat(timespec='seconds')
+            print(f'{when} {tracker.names.get(zid, zid)}:'
+                  f' {"online" if online else "offline"}')
+            pass
+
+        tracker.subscribe(show)
+        pass
     lines = 0
     maps = dict()
 
-    ecnt = 0
-
-    while True:
-        # seems like there is only one worldID?
-        for i in range(1, 2):
-            w = None
-            p = None
-
-            try:
-                if cl is None:  # handle connexion reset
-                    print('connexion reset -- retry...')
-                    (cl, _) = zwi.zwi_init(key='zwi.py')
-                    break
+    for (i, p, lat) in poller.polls(once=not poll):
+        if not p:
+            if not poll:
+                print(f'{i=}: no world')
+                pass
+            continue
 
-                w = cl.get_world(world_id=i)
-                if w:
-                    p = w.players
-                    pass
-            except (zwift.error.RequestException,
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.ChunkedEncodingError,
-                    urllib3.exceptions.ProtocolError,
-                    urllib3.exceptions.ProtocolError,
-                    Exception, BaseException) as e:
-                # I should not be catching BaseException here, except
-                # that the zwift package bases exception on it, rather
-                # than Exception.
-                zwi.debug(1, f'{i=} {e=}')
-                ecnt += 1
-                zwi.verbo(1, f'exception {e=} count: {ecnt}')
-                if cl is not None:
-                    del cl
-                    pass
-                cl = w = p = None
-                break
-
-            if cl and w and p:
-                friends = 0
-                maps = dict(zip(maps.keys(), [0 for k in maps.keys()]))
-                for f in p['friendsInWorld']:
-                    # print(f'{f=}')
-                    if f['mapId'] not in maps.keys():
-                        maps[f['mapId']] = 0
-                        lines = 0   # spit out header again
-                        pass
-                    maps[f['mapId']] += 1
-                    buddy = (f['followerStatusOfLoggedInPlayer']
-                             != 'NO_RELATIONSHIP')
-                    if buddy:
-                        friends += 1
-                        pass
-                    pass
+        friends = 0
+        maps = dict(zip(maps.keys(), [0 for k in maps.keys()]))
+        mapf = {}
+        for f in p['friendsInWorld']:
+            # print(f'{f=}')
+            if f['mapId'] not in maps.keys():
+                maps[f['mapId']] = 0
+                lines = 0   # spit out header again
+                pass
+            maps[f['mapId']] += 1
+            buddy = (f['followerStatusOfLoggedInPlayer']
+                     != 'NO_RELATIONSHIP')
+            if buddy:
+                friends += 1
+                mapf[f['mapId']] = mapf.get(f['mapId'], 0) + 1
+                pass
+            pass
+        if series is not None:
+            series.record(i, p['playerCount'], friends, dict(
+                (m, (n, mapf.get(m, 0))) for (m, n) in maps.items() if n))
+            pass
+        if tracker is not None:
+            tracker.observe(i, p['friendsInWorld'])
+            pass
 
-                zwi.debug(1, f'{i=} {p["worldId"]=} {p["playerCount"]=}')
-                if lines % 20 == 0:
-                    print('world players friends', end='')
-                    for j in range(1, 1+len(maps.keys())):
-                        print(f' {j:7d}', end='')
-                        pass
-                    print('')
-                    pass
-                print(f'{i:5d} {p["playerCount"]:7d} {friends:7d}', end='')
-                key = list(maps.keys())
-                key.sort()
-                for k in key:
-                    # print(f' {k}:{maps[k]}', end='')
-                    print(f' {maps[k]:7d}', end='')
-                    pass
-                print()
-                lines += 1
-
-                if zwi.verbosity:
-                    for f in p['friendsInWorld']:
-                        buddy = (f['followerStatusOfLoggedInPlayer']
-                                 != 'NO_RELATIONSHIP')
-                        if buddy:
-                            print(f'{f["firstName"]} {f["lastName"]}')
-                            pass
-                        pass
-                    pass
+        zwi.debug(1, f'{i=} {p["worldId"]=} {p["playerCount"]=}')
+        if lines % 20 == 0:
+            print('world players friends', end='')
+            for j in range(1, 1+len(maps.keys())):
+                print(f' {j:7d}', end='')
                 pass
-            else:
-                print(f'{i=}: no world')
+            print('')
+            pass
+        print(f'{i:5d} {p["playerCount"]:7d} {friends:7d}', end='')
+        key = list(maps.keys())
+        key.sort()
+        for k in key:
+            # print(f' {k}:{maps[k]}', end='')
+            print(f' {maps[k]:7d}', end='')
+            pass
+        print()
+        lines += 1
+
+        if zwi.verbosity:
+            for f in p['friendsInWorld']:
+                buddy = (f['followerStatusOfLoggedInPlayer']
+                         != 'NO_RELATIONSHIP')
+                if buddy:
+                    print(f'{f["firstName"]} {f["lastName"]}')
+                    pass
                 pass
             pass
-        if poll:
-            time.sleep(sleep)
-            continue
-        else:
-            return 0
         pass
-    pass
+
+    for (w, (n, fails, lat)) in poller.stats().items():
+        zwi.verbo(1, f'world {w}: {n} polls, {fails} failed,'
+                  f' {lat * 1000:.0f}ms mean latency')
+        pass
+    if tracker is not None:
+        zwi.verbo(1, f'{tracker.fetches} profiles fetched for presence')
+        pass
+    return 0
+
+
+@click.option('--by', type=click.Choice(list(zwi.ROLLUPS)), default='hour',
+              show_default=True, help='rollup to show')
+@click.option('--since', help='start date[Ttime]')
+@click.option('--until', help='end date[Ttime]')
+@click.option('--world', type=int, help='restrict to this world')
+@click.option('--map', 'mapid', type=int, default=0, show_default=True,
+              help='map ID (0 for the whole world, -1 for each map)')
+@cli.command()
+def worlds_history(by, since, until, world, mapid):
+    """Show the riders in the worlds over time, as recorded by `worlds`."""
+    series = zwi.ZwiSeries()
+    rows = series.query(by=by, since=since, until=until, world=world,
+                        map=None if mapid < 0 else mapid)
+    if rows:
+        print(f'{"from":16s} world   map samples   riders    min    max'
+              f'  friends    max')
+        pass
+    for (b, w, m, n, p, pmin, pmax, f, fmax) in rows:
+        when = datetime.fromtimestamp(b).isoformat(timespec='minutes')
+        print(f'{when:16s} {w:5d} {m:5d} {n:7d} {p:8.1f} {pmin:6d} {pmax:6d}'
+              f' {f:8.1f} {fmax:6d}')
+        pass
+    return 0
+
+
+@click.option('--zid', type=int, help='restrict to this Zwift ID')
+@click.option('--since', help='start date[Ttime]')
+@click.option('--until', help='end date[Ttime]')
+@cli.command()
+def presence(zid, since, until):
+    """Show who is riding, as tracked by `worlds --presence`, or (given
+    a date or ID) their sessions."""
+    tracker = zwi.ZwiPresence()
+    rows = tracker.sessions(zid=zid, since=since, until=until)
+    if zid is None and since is None and until is None:
+        rows = [r for r in rows if r[6]]
+        pass
+    for (i, start, end, w, m, name, live) in rows:
+        (t0, t1) = (datetime.fromtimestamp(t).isoformat(timespec='minutes')
+                    for t in (start, end))
+        print(f'{i:9d} {name:30.30s} {w:5d} {m:5d} {t0} - '
+              f'{"now" if live else t1} ({(end - start) // 60} min)')
+        pass
+    return 0
 
 
 def keyboardInterruptHandler(sig, frame):
@@ -3,11 +3,13 @@
 # Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
 """Bokeh-based interface to ZwiPro profile data."""
 
+import os
 import sys
 import signal
 import functools
 import zwi
-from zwi import ZwiPro, debug, debug_p
+from zwi import ZwiPro, debug, debug_p, get_zdir
+from zwi.asset_cache import thumb_path
 
 server = None
 
@@ -21,6 +23,7 @@ try:
     from bokeh.models import Button, Toggle, HoverTool
     from bokeh.plotting import figure
     from bokeh.server.server import Server
+    from tornado.web import StaticFileHandler
 except Exception as e:
     print('import error', e)
     raise SystemExit('use `pip3 install` to install missing modules.')
@@ -68,6 +71,20 @@ def map_none(x):
     pass
 
 
+THUMB_SIZE = 128    # tooltip image size
+THUMB_URL = '/thumbs/'
+
+
+def map_thumb(x, icache):
+    """Use the local pre-scaled thumbnail for the image, if we have one."""
+    if x is None or x == 'None':
+        return NONE
+    fna = thumb_path(icache + x.split('/')[-1], THUMB_SIZE)
+    if os.path.isfile(fna):
+        return THUMB_URL + os.path.relpath(fna, icache)
+    return x
+
+
 COL_WIDTH = 200
 ROW_HEIGHT = 48
 CIRCLE_ALPHA = 0.7
@@ -161,7 +178,8 @@ class ZwiBok(object):
         df['ftp'] = df['ftp'].apply(lambda x: minmax(x, 0, 2000))
         df['weight'] = df['weight'].apply(lambda x: int(x) // 1000)
         df['height'] = df['height'].apply(lambda x: int(x) // 10)
-        df['imageSrc'] = df['imageSrc'].apply(lambda x: map_none(x))
+        icache = get_zdir('.image-cache')
+        df['imageSrc'] = df['imageSrc'].apply(lambda x: map_thumb(x, icache))
         df['achievementLevel'] = df['achievementLevel'].apply(
             lambda x: int(x) // 100)
         df['totalDistance'] = df['totalDistance'].apply(
@@ -623,9 +641,13 @@ def keyboardInterruptHandler(sig, frame):
 
 @click.option('-v', '--verbose', count=True)
 @click.option('-d', '--debug', count=True)
+@click.option('--db-profile', type=click.Choice(list(zwi.DB_PROFILES)),
+              default=zwi.DataBase.profile, show_default=True,
+              help='SQLite tuning profile')
 @click.group()
-def cli(verbose, debug):
+def cli(verbose, debug, db_profile):
     zwi.setup(verbose, debug)
+    zwi.DataBase.set_profile(db_profile)
     pass
 
 
@@ -638,7 +660,9 @@ def serve(port):
 
     server = Server({
         '/zwibok': zwibok,
-    }, num_procs=1, port=port)
+    }, num_procs=1, port=port,
+        extra_patterns=[(THUMB_URL + '(.*)', StaticFileHandler,
+                         {'path': get_zdir('.image-cache')})])
     server.start()
 
     print(f'Opening ZwiBok application on http://localhost:{port}/')
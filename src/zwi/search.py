@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""In-memory name/country/player type search index."""
+
+
+class SearchIndex(object):
+    """Index Zwift users by name, country and player type.
+
+    Names are indexed by trigram for substring matching, and by the one
+    and two character prefixes of each word for short queries.
+    Entries are keyed by Zwift ID, and can be added, replaced or removed
+    one at a time, so the index can be kept current as the DB changes.
+    """
+
+    def __init__(self):
+        self._entries = {}  # zid => (name, country, ptype)
+        self._grams = {}    # trigram => {zid}
+        self._prefix = {}   # word prefix => {zid}
+        self._country = {}  # countryAlpha3 => {zid}
+        self._ptype = {}    # playerType => {zid}
+        pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, zid):
+        return zid in self._entries
+
+    @staticmethod
+    def _keys(name):
+        """Enumerate the trigram and prefix keys for a name."""
+        grams = set()
+        prefix = set()
+        for word in name.split():
+            prefix.add(word[:1])
+            prefix.add(word[:2])
+            pass
+        for i in range(len(name) - 2):
+            grams.add(name[i:i+3])
+            pass
+        return grams, prefix
+
+    @staticmethod
+    def _put(index, key, zid):
+        s = index.get(key)
+        if s is None:
+            index[key] = s = set()
+            pass
+        s.add(zid)
+        pass
+
+    @staticmethod
+    def _drop(index, key, zid):
+        s = index.get(key)
+        if s is not None:
+            s.discard(zid)
+            if not s:
+                del index[key]
+                pass
+            pass
+        pass
+
+    def add(self, zid, firstName, lastName, country='', ptype=''):
+        """Add (or replace) the entry for `zid`."""
+        name = f'{firstName} {lastName}'.lower()
+        entry = (name, f'{country}'.upper(), f'{ptype}'.upper())
+        old = self._entries.get(zid)
+        if old == entry:
+            return
+        if old is not None:
+            self.remove(zid)
+            pass
+
+        self._entries[zid] = entry
+        grams, prefix = self._keys(name)
+        for g in grams:
+            self._put(self._grams, g, zid)
+            pass
+        for p in prefix:
+            self._put(self._prefix, p, zid)
+            pass
+        self._put(self._country, entry[1], zid)
+        self._put(self._ptype, entry[2], zid)
+        pass
+
+    def remove(self, zid):
+        """Remove the entry for `zid`, if any."""
+        old = self._entries.pop(zid, None)
+        if old is None:
+            return
+        grams, prefix = self._keys(old[0])
+        for g in grams:
+            self._drop(self._grams, g, zid)
+            pass
+        for p in prefix:
+            self._drop(self._prefix, p, zid)
+            pass
+        self._drop(self._country, old[1], zid)
+        self._drop(self._ptype, old[2], zid)
+        pass
+
+    def query(self, q, limit=None):
+        """Search using a query string.
+        Words of the form `country:GBR` or `type:CYCLIST` restrict the
+        search to that country or player type; other words match names.
+        """
+        words = []
+        country = ptype = None
+        for w in q.split():
+            k, _, v = w.partition(':')
+            if v and k.lower() == 'country':
+                country = v
+            elif v and k.lower() == 'type':
+                ptype = v
+            else:
+                words.append(w)
+                pass
+            pass
+        return self.search(' '.join(words), country=country, ptype=ptype,
+                           limit=limit)
+
+    def _word(self, word):
+        """Candidate set for one word of the query."""
+        if len(word) < 3:
+            return self._prefix.get(word, set())
+        sets = []
+        for i in range(len(word) - 2):
+            s = self._grams.get(word[i:i+3])
+            if not s:
+                return set()
+            sets.append(s)
+            pass
+        sets.sort(key=len)
+        return set.intersection(*sets)
+
+    def search(self, text='', country=None, ptype=None, limit=None):
+        """Return the list of Zwift IDs matching all of the given terms.
+        Each word of `text` must occur in the name: words of one or two
+        characters must start a name word, longer ones may occur anywhere.
+        """
+        sets = []
+        words = text.lower().split()
+        for w in words:
+            s = self._word(w)
+            if not s:
+                return []
+            sets.append(s)
+            pass
+        if country:
+            sets.append(self._country.get(country.upper(), set()))
+            pass
+        if ptype:
+            sets.append(self._ptype.get(ptype.upper(), set()))
+            pass
+        if not sets:
+            hits = self._entries.keys()
+        else:
+            sets.sort(key=len)
+            hits = set.intersection(*sets)
+            pass
+
+        rv = []
+        for zid in hits:
+            # trigrams can match across word boundaries: verify
+            name = self._entries[zid][0]
+            if all(w in name for w in words if len(w) >= 3):
+                rv.append(zid)
+                if limit is not None and len(rv) >= limit:
+                    break
+                pass
+            pass
+        return rv
+
+    pass
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""Workers sharded by Zwift ID, feeding a single writer."""
+
+import time
+import queue
+import signal
+import threading
+
+from .util import Log
+from .core import ZwiArchive, ZwiProfile, fetch_profile, zwi_init
+
+_shard_log = Log('shard')   # the workers
+
+
+def _spawn():
+    """The multiprocessing context, imported on first use.  Worker
+    processes are spawned, not forked: they must not inherit our sqlite3
+    connections (or threads)."""
+    import multiprocessing
+    return multiprocessing.get_context('spawn')
+
+
+class _Exhausted(Exception):
+    """The API budget ran out mid-task."""
+    pass
+
+
+class ApiBudget(object):
+    """Budget of Zwift API requests: at most `limit` in all (None for no
+    limit), and at most `rate` per second (None for no limit).
+    It is shared by the worker threads or processes.
+    """
+
+    def __init__(self, limit=None, rate=None):
+        self._limit = limit
+        self._interval = 1.0 / rate if rate else 0.0
+        self._mux = _spawn().Lock()
+        self._used = _spawn().RawValue('q', 0)
+        self._next = _spawn().RawValue('d', 0.0)
+        pass
+
+    @property
+    def used(self):
+        return self._used.value
+
+    def exhausted(self):
+        return self._limit is not None and self._used.value >= self._limit
+
+    def take(self):
+        """Take one request from the budget, waiting as the rate limit
+        requires.  Returns False if the budget is exhausted."""
+        with self._mux:
+            if self.exhausted():
+                return False
+            self._used.value += 1
+            now = time.monotonic()
+            delay = self._next.value - now
+            self._next.value = max(now, self._next.value) + self._interval
+            pass
+        if delay > 0:
+            time.sleep(delay)
+            pass
+        return True
+
+    pass
+
+
+def zwift_session():
+    """The usual worker session: `get(req)` via our Zwift login."""
+    _, pr = zwi_init()
+    return pr.request.json
+
+
+class Session(object):
+    """A worker's `get(req)`, charged to the ApiBudget."""
+
+    def __init__(self, raw, budget=None):
+        self.raw = raw
+        self._budget = budget
+        pass
+
+    def take(self):
+        """Charge one request, raising _Exhausted if we cannot."""
+        if self._budget is not None and not self._budget.take():
+            raise _Exhausted()
+        pass
+
+    def __call__(self, req):
+        self.take()
+        return self.raw(req)
+
+    pass
+
+
+def _worker(fun, get, inq, outq):
+    """Worker loop: run `fun(get, zid, arg)` for each task, until None."""
+    while True:
+        task = inq.get()
+        if task is None:
+            break
+        (zid, arg) = task
+        try:
+            outq.put((zid, fun(get, zid, arg), None))
+        except _Exhausted:
+            outq.put((zid, None, 'exhausted'))
+        except BaseException as e:
+            # fetch_profile() raises SystemExit, zwift a BaseException:
+            # whatever it was, the caller is waiting for an answer.
+            _shard_log.debug(1, '%s: %r', zid, e)
+            outq.put((zid, None, f'{e!r}'))
+            pass
+        pass
+    pass
+
+
+def _refuse(err, inq, outq):
+    """Worker loop, when we cannot work: fail each task, until None."""
+    while True:
+        task = inq.get()
+        if task is None:
+            break
+        outq.put((task[0], None, err))
+        pass
+    pass
+
+
+def _process(fun, session, budget, archive, inq, outq):
+    """Worker process: log in for ourselves, then run the worker loop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # the parent handles ^C
+    ZwiArchive.enabled = archive
+    try:
+        get = Session(session(), budget)
+    except BaseException as e:
+        _shard_log.debug(1, 'worker session: %r', e)
+        _refuse(f'{e!r}', inq, outq)
+        return
+    _worker(fun, get, inq, outq)
+    pass
+
+
+class ShardPool(object):
+    """Pool of `n` workers, worker `i` taking the tasks for the Zwift IDs
+    with `zid % n == i`.  Worker processes (if `processes`) each have
+    their own Zwift session (from `session()`), and run `fun` free of our
+    GIL; threads share ours.  `fun(get, zid, arg)` must be a module level
+    function, and its result picklable.  Results stream back to the
+    caller, who (alone) writes them to the DB.
+    Should a worker die, its tasks are failed (with error 'died').
+    """
+
+    POLL = 1.0  # seconds between checks that the workers live
+
+    def __init__(self, fun, n, budget=None, processes=False,
+                 session=zwift_session):
+        self._n = max(1, n)
+        self._pending = 0
+        self._busy = [[] for i in range(self._n)]   # zids, per worker
+        self._lost = []     # results of the tasks of dead workers
+        if processes:
+            self._inq = [_spawn().Queue() for i in range(self._n)]
+            self._outq = _spawn().Queue()
+            self._workers = [_spawn().Process(
+                target=_process, daemon=True,
+                args=(fun, session, budget, ZwiArchive.enabled, q,
+                      self._outq)) for q in self._inq]
+        else:
+            get = Session(session(), budget)
+            self._inq = [queue.Queue() for i in range(self._n)]
+            self._outq = queue.Queue()
+            self._workers = [threading.Thread(
+                target=_worker, daemon=True,
+                args=(fun, get, q, self._outq)) for q in self._inq]
+            pass
+        for w in self._workers:
+            w.start()
+            pass
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        pass
+
+    def __len__(self):
+        """The number of workers."""
+        return self._n
+
+    @property
+    def pending(self):
+        """The number of tasks submitted whose results are not yet got."""
+        return self._pending
+
+    def submit(self, zid, arg=None):
+        self._inq[zid % self._n].put((zid, arg))
+        self._busy[zid % self._n].append(zid)
+        self._pending += 1
+        pass
+
+    def _reap(self):
+        """Fail the tasks of any worker which has died."""
+        for (i, w) in enumerate(self._workers):
+            if self._busy[i] and not w.is_alive():
+                _shard_log.debug(1, 'worker %s died', i)
+                self._lost += [(z, None, 'died') for z in self._busy[i]]
+                self._busy[i] = []
+                pass
+            pass
+        pass
+
+    def get(self, block=True):
+        """Wait for the next result: (zid, result, error).  Unless
+        `block`, returns None if there is none ready."""
+        while True:
+            if self._lost:
+                self._pending -= 1
+                return self._lost.pop(0)
+            try:
+                rv = self._outq.get(block, self.POLL)
+            except queue.Empty:
+                self._reap()
+                if not block and not self._lost:
+                    return None
+                continue
+            busy = self._busy[rv[0] % self._n]
+            if rv[0] not in busy:
+                continue    # failed already
+            busy.remove(rv[0])
+            self._pending -= 1
+            return rv
+        pass
+
+    def close(self):
+        for q in self._inq:
+            q.put(None)
+            pass
+        for w in self._workers:
+            w.join()
+            pass
+        pass
+
+    pass
+
+
+def _refresh(get, zid, old):
+    """Worker: fetch profile `zid`, and compare it with ZwiProfile `old`.
+    Returns None if the fetch failed, False if unchanged, else the raw
+    profile."""
+    get.take()
+    rsp = fetch_profile(get.raw, zid)
+    if rsp is None:
+        return None
+    if ZwiProfile.from_zwift(rsp) == old:
+        return False
+    return rsp
+
+
+def refresh_sharded(pro, todo, n, budget=None, processes=True, batch=100,
+                    session=zwift_session):
+    """Refresh the ZwiProfiles `todo` of ZwiPro `pro`, fetching and
+    comparing them across `n` workers, and writing the changes here, up
+    to `batch` results at a time.  No transaction is held open while
+    the caller has the results.
+    Generates (old, new) per profile, as for ZwiPro.refresh(): new being
+    None if Zwift has no such profile, and `old` itself if unchanged.
+    Profiles a worker could not fetch (say, the network failed) are
+    skipped, as not refreshed.
+    """
+    todo = iter(todo)
+    old = {}
+    count = 0
+    with ShardPool(_refresh, n, budget=budget, processes=processes,
+                   session=session) as pool:
+        while True:
+            # keep each worker busy, but not too far ahead of us
+            while pool.pending < 4 * len(pool):
+                if budget is not None and budget.exhausted():
+                    break
+                p = next(todo, None)
+                if p is None:
+                    break
+                old[p.id] = p
+                pool.submit(p.id, p)
+                pass
+            if not pool.pending:
+                break
+            got = [pool.get()]
+            while len(got) < batch:
+                rv = pool.get(block=False)
+                if rv is None:
+                    break
+                got.append(rv)
+                pass
+            out = []
+            with pro.db.batch():
+                for (zid, rsp, err) in got:
+                    p = old.pop(zid)
+                    if err is not None:
+                        continue    # not refreshed, rather than failed
+                    if rsp is None:
+                        out.append((p, None))
+                    elif rsp is False:
+                        out.append((p, p))
+                    else:
+                        out.append((p, pro.store(zid, rsp)))
+                        count += 1
+                        pass
+                    pass
+                pass
+            yield from out
+            pass
+        pass
+    _shard_log.verbo(2, 'refresh: %s written', count)
+    pass
@@ -4,6 +4,8 @@
 #
 """Some utility functions of dubious utility."""
 import sys
+import json
+import time
 
 verbosity = 0
 debug_lvl = 0
@@ -24,11 +26,100 @@ class Error(Exception):
     pass
 
 
-def setup(v, d):
-    """Pass in the verbosity and debug levels."""
+class Log(object):
+    """The messages of subsystem `name`, to stderr: `verbo()` by the
+    verbosity level, and `debug()` by the debug level, either of which
+    may be set for the subsystem alone (see `setup()`).
+    A message is formatted only if it is emitted: `msg % args`, or
+    `msg()` if it is callable.  `v` and `d` are the levels in effect, so
+    a disabled message costs a compare; hot paths may test `log.d`
+    themselves to skip even the call.
+    If `as_json`, each message is written as a line of JSON.
+    """
+
+    logs = {}       # name => Log
+    levels = {}     # name => {'v': verbosity, 'd': debug level}
+    as_json = False
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+        Log.logs[name] = self
+        pass
+
+    def reset(self):
+        """Pick up the levels in effect for us."""
+        lvls = Log.levels.get(self.name, {})
+        self.v = lvls.get('v', verbosity)
+        self.d = lvls.get('d', debug_lvl)
+        pass
+
+    def emit(self, kind, lvl, msg, args=(), end='\n'):
+        if callable(msg):
+            msg = msg()
+        elif args:
+            msg = msg % args
+            pass
+        if not Log.as_json:
+            sys.stderr.write(msg + end)
+            return
+        msg = msg.strip('\r\n')
+        if msg:
+            sys.stderr.write(json.dumps({
+                'ts': round(time.time(), 3), 'log': self.name,
+                'kind': kind, 'lvl': lvl, 'msg': msg}) + '\n')
+            pass
+        pass
+
+    def verbo_p(self, lvl):
+        return self.v >= lvl
+
+    def debug_p(self, lvl):
+        return self.d >= lvl
+
+    def verbo(self, lvl, msg, *args, end='\n'):
+        if self.v >= lvl:
+            self.emit('verbo', lvl, msg, args, end)
+            pass
+        pass
+
+    def debug(self, lvl, msg, *args, end='\n'):
+        if self.d >= lvl:
+            self.emit('debug', lvl, msg, args, end)
+            pass
+        pass
+
+    pass
+
+
+_log = Log('zwi')
+
+
+def log_levels(specs):
+    """Parse `specs`, each NAME=LEVEL (a debug level) or NAME=vLEVEL (a
+    verbosity level), into the levels for `setup()`."""
+    levels = {}
+    for spec in specs:
+        (name, _, lvl) = spec.partition('=')
+        kind = 'v' if lvl.startswith('v') else 'd'
+        try:
+            levels.setdefault(name, {})[kind] = int(lvl.lstrip('v'))
+        except ValueError:
+            raise SystemExit(f'Bad log level: {spec}')
+        pass
+    return levels
+
+def setup(v, d, levels=None, as_json=False):
+    """Pass in the verbosity and debug levels, those of any subsystems
+    (see `log_levels()`), and whether to log as JSON."""
     global verbosity, debug_lvl
     verbosity = v
     debug_lvl = d
+    Log.levels = dict(levels or {})
+    Log.as_json = as_json
+    for log in Log.logs.values():
+        log.reset()
+        pass
     return
 
 def verbo_p(lvl):
@@ -42,13 +133,13 @@ def debug_p(lvl):
 def verbo(lvl, msg, end='\n'):
     """Emit a message to stderr based on verbosity level."""
     if verbo_p(lvl):
-        sys.stderr.write(msg + end)
+        _log.emit('verbo', lvl, msg, end=end)
     return
 
 def debug(lvl, msg, end='\n'):
     """Emit a message to stderr based on debug level."""
     if debug_p(lvl):
-        sys.stderr.write(msg + end)
+        _log.emit('debug', lvl, msg, end=end)
     return
 
 def error(data):
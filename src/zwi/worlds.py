@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""Zwift worlds: polling, and occupancy time series."""
+
+import time
+import heapq
+import random
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .util import Log
+from .core import DataBase, _import, get_zpath, zwi_init
+
+_worlds_log = Log('worlds')  # polling of the worlds
+
+# the worlds known (those of zwift.world.COURSE_TO_WORLD)
+WORLDS = (1, 2, 3)
+
+# rollup resolutions, in seconds
+ROLLUPS = {
+    '5m': 5*60,
+    'hour': 60*60,
+    'day': 24*60*60,
+}
+
+
+def _epoch(when):
+    """Seconds since the epoch of `when`: an ISO date[Ttime], or seconds."""
+    if when is None or isinstance(when, (int, float)):
+        return when
+    try:
+        return int(datetime.fromisoformat(when).timestamp())
+    except ValueError:
+        raise SystemExit(f'Cannot parse date: {when}')
+    pass
+
+
+class ZwiSeries(object):
+    """Time series of the riders in each world, as polled by `worlds`.
+    The `sample` table holds each poll: per (ts, world, map), the riders
+    seen and how many of those are friends, map 0 being the whole world
+    (by its playerCount).  The `rollup` table holds, per resolution in
+    ROLLUPS, the number of samples, the sum, min and max of the riders,
+    and the sum and max of the friends, in each bucket.  The rollups are
+    updated as each sample is recorded, so range queries read only them.
+    Samples older than KEEP days are dropped; the rollups are kept.
+    Buckets start at multiples of their resolution since the epoch (so
+    days are UTC days).
+    """
+
+    SAMPLE = [
+        'ts INT',
+        'world INT',
+        'map INT',
+        'players INT',
+        'friends INT',
+        'PRIMARY KEY (ts, world, map)',
+    ]
+
+    ROLLUP = [
+        'res INT',
+        'bucket INT',
+        'world INT',
+        'map INT',
+        'n INT',
+        'players INT',
+        'pmin INT',
+        'pmax INT',
+        'friends INT',
+        'fmax INT',
+        'PRIMARY KEY (res, world, map, bucket)',
+    ]
+
+    KEEP = 14   # days of samples retained
+
+    def __init__(self, db=None, create=False):
+        self._db = db
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='worlds.db'),
+                                           create=create)
+            pass
+        self._db.create_table('sample', self.SAMPLE)
+        self._db.create_table('rollup', self.ROLLUP)
+        self._db.commit()
+        self._day = None
+        pass
+
+    @property
+    def db(self):
+        return self._db
+
+    def record(self, world, players, friends, maps={}, ts=None):
+        """Record a poll of `world`, at `ts` (default now): `players` and
+        `friends` in all, and `maps` {mapId: (players, friends)}."""
+        ts = int(time.time()) if ts is None else int(ts)
+        rows = [(world, 0, players, friends)] + [
+            (world, m, p, f) for (m, (p, f)) in sorted(maps.items())]
+        with self._db.lock:
+            for (w, m, p, f) in rows:
+                cur = self._db.execute('INSERT OR IGNORE INTO sample'
+                                       ' (ts, world, map, players, friends)'
+                                       ' VALUES (?, ?, ?, ?, ?)',
+                                       (ts, w, m, p, f))
+                if cur.rowcount != 1:
+                    continue    # already recorded
+                self._db.executemany(
+                    'INSERT INTO rollup (res, bucket, world, map, n, players,'
+                    ' pmin, pmax, friends, fmax)'
+                    ' VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)'
+                    ' ON CONFLICT (res, world, map, bucket) DO UPDATE SET'
+                    ' n = n + 1, players = players + excluded.players,'
+                    ' pmin = MIN(pmin, excluded.pmin),'
+                    ' pmax = MAX(pmax, excluded.pmax),'
+                    ' friends = friends + excluded.friends,'
+                    ' fmax = MAX(fmax, excluded.fmax)',
+                    [(res, ts - ts % res, w, m, p, p, p, f, f)
+                     for res in ROLLUPS.values()])
+                pass
+            day = ts // ROLLUPS['day']
+            if day != self._day:
+                self._day = day
+                self._db.execute('DELETE FROM sample WHERE ts < ?',
+                                 (ts - self.KEEP * ROLLUPS['day'],))
+                pass
+            self._db.commit()
+            pass
+        pass
+
+    def query(self, by='hour', since=None, until=None, world=None, map=0):
+        """The rollups `by` ('5m', 'hour' or 'day') from `since` until
+        `until` (ISO dates, or seconds since the epoch), of `world` (or
+        all) and `map` (0 for the whole world, None for all).
+        Returns a list of (bucket, world, map, samples, mean riders, min,
+        max, mean friends, max friends)."""
+        if by not in ROLLUPS:
+            raise SystemExit(f'Unknown rollup: {by}')
+        terms = ['res = ?']
+        args = [ROLLUPS[by]]
+        for (t, v) in (('bucket >= ?', _epoch(since)),
+                       ('bucket < ?', _epoch(until)),
+                       ('world = ?', world), ('map = ?', map)):
+            if v is not None:
+                terms.append(t)
+                args.append(v)
+                pass
+            pass
+        return [(b, w, m, n, p / n, pmin, pmax, f / n, fmax)
+                for (b, w, m, n, p, pmin, pmax, f, fmax) in self._db.read(
+                    'SELECT bucket, world, map, n, players, pmin, pmax,'
+                    ' friends, fmax FROM rollup WHERE '
+                    + ' AND '.join(terms) + ' ORDER BY bucket, world, map',
+                    args).fetchall()]
+
+    pass
+
+
+class WorldPoller(object):
+    """Poll each of `worlds` every `interval` seconds, concurrently.
+    Each poll is scheduled a random `jitter` (a fraction of the interval)
+    early or late, so that the polls spread out rather than go in bursts.
+    A world whose poll fails is retried after a backoff, doubling from
+    BACKOFF up to the interval.  The Zwift session is kept throughout:
+    should Zwift refuse our access token, it is refreshed (see ZwiToken),
+    rather than logging in again.
+    `get(req)` is that of our Zwift session, unless given.
+    """
+
+    BACKOFF = 5     # seconds before the first retry
+
+    def __init__(self, worlds=WORLDS, interval=300, jitter=0.1, get=None):
+        self._worlds = list(worlds)
+        self._interval = interval
+        self._jitter = jitter
+        self._token = None
+        if get is None:
+            (cl, pr) = zwi_init()
+            (get, self._token) = (pr.request.json, cl.auth_token)
+            pass
+        self._get = get
+        self._backoff = dict((w, 0) for w in self._worlds)
+        self._stats = dict((w, [0, 0, 0.0]) for w in self._worlds)
+        pass
+
+    @property
+    def worlds(self):
+        return self._worlds
+
+    def stats(self):
+        """{world: (polls, failures, mean latency)}"""
+        return dict((w, (n, f, t / n if n else 0.0))
+                    for (w, (n, f, t)) in self._stats.items())
+
+    def _fetch(self, world):
+        """Poll `world`: (world, response or None, error, latency)."""
+        error = _import('zwift.error')
+        t0 = time.monotonic()
+        try:
+            (rsp, err) = (self._get(f'/relay/worlds/{world}'), None)
+        except (Exception, error.RequestException) as e:
+            (rsp, err) = (None, e)
+            pass
+        return world, rsp, err, time.monotonic() - t0
+
+    def _delay(self, world, err):
+        """Seconds until we next poll `world`."""
+        if err is None:
+            self._backoff[world] = 0
+            return self._interval * (1 + random.uniform(-self._jitter,
+                                                        self._jitter))
+        b = min(self._interval, max(self.BACKOFF, 2 * self._backoff[world]))
+        self._backoff[world] = b
+        _worlds_log.verbo(1, 'world %s: retry in %ss', world, b)
+        return b * (1 + random.uniform(0, self._jitter))
+
+    def polls(self, once=False):
+        """Generate (world, response or None, latency) as each poll
+        completes, forever (or, if `once`, once per world)."""
+        now = time.monotonic()
+        due = [(now, w) for w in self._worlds]
+        pending = set()
+        with ThreadPoolExecutor(len(self._worlds)) as pool:
+            while due or pending:
+                now = time.monotonic()
+                while due and due[0][0] <= now:
+                    (_, w) = heapq.heappop(due)
+                    pending.add(pool.submit(self._fetch, w))
+                    pass
+                timeout = max(0.0, due[0][0] - now) if due else None
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+                (done, pending) = wait(pending, timeout=timeout,
+                                       return_when=FIRST_COMPLETED)
+                for fut in done:
+                    (w, rsp, err, lat) = fut.result()
+                    st = self._stats[w]
+                    st[0] += 1
+                    st[1] += err is not None
+                    st[2] += lat
+                    _worlds_log.verbo(2, 'world %s: %.0fms', w, lat * 1000)
+                    if err is not None:
+                        _worlds_log.verbo(1, 'world %s: %r', w, err)
+                        if '401' in f'{err}' and self._token is not None:
+                            self._token.expire()
+                            pass
+                        pass
+                    if not once:
+                        heapq.heappush(due, (time.monotonic() +
+                                             self._delay(w, err), w))
+                        pass
+                    yield w, rsp, lat
+                    pass
+                pass
+            pass
+        pass
+
+    pass
+
+
+class ZwiPresence(object):
+    """Who is riding now, and when they rode: the riding sessions of
+    those we follow, from the `friendsInWorld` of each world polled by
+    WorldPoller, so that watching all of them costs a request per world
+    rather than one per rider.
+    A rider seen in a world is online, from when first seen until last
+    seen there.  When a rider last seen in a world is missing from its
+    next poll, we `fetch(zid)` their profile (at most MAX_FETCH per poll)
+    to see if they are still riding (the feed may not list everyone);
+    without an answer, they are offline once unseen for GRACE seconds.
+    The `session` table holds each (id, start, end, world, map, name),
+    the world and map being where the rider was first seen, and `open`
+    set while the rider is online.  Callbacks `subscribe()`d are told
+    `fun(zid, online, ts)` as riders come and go.
+    """
+
+    COLS = [
+        'id INT',
+        'start INT',
+        'end INT',
+        'world INT',
+        'map INT',
+        'name TEXT',
+        'open INT',
+        'PRIMARY KEY (id, start)',
+    ]
+
+    INDEXES = [
+        ['open'],
+        ['start'],
+    ]
+
+    GRACE = 600     # seconds unseen before a rider is offline
+    MAX_FETCH = 10  # profile fetches per poll
+
+    def __init__(self, db=None, create=False, fetch=None):
+        self._db = db
+        if self._db is None:  # attach to the usual DB
+            self._db = DataBase.db_connect(get_zpath(fname='worlds.db'),
+                                           create=create)
+            pass
+        self._db.create_table('session', self.COLS)
+        for cols in self.INDEXES:
+            self._db.create_index('session', cols)
+            pass
+        self._db.commit()
+        self._fetch = fetch
+        self._subs = []
+        self.fetches = 0
+        self.names = {}
+        self._online = {}   # zid => [start, last seen, world, map]
+        for (zid, start, end, world, mapid) in self._db.read(
+                'SELECT id, start, end, world, map FROM session'
+                ' WHERE open = 1').fetchall():
+            self._online[zid] = [start, end, world, mapid]
+            pass
+        pass
+
+    @property
+    def db(self):
+        return self._db
+
+    def subscribe(self, fun):
+        """Call `fun(zid, online, ts)` as riders come and go."""
+        self._subs.append(fun)
+        pass
+
+    def _notify(self, zid, online, ts):
+        for fun in self._subs:
+            fun(zid, online, ts)
+            pass
+        pass
+
+    def _close(self, zid):
+        (start, last, world, mapid) = self._online.pop(zid)
+        self._db.execute('UPDATE session SET end = ?, open = 0'
+                         ' WHERE id = ? AND start = ?', (last, zid, start))
+        self._notify(zid, False, last)
+        pass
+
+    def _riding(self, zid):
+        """Does the profile of `zid` say they are riding (None if we
+        could not tell)?"""
+        self.fetches += 1
+        try:
+            rsp = self._fetch(zid)
+        except (Exception, SystemExit) as e:
+            # fetch_profile() exits on network errors: we poll on
+            _worlds_log.verbo(1, 'presence of %s: %s', zid, e)
+            return None
+        if rsp is None:
+            return None
+        return bool(rsp.get('riding') or rsp.get('likelyInGame'))
+
+    def observe(self, world, friends, ts=None):
+        """Note the `friends` (its `friendsInWorld`) of a poll of `world`
+        at `ts` (default now)."""
+        ts = int(time.time()) if ts is None else int(ts)
+        seen = dict((f['playerId'], f) for f in friends
+                    if f['followerStatusOfLoggedInPlayer'] != 'NO_RELATIONSHIP')
+        # those last seen here, but not now: ask their profiles (before
+        # we take the DB lock)
+        missing = dict((zid, None) for (zid, s) in self._online.items()
+                       if s[2] == world and zid not in seen)
+        if self._fetch is not None:
+            for zid in list(missing)[:self.MAX_FETCH]:
+                missing[zid] = self._riding(zid)
+                pass
+            pass
+        with self._db.lock:
+            for (zid, f) in seen.items():
+                self.names[zid] = f'{f["firstName"]} {f["lastName"]}'.strip()
+                s = self._online.get(zid)
+                if s is None:
+                    self._online[zid] = [ts, ts, world, f['mapId']]
+                    self._db.execute(
+                        'INSERT OR IGNORE INTO session (id, start, end, world,'
+                        ' map, name, open) VALUES (?, ?, ?, ?, ?, ?, 1)',
+                        (zid, ts, ts, world, f['mapId'], self.names[zid]))
+                    self._notify(zid, True, ts)
+                    continue
+                (s[1], s[2], s[3]) = (ts, world, f['mapId'])
+                pass
+            for (zid, riding) in missing.items():
+                s = self._online[zid]
+                if riding:
+                    s[1] = ts
+                elif riding is False or ts - s[1] > self.GRACE:
+                    self._close(zid)
+                    pass
+                pass
+            self._db.executemany('UPDATE session SET end = ?'
+                                 ' WHERE id = ? AND start = ?',
+                                 [(s[1], zid, s[0])
+                                  for (zid, s) in self._online.items()])
+            self._db.commit()
+            pass
+        pass
+
+    def expire(self, ts=None):
+        """Close the sessions of riders unseen for GRACE seconds at `ts`
+        (default now), as when we stopped polling for a while."""
+        ts = int(time.time()) if ts is None else int(ts)
+        with self._db.lock:
+            for zid in [z for (z, s) in self._online.items()
+                        if ts - s[1] > self.GRACE]:
+                self._close(zid)
+                pass
+            self._db.commit()
+            pass
+        pass
+
+    def online(self):
+        """{zid: (since, world, map)} of the riders online now."""
+        return dict((zid, (s[0], s[2], s[3]))
+                    for (zid, s) in self._online.items())
+
+    def sessions(self, zid=None, since=None, until=None, now=None):
+        """The sessions of `zid` (or all riders) overlapping `since` to
+        `until` (ISO dates, or seconds since the epoch), oldest first:
+        a list of (id, start, end, world, map, name, online).  A session
+        is `online` at `now` (default now) if it is open, and was seen in
+        the last GRACE seconds: the poller may have stopped."""
+        now = int(time.time()) if now is None else int(now)
+        terms = ['1']
+        args = [now - self.GRACE]
+        for (t, v) in (('id = ?', zid), ('end >= ?', _epoch(since)),
+                       ('start < ?', _epoch(until))):
+            if v is not None:
+                terms.append(t)
+                args.append(v)
+                pass
+            pass
+        return self._db.read('SELECT id, start, end, world, map, name,'
+                             ' open AND end >= ? FROM session WHERE '
+                             + ' AND '.join(terms) + ' ORDER BY start, id',
+                             args).fetchall()
+
+    pass
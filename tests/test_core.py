@@ -5,8 +5,11 @@
 """test zwi core"""
 
 import os
+import sqlite3
+import time
 import zwi
 import pytest
+import threading
 
 def test_zdir(home):
     assert os.environ['HOME'] == home
@@ -74,9 +77,704 @@ def test_db2(home):
     # ... more needed here?
     pass
 
+def test_db_profile(home):
+    db = zwi.DataBase.db_connect(create=True)
+    assert db.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+    db.tune('bulk')
+    assert db.execute('PRAGMA synchronous;').fetchone()[0] == 0
+    db.tune('concurrent')
+    assert db.execute('PRAGMA synchronous;').fetchone()[0] == 1
+    with pytest.raises(SystemExit):
+        db.tune('bogus')
+        pass
+    pass
+
+def test_db_threads(home):
+    db = zwi.DataBase.db_connect(create=True)
+    db.create_table('test', ['c0 int primary key', 'c1'])
+    for i in range(10):
+        db.row_replace('test', ['c0', 'c1'], [f'{i}', f'{i*i}'])
+        pass
+    res = {}
+
+    def reader(n):
+        assert zwi.DataBase.db_connect() is db
+        res[n] = [r for r in db.table_rows('test', ['c0', 'c1'])()]
+        db.row_replace('test', ['c0', 'c1'], [f'{100+n}', f'{n}'])
+        pass
+
+    ths = [threading.Thread(target=reader, args=(n,)) for n in range(4)]
+    for t in ths:
+        t.start()
+        pass
+    for t in ths:
+        t.join()
+        pass
+    assert len(res) == 4
+    for rows in res.values():
+        assert rows[:10] == [(i, i*i) for i in range(10)]
+        pass
+    assert len(list(db.table_rows('test', ['c0'])())) == 14
+    pass
+
+def test_pro_query(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='query.db'),
+                                 create=True)
+    pro = zwi.ZwiPro(db=db)
+    for (i, c, f) in [(1, 'GBR', 250), (2, 'GBR', 350), (3, 'AUS', 400)]:
+        db.row_replace('profile', ['id', 'countryAlpha3', 'ftp'],
+                       [f'{i}', f"'{c}'", f'{f}'])
+        pass
+    q = pro.query(where=[pro.parse_pred('countryAlpha3=GBR')])
+    assert sorted(p.id for p in q) == [1, 2]
+    q = pro.query(where=[pro.parse_pred('ftp >= 300')], order=['-ftp'])
+    assert [p.id for p in q] == [3, 2]
+    q = pro.query(order=['ftp'], limit=1)
+    assert [p.id for p in q] == [1]
+    with pytest.raises(SystemExit):
+        pro.query(where=[('bogus', '=', 1)])
+        pass
+    for (i, n) in [(1, 'Cee'), (2, 'Ay'), (3, 'Bee')]:
+        db.row_replace('profile', ['id', 'firstName', 'lastName'],
+                       [f'{i}', "'x'", f"'{n}'"])
+        pass
+    # the first by name, not the first found
+    assert [p.id for p in zwi.ZwiPro(db=db).search(limit=2)] == [2, 3]
+    db.row_replace('profile', ['id'], ['4'])    # no name at all
+    assert [p.id for p in zwi.ZwiPro(db=db).search()] == [4, 2, 3, 1]
+    pass
+
+def test_history(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='hist.db'),
+                                 create=True)
+    h = zwi.ZwiHistory(db=db)
+
+    def pro(**kw):
+        p = zwi.ZwiProfile.from_seq(
+            [0 if c.endswith('INT') else ''
+             for c in zwi.ZwiProfile.column_names(create=True)])
+        for (k, v) in kw.items():
+            setattr(p, k, v)
+            pass
+        return p
+
+    p0 = pro(id=7, ftp=200, weight=70000, addDate='2021-01-01T00:00')
+    assert h.record(pro(id=7, ftp=250, weight=70000), p0,
+                    ts='2021-02-01T00:00:00') == {'ftp': 250}
+    assert h.record(pro(id=7, ftp=250, weight=70000),
+                    ts='2021-03-01T00:00:00') == {}
+    assert h.record(pro(id=7, ftp=260, weight=68000),
+                    ts='2021-04-01T00:00:00') == {'ftp': 260, 'weight': 68000}
+    assert len(h.changes(7)) == 3
+    assert h.as_of(7, '2020-12-01') is None
+    assert h.as_of(7, '2021-01-15').ftp == 200
+    assert h.as_of(7, '2021-03-15').ftp == 250
+    assert h.as_of(7).weight == 68000
+    assert [(ts[:7], v) for (i, ts, v) in h.series('ftp', zid=7)] == [
+        ('2021-01', 200), ('2021-02', 250), ('2021-04', 260)]
+    assert len(h.series('weight', since='2021-02')) == 1
+    pass
+
+def test_schedule(home):
+    from datetime import datetime, timedelta
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='sched.db'),
+                                 create=True)
+    zwi.ZwiPro(db=db)
+    now = datetime(2021, 6, 1)
+    for (i, age, riding) in [(1, 30, 0), (2, 3, 0), (3, 3, 1), (4, 10, 0),
+                             (5, 3, 0)]:
+        added = (now - timedelta(days=age)).isoformat(timespec='minutes')
+        db.row_replace('profile', ['id', 'addDate', 'riding'],
+                       [f'{i}', f"'{added}'", f'{riding}'])
+        pass
+    sched = zwi.ZwiSchedule(db=db)
+    # 3 is riding, 5 we follow: both hot, so due at 7/4 days
+    assert sched.due(hot={5}, now=now) == [3, 5, 1, 4]
+    assert sched.due(hot={5}, now=now, budget=2) == [3, 5]
+
+    sched.done(1, changed=False, now=now)
+    sched.done(4, changed=True, now=now)
+    later = now + timedelta(days=4)
+    assert sched.due(now=later) == [3, 4, 2, 5]
+    assert 1 not in sched.due(now=now + timedelta(days=13))
+    assert 1 in sched.due(now=now + timedelta(days=14))
+    sched.forget(1)
+    assert 1 in sched.due(now=now)
+
+    # 1 keeps failing: the others get their turn
+    assert sched.due(now=later, budget=2) == [3, 1]
+    sched.failed(1, now=later)
+    assert sched.due(now=later, budget=2) == [3, 4]
+    assert 1 in sched.due(now=later + timedelta(days=7))
+    pass
+
+def test_archive(home, monkeypatch):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='arc.db'),
+                                 create=True)
+    arc = zwi.ZwiArchive(db=db)
+    arc.put('/api/profiles/8', {'id': 8, 'firstName': 'Eight', 'ftp': 300},
+            ts='2021-01-01T00:00:00')
+    arc.put('/api/profiles/8', {'firstName': 'Eight', 'id': 8, 'ftp': 300},
+            ts='2021-02-01T00:00:00')
+    arc.put('/api/profiles/9', {'id': 9, 'firstName': 'Nine', 'xyzzy': 1})
+    assert arc.stats() == (3, 2, arc.stats()[2])
+    assert arc.get('/api/profiles/9')['xyzzy'] == 1
+
+    def ent(zid, name):
+        return {'followerId': zid, 'followeeId': 8, 'status': 'IS_FOLLOWING',
+                'followerProfile': {'firstName': name}}
+
+    pre = '/api/profiles/8/followers?start='
+    arc.put(pre + '0&limit=200', [ent(9, 'Nine'), ent(10, 'Ten')],
+            ts='2021-01-01T00:00:00')
+    arc.put(pre + '2&limit=200', [], ts='2021-01-01T00:00:00')
+    arc.put(pre + '0&limit=200', [ent(9, 'Nine')], ts='2021-02-01T00:00:00')
+    arc.put(pre + '1&limit=200', [], ts='2021-02-01T00:00:00')
+    assert arc.get(pre + '0&limit=200', '2021-01-15')[1]['followerId'] == 10
+    assert arc.stats()[1] == 2 + 2 + 3  # ent(9) and [] are held once
+    assert arc.owners() == [8]
+    assert [e[0] for e in arc.follows(8, 'followers')] == [9]
+    assert arc.follows(8, 'followees') is None
+
+    monkeypatch.setattr(zwi.ZwiArchive, 'CHUNK', 1)
+    pro = zwi.ZwiPro(db=db)
+    assert pro.rebuild(arc, workers=2) == 2
+    q = list(zwi.ZwiPro(db=db).query(order=['id']))
+    assert [(p.id, p.firstName, p.ftp) for p in q] == [
+        (8, 'Eight', 300), (9, 'Nine', 0)]
+    assert q[0].addDate == '2021-02-01T00:00'
+    pass
+
+def test_graph(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='graph.db'),
+                                 create=True)
+    zwi.ZwiPro(db=db)
+    g = zwi.ZwiGraph(db=db)
+    W, E = zwi.GRAPH_WERS, zwi.GRAPH_WEES
+    assert g.record(1, W, [(2, 'IS_FOLLOWING', 0, None),
+                           (3, 'IS_FOLLOWING', 0, None)]) == (2, 0)
+    assert g.record(1, E, [(2, 'IS_FOLLOWING', 1, None)]) == (1, 0)
+    assert g.record(4, E, [(1, 'IS_FOLLOWING', 0, None),
+                           (2, 'IS_FOLLOWING', 0, None)]) == (2, 0)
+    assert g.owners() == [1, 4]
+    assert sorted(g.followers(1)) == [2, 3, 4]
+    assert g.mutual(1) == [2]
+    assert g.common(1, 4) == [2]
+    assert sorted(g.followers(2)) == [1, 4]
+    assert g.record(1, W, [(2, 'IS_FOLLOWING', 0, None)]) == (0, 1)
+    assert sorted(g.followers(1)) == [2, 4]
+
+    db.row_replace('profile', ['id', 'firstName'], ['2', "'Two'"])
+    assert [r for r in g.profiles(1, W, ['id', 'firstName'])()] == [
+        (2, 'Two')]
+
+    # an old style per-user DB
+    old = zwi.DataBase.db_connect(path=zwi.get_zpath(subdir='5'),
+                                  create=True)
+    cn = zwi.ZwiFollowers.column_names
+    old.create_table('followers', cn(create=True, pk='followerId'))
+    old.create_table('followees', cn(create=True, pk='followeeId'))
+    for (a, name) in ((6, 'Six'), (2, 'Old')):
+        f = zwi.ZwiFollowers(followerId=a, followeeId=5,
+                             status='IS_FOLLOWING')
+        f.profile.firstName = name
+        old.row_insert('followers', cn(), f.column_values())
+        pass
+    old.close()
+    assert g.migrate(remove=True) == [5]
+    assert sorted(g.followers(5)) == [2, 6]
+    # the riders known only there are kept; those we know are not touched
+    pro = zwi.ZwiPro(db=db)
+    assert pro.lookup(6).firstName == 'Six'
+    assert pro.lookup(2).firstName == 'Two'
+    assert not os.path.isfile(zwi.get_zpath(subdir='5'))
+    pass
+
+class FakeRequest(object):
+    """Serve canned followers/followees lists."""
+    def __init__(self, lists):
+        self.lists = lists
+        pass
+
+    def json(self, req):
+        tab = req.split('?')[0].split('/')[-1]
+        start = int(req.split('start=')[1].split('&')[0])
+        return self.lists[tab][start:start+200]
+    pass
+
+class FakeProfile(object):
+    player_id = 1
+    pass
+
+def test_zu_edges(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='usr.db'),
+                                 create=True)
+    # an old style DB, with flat tables
+    cn = zwi.ZwiFollowers.column_names
+    db.create_table('followers', cn(create=True, pk='followerId'))
+    db.create_table('followees', cn(create=True, pk='followeeId'))
+    for (t, a, b) in (('followers', 2, 1), ('followers', 3, 1),
+                      ('followees', 1, 2)):
+        f = zwi.ZwiFollowers(followerId=a, followeeId=b, status='IS_FOLLOWING')
+        f.profile.firstName = f'rider{a+b-1}'
+        db.row_insert(t, cn(), f.column_values())
+        pass
+
+    usr = zwi.ZwiUser(db=db)
+    assert not db.table_exists('followers')
+    assert sorted(usr.wers_dict) == [2, 3]
+    assert list(usr.wees_dict) == [2]
+    fn = usr.cols.index('firstName')
+    assert usr.wers_dict[2][fn] == usr.wees_dict[2][fn] == 'rider2'
+    assert len(list(db.table_rows('fprofile', ['id'])())) == 2
+
+    def ent(sym, zid, name):
+        return {sym: zid, 'status': 'IS_FOLLOWING',
+                sym.replace('Id', 'Profile'): {'firstName': name}}
+
+    pdb = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='graph.db'),
+                                  create=True)
+    graph = zwi.ZwiGraph(db=pdb)
+    usr = zwi.ZwiUser(db=db, update=True, defer=True, graph=graph)
+    usr._pr = FakeProfile()
+    usr._uid = usr._pr.player_id
+    usr._pr.request = FakeRequest({
+        'followers': [ent('followerId', 2, 'Two'), ent('followerId', 4, 'Four')],
+        'followees': [ent('followeeId', 2, 'Two')]})
+    usr.load()
+    assert sorted(usr.wers_dict) == [2, 4]
+    assert usr.wers_dict[2][fn] == usr.wees_dict[2][fn] == 'Two'
+    assert usr.wers_dict[4][usr.cols.index('followeeId')] == 1
+    # our edges are in the shared graph too
+    assert sorted(graph.followers(1)) == [2, 4]
+    assert graph.followees(1) == [2]
+
+    # the lists were archived as fetched: rebuild from them
+    db.execute('DELETE FROM fprofile')
+    usr.rebuild(zwi.ZwiArchive())
+    usr = zwi.ZwiUser(db=db)
+    assert sorted(usr.wers_dict) == [2, 4]
+    assert usr.wees_dict[2][fn] == 'Two'
+
+    # drop an old style DB
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='old.db'),
+                                 create=True)
+    db.create_table('followers', cn(create=True, pk='followerId'))
+    db.create_table('followees', cn(create=True, pk='followeeId'))
+    usr = zwi.ZwiUser(db=db, drop=True)
+    assert not db.table_exists('followers')
+    assert usr.wers_dict == {} and usr.wees_dict == {}
+    pass
+
+class FakeGraph(object):
+    """Serve the lists and profiles of a little follower graph."""
+    wees = {1: [2, 3], 2: [4], 3: [1], 4: [5]}
+
+    def json(self, req):
+        parts = req.split('?')[0].split('/')
+        zid = int(parts[3])
+        if len(parts) == 4:
+            return {'id': zid, 'firstName': f'rider{zid}'}
+        if int(req.split('start=')[1].split('&')[0]) > 0:
+            return []
+        if parts[4] == 'followees':
+            return [{'followeeId': z, 'status': 'IS_FOLLOWING'}
+                    for z in self.wees.get(zid, [])]
+        return [{'followerId': a, 'status': 'IS_FOLLOWING'}
+                for (a, bs) in self.wees.items() if zid in bs]
+    pass
+
+def fake_session():
+    return FakeGraph().json
+
+def no_session():
+    raise SystemExit('cannot log in')
+
+def die(get, zid, arg):
+    os._exit(1)
+
+def test_crawl(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='crawl.db'),
+                                 create=True)
+    cr = zwi.ZwiCrawler(db=db)
+    cr.seed([1])
+    # 5 requests per user: 2 pages of each list, plus the profile
+    bud = zwi.ApiBudget(limit=10)
+    assert cr.run(max_depth=2, workers=1, budget=bud,
+                  session=fake_session) == 2
+    assert cr.stats() == (2, 2, 0)
+
+    # resume, in 2 processes
+    assert cr.run(max_depth=2, workers=2, processes=True,
+                  session=fake_session) == 2
+    assert cr.stats() == (0, 4, 0)     # 5 is too deep
+    g = zwi.ZwiGraph(db=db)
+    assert g.followers(4) == [2]
+    assert g.followees(1) == [2, 3]
+    assert zwi.ZwiPro(db=db).lookup(4).firstName == 'rider4'
+    pass
+
+def test_refresh_sharded(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='shard.db'),
+                                 create=True)
+    pro = zwi.ZwiPro(db=db)
+    for i in range(1, 6):
+        name = f'rider{i}' if i % 2 else f'old{i}'
+        pro.store(i, {'id': i, 'firstName': name})
+        pass
+    db.commit()
+    pro = zwi.ZwiPro(db=db)
+    todo = sorted(pro, key=lambda p: p.id)
+    res = {}
+    for (p, q) in zwi.refresh_sharded(pro, todo, 2, processes=False,
+                                      batch=2, session=fake_session):
+        assert db._batch == 0   # no transaction held while we have it
+        res[p.id] = q
+        pass
+    assert sorted(res) == [1, 2, 3, 4, 5]
+    assert [res[i].firstName for i in sorted(res)] == [
+        f'rider{i}' for i in range(1, 6)]
+    assert zwi.ZwiPro(db=db).lookup(4).firstName == 'rider4'
+
+    def down():
+        def get(req):
+            raise RuntimeError('network down')
+        return get
+
+    # not refreshed: neither failed (to be pruned), nor hung
+    assert list(zwi.refresh_sharded(pro, todo, 2, processes=False,
+                                    session=down)) == []
+    # nor when the workers cannot log in, or die
+    assert list(zwi.refresh_sharded(pro, todo, 2,
+                                    session=no_session)) == []
+    with zwi.ShardPool(die, 1, processes=True, session=fake_session) as pool:
+        pool.POLL = 0.1
+        pool.submit(7)
+        assert pool.get() == (7, None, 'died')
+        pass
+    pass
+
+def test_pipeline():
+    out = []
+    pipe = zwi.Pipeline([
+        zwi.Stage('split', lambda n: [n] * n, workers=3, many=True),
+        zwi.Stage('odd', lambda n: n if n % 2 else None, workers=2),
+        zwi.Stage('write', out.extend, batch=4),
+    ], qsize=2)
+    pipe.run(range(1, 6))
+    assert sorted(out) == [1, 3, 3, 3, 5, 5, 5, 5, 5]
+    assert [(s.name, s.items, s.out) for s in pipe.stats()] == [
+        ('source', 5, 5), ('split', 5, 15), ('odd', 15, 9), ('write', 9, 0)]
+
+    def fail(n):
+        if n == 3:
+            raise SystemExit('three')
+        return n
+
+    pipe = zwi.Pipeline([zwi.Stage('fail', fail, workers=2),
+                         zwi.Stage('write', out.append)], qsize=1)
+    with pytest.raises(SystemExit):
+        pipe.run(range(100))
+        pass
+    pass
+
+def test_update_all(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='all.db'),
+                                 create=True)
+    pro = zwi.ZwiPro(db=db)
+    pro._pr = FakeProfile()
+    pro._pr.request = FakeGraph()
+    pro.store(2, {'id': 2, 'firstName': 'old2'})
+    seen = []
+    pipe = pro.update_all([1, 2, 3, 1], report=lambda z, o, n: seen.append(z))
+    assert sorted(seen) == [1, 3]   # 2 is known, 1 asked for twice
+    seen = []
+    pipe = pro.update_all([1, 2, 3], force=True, stages={'fetch': 2},
+                          report=lambda z, o, n: seen.append((z, n.firstName)))
+    assert sorted(seen) == [(1, 'rider1'), (2, 'rider2'), (3, 'rider3')]
+    assert pipe.stats()[1].workers == 2
+    assert zwi.ZwiPro(db=db).lookup(2).firstName == 'rider2'
+    pass
+
+def test_token(home, monkeypatch):
+    grants = []
+
+    def fetch(self):
+        grants.append(self.refresh_token or self.password)
+        if self.refresh_token == 'revoked':
+            return {'error': 'invalid_grant'}
+        n = len(grants)
+        return {'access_token': f'a{n}', 'refresh_token': f'r{n}',
+                'expires_in': 300, 'refresh_expires_in': 1800}
+
+    monkeypatch.setattr(zwi.ZwiToken, 'fetch_token_data', fetch)
+    monkeypatch.setattr(zwi.core, 'auth_passwd', lambda name, key: 'pw')
+    monkeypatch.setattr(zwi.core, '_zwi_auth_cache', {})
+    zwi.ZwiToken.clear('test')
+    assert zwi.ZwiToken.load('test') is None
+
+    tok = zwi.ZwiToken('me@example.com', key='test')
+    assert tok.get_access_token() == 'a1'
+    assert grants == ['pw']     # from the keyring, as needed
+    assert zwi.ZwiToken.load('test') is None    # no player ID yet
+    tok.player_id = 42
+    tok.save()
+    assert os.stat(tok.path('test')).st_mode & 0o777 == 0o600
+
+    # a new run: no login
+    (cl, pr) = zwi.zwi_init(key='test')
+    assert pr.player_id == 42
+    assert cl.auth_token.get_access_token() == 'a1'
+    assert len(grants) == 1
+
+    # near expiry: refreshed, and the refresh cached
+    cl.auth_token.access_token_expiration = time.time() + 30
+    assert cl.auth_token.get_access_token() == 'a2'
+    assert grants[1] == 'r1'
+    assert zwi.ZwiToken.load('test').access_token == 'a2'
+
+    # refresh refused: log in again
+    cl.auth_token.access_token = None
+    cl.auth_token.refresh_token = 'revoked'
+    assert cl.auth_token.get_access_token() == 'a4'
+    assert grants[2:] == ['revoked', 'pw']
+
+    zwi.ZwiToken.clear('test')
+    assert zwi.ZwiToken.load('test') is None
+    pass
+
+def test_daemon(home):
+    zwi.ZwiUser(db=zwi.DataBase.db_connect(create=True))
+    zwi.ZwiPro(create=True).store(7, {'id': 7, 'firstName': 'Seven',
+                                      'lastName': 'Daemon'})
+    d = zwi.ZwiDaemon()
+    t = threading.Thread(target=d.serve)
+    t.start()
+    for i in range(100):
+        if zwi.daemon_running() is not None:
+            break
+        time.sleep(0.05)
+        pass
+    assert zwi.daemon_running() == os.getpid()
+    [p] = zwi.daemon_call('search', text='sev dae')
+    assert zwi.ZwiDaemon.profile(p).lastName == 'Daemon'
+    assert zwi.daemon_call('lookup', zid=7)['firstName'] == 'Seven'
+    assert zwi.daemon_call('lookup', zid=8) is None
+    rv = zwi.daemon_call('list', which='wers')
+    assert 'followerId' in rv['cols']
+    assert zwi.daemon_call('csv', which='wees').startswith('followerId,')
+    with pytest.raises(SystemExit):
+        zwi.daemon_call('frobnicate')
+        pass
+
+    # another process writes: we see it on the next read
+    with sqlite3.connect(zwi.get_zpath(fname='profile.db')) as db:
+        db.execute("INSERT INTO profile (id, firstName) VALUES (8, 'Eight')")
+        pass
+    assert zwi.daemon_call('lookup', zid=8)['firstName'] == 'Eight'
+    assert zwi.daemon_call('reload')[2] == 2
+
+    # a write which fails (as zwift's BaseExceptions do) leaves the writer
+    class Down(BaseException):
+        pass
+
+    def down(**args):
+        raise Down('network down')
+
+    (d.do_update, up) = (down, d.do_update)
+    with pytest.raises(SystemExit):
+        zwi.daemon_call('update')
+        pass
+    with pytest.raises(SystemExit):
+        zwi.daemon_call('update')
+        pass
+    d.do_update = up
+
+    # told not to use it, we still do not usurp it
+    zwi.ZwiDaemon.enabled = False
+    try:
+        assert zwi.daemon_running() == os.getpid()
+        with pytest.raises(SystemExit):
+            zwi.ZwiDaemon().serve()
+            pass
+    finally:
+        zwi.ZwiDaemon.enabled = True
+        pass
+    zwi.daemon_call('stop')
+    t.join()
+    assert zwi.daemon_running() is None
+    with pytest.raises(zwi.DaemonDown):
+        zwi.daemon_call('ping')
+        pass
+    pass
+
+def test_series(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='series.db'),
+                                 create=True)
+    ts = zwi.ZwiSeries(db=db)
+    t0 = 1622505600     # 2021-06-01T00:00Z
+    for (i, n) in enumerate([10, 20, 30, 40]):
+        ts.record(1, n, n // 10, {3: (n // 2, 1)}, ts=t0 + i * 120)
+        pass
+    ts.record(1, 99, 9, ts=t0 + 120)     # already recorded: ignored
+
+    # 0, 2 and 4 minutes in the first 5m, 6 in the second
+    assert [r[3:7] for r in ts.query(by='5m')] == [(3, 20.0, 10, 30),
+                                                   (1, 40.0, 40, 40)]
+    [r] = ts.query(by='day', since=t0, until=t0 + 86400)
+    assert r == (t0, 1, 0, 4, 25.0, 10, 40, 2.5, 4)
+    assert [r[2:] for r in ts.query(by='hour', map=3)] == [
+        (3, 4, 12.5, 5, 20, 1.0, 1)]
+    assert ts.query(by='hour', world=2) == []
+    assert ts.query(by='hour', since=t0 + 3600) == []
+    pass
+
+class FakeToken(object):
+    expired = 0
+
+    def expire(self):
+        self.expired += 1
+        pass
+    pass
+
+def test_poller():
+    import itertools
+    import zwift
+    fails = {2: 2}
+
+    def get(req):
+        w = int(req.split('/')[-1])
+        if fails.get(w):
+            fails[w] -= 1
+            raise zwift.error.RequestException('401 - Unauthorized')
+        return {'worldId': w, 'playerCount': 10 * w, 'friendsInWorld': []}
+
+    pol = zwi.WorldPoller(worlds=[1, 2], interval=0.05, jitter=0.5, get=get)
+    pol._token = FakeToken()
+    assert sorted(w for (w, r, t) in pol.polls(once=True)) == [1, 2]
+    assert fails[2] == 1    # not retried
+
+    pol.BACKOFF = 0.01
+    got = list(itertools.islice(pol.polls(), 8))
+    ok = [w for (w, r, t) in got if r is not None]
+    assert ok.count(1) >= 2 and ok.count(2) >= 2
+    assert pol._token.expired == 2
+    st = pol.stats()
+    assert st[2][1] == 2 and st[1][1] == 0
+    assert st[1][0] + st[2][0] == 10
+    pass
+
+def test_rowview():
+    rows = [('c', 1), ('a', 2), ('b', 3)]
+    v = zwi.RowView(rows)
+    assert list(v) == rows
+    assert v[-1] == ('b', 3)
+    v = zwi.RowView(rows, [1, 2, 0])
+    assert [r[0] for r in v] == ['a', 'b', 'c']
+    v = zwi.RowView(rows, [1, 2, 0], reverse=True)
+    assert [r[0] for r in v] == ['c', 'b', 'a']
+    assert len(v) == 3
+    with pytest.raises(IndexError):
+        v[3]
+        pass
+    rows.append(('d', 4))   # still loading: the permutation is short
+    assert len(v) == 3 and list(v) == [('c', 1), ('b', 3), ('a', 2)]
+    pass
+
 def test_zu0(home):
     u0 = zwi.ZwiUser()
     wers = zwi.ZwiFollowers()
     wees = zwi.ZwiFollowees()
     assert 0, wers
 
+
+def test_presence(home):
+    db = zwi.DataBase.db_connect(path=zwi.get_zpath(fname='presence.db'),
+                                 create=True)
+    riding = {}
+
+    def fetch(zid):
+        return {'riding': riding.get(zid, False)}
+
+    def friend(zid, mapid=1):
+        return {'playerId': zid, 'firstName': f'R{zid}', 'lastName': '',
+                'mapId': mapid,
+                'followerStatusOfLoggedInPlayer': 'IS_FOLLOWING'}
+
+    pre = zwi.ZwiPresence(db=db, fetch=fetch)
+    events = []
+    pre.subscribe(lambda zid, online, ts: events.append((zid, online, ts)))
+    t0 = 1622505600
+    stranger = dict(friend(9), followerStatusOfLoggedInPlayer='NO_RELATIONSHIP')
+    pre.observe(1, [friend(1), friend(2), stranger], ts=t0)
+    pre.observe(2, [friend(3)], ts=t0)
+    assert sorted(pre.online()) == [1, 2, 3]
+    assert pre.fetches == 0
+
+    riding[2] = True        # missing from the feed, but riding
+    pre.observe(1, [friend(1)], ts=t0 + 300)
+    pre.observe(2, [friend(1, 6)], ts=t0 + 310)    # 1 moved, 3 stopped
+    assert sorted(pre.online()) == [1, 2]
+    assert pre.fetches == 2
+    pre.observe(1, [], ts=t0 + 600)     # 1 was last seen in world 2
+    assert sorted(pre.online()) == [1, 2]
+
+    def down(zid):
+        raise SystemExit('network down')
+
+    pre._fetch = down       # no answers: offline after GRACE
+    pre.observe(2, [], ts=t0 + 910)
+    assert sorted(pre.online()) == [1, 2]
+    pre.observe(2, [], ts=t0 + 911)
+    assert sorted(pre.online()) == [2]
+    assert events == [(1, True, t0), (2, True, t0), (3, True, t0),
+                      (3, False, t0), (1, False, t0 + 310)]
+
+    # the open sessions survive a restart
+    pre = zwi.ZwiPresence(db=db)
+    pre.expire(ts=t0 + 700)
+    assert sorted(pre.online()) == [2]
+    assert [r[:3] + r[6:] for r in pre.sessions(now=t0 + 700)] == [
+        (1, t0, t0 + 310, 0), (2, t0, t0 + 600, 1), (3, t0, t0, 0)]
+    assert [r[0] for r in pre.sessions(since=t0 + 320)] == [2]
+    # unseen too long: not online, though the poller may yet close it
+    assert pre.sessions(zid=2, now=t0 + 1201)[0][6] == 0
+    pre.expire(ts=t0 + 1201)
+    assert pre.online() == {}
+    assert pre.sessions(zid=2)[0][2:] == (t0 + 600, 1, 1, 'R2', 0)
+    pass
+
+def test_log(capsys):
+    import json
+    calls = []
+
+    def msg():
+        calls.append(1)
+        return 'lazy'
+
+    log = zwi.Log('test')
+    try:
+        zwi.setup(0, 1, zwi.log_levels(['test=2', 'other=v3']))
+        assert (log.v, log.d) == (0, 2)
+        assert zwi.Log('other').v == 3
+        log.verbo(1, msg)
+        log.debug(3, msg)
+        assert calls == []
+        log.debug(2, msg)
+        log.debug(1, '%s=%d', 'n', 7)
+        zwi.debug(1, '100%')
+        assert capsys.readouterr().err == 'lazy\nn=7\n100%\n'
+
+        zwi.setup(1, 0, as_json=True)
+        log.verbo(1, '\rslurped %s: %d', 'profile', 3, end='')
+        log.debug(1, 'hidden')
+        [rec] = [json.loads(r) for r in capsys.readouterr().err.splitlines()]
+        assert rec['log'] == 'test' and rec['kind'] == 'verbo'
+        assert rec['msg'] == 'slurped profile: 3'
+        with pytest.raises(SystemExit):
+            zwi.log_levels(['db=x'])
+            pass
+    finally:
+        zwi.setup(0, 0)
+        pass
+    pass
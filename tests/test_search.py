@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""test zwi search index"""
+
+import zwi
+
+
+def test_search0():
+    idx = zwi.SearchIndex()
+    idx.add(1, 'Damon', 'Permezel', 'AUS', 'CYCLIST')
+    idx.add(2, 'Jane', 'Doe', 'GBR', 'RUNNER')
+    idx.add(3, 'Dam', 'Smith', 'GBR', 'CYCLIST')
+    assert len(idx) == 3
+    assert sorted(idx.search('dam')) == [1, 3]
+    assert sorted(idx.search('d')) == [1, 2, 3]
+    assert idx.search('mez') == [1]
+    assert idx.search('xyz') == []
+    assert sorted(idx.search(country='gbr')) == [2, 3]
+    assert idx.query('d type:runner') == [2]
+    assert idx.query('dam country:GBR') == [3]
+    pass
+
+
+def test_search1():
+    idx = zwi.SearchIndex()
+    idx.add(1, 'Damon', 'Permezel', 'AUS', 'CYCLIST')
+    idx.add(1, 'Bob', 'Smith', 'USA', 'CYCLIST')
+    assert idx.search('dam') == []
+    assert idx.search('bob') == [1]
+    assert idx.search(country='AUS') == []
+    idx.remove(1)
+    assert 1 not in idx
+    assert idx.search('bob') == []
+    pass
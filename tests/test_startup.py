@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2021 Damon Anton Permezel, all bugs revered.
+#
+"""test zwi CLI start up: what each subcommand imports, and how long"""
+
+import os
+import sys
+import subprocess
+import pytest
+from zwi.scripts.zwi import cli
+
+# modules only a command which talks to Zwift (or the GUI) should load
+HEAVY = ['zwift', 'requests', 'urllib3', 'keyring', 'multiprocessing',
+         'PyQt5', 'bokeh', 'pandas']
+
+# microseconds to import the CLI, with the byte code compiled
+BUDGET = 200000
+
+MAIN = 'from zwi.scripts.zwi import main; main()'
+
+
+def importtime(env, *args):
+    """Run the CLI under `-X importtime`: {module: cumulative usecs}."""
+    rv = subprocess.run([sys.executable, '-X', 'importtime', '-c', MAIN]
+                        + list(args), env=env, capture_output=True,
+                        text=True)
+    assert rv.returncode == 0, rv.stderr
+    times = {}
+    for line in rv.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            (_, cum, name) = line.split('|')
+            if cum.strip().isdigit():
+                times[name.strip()] = int(cum)
+                pass
+            pass
+        pass
+    return times
+
+
+@pytest.fixture(scope='module')
+def env(tmp_path_factory):
+    """Environment in which the byte code is cached (and warm)."""
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = str(tmp_path_factory.mktemp('pyc'))
+    importtime(env, '--help')
+    return env
+
+
+@pytest.mark.parametrize('cmd', sorted(cli.commands))
+def test_startup(env, cmd):
+    times = importtime(env, cmd, '--help')
+    heavy = [m for m in times if m.split('.')[0] in HEAVY]
+    assert heavy == []
+    assert times['zwi.scripts.zwi'] < BUDGET
+    pass